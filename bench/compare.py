@@ -0,0 +1,48 @@
+import sys, json, argparse
+
+# flags p95 regressions between two bench.run JSON reports; exits 1 when any metric got slower than allowed
+
+_KEYS = {"ws": ("concurrency",), "chat": ("concurrency",), "kb_search": ("index_size", "concurrency"), "ingest": ("concurrency",)}
+
+def _rows(report: dict):
+    for scenario, keys in _KEYS.items():
+        for r in report.get("results", {}).get(scenario, []):
+            key = (scenario,) + tuple(r.get(k) for k in keys)
+            for metric, v in r.items():
+                if isinstance(v, dict) and "p95_ms" in v:
+                    yield key + (metric,), v["p95_ms"]
+            if "qps" in r:
+                yield key + ("qps",), r["qps"]
+
+def compare(old: dict, new: dict, threshold: float):
+    before = dict(_rows(old))
+    out = []
+    for key, value in _rows(new):
+        if key not in before or before[key] in (None, 0) or value is None:
+            continue
+        prev = before[key]
+        # qps regresses downwards, latencies upwards
+        change = (prev - value) / prev if key[-1] == "qps" else (value - prev) / prev
+        out.append((key, prev, value, change, change > threshold))
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare two benchmark reports")
+    ap.add_argument("baseline")
+    ap.add_argument("candidate")
+    ap.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+    args = ap.parse_args()
+    with open(args.baseline, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        new = json.load(f)
+    rows = compare(old, new, args.threshold)
+    print(f"baseline {old.get('git', '?')} -> candidate {new.get('git', '?')}")
+    for key, prev, value, change, bad in rows:
+        name = "/".join(str(k) for k in key)
+        unit = "" if key[-1] == "qps" else " p95 ms"
+        print(f"{'REGRESSION' if bad else 'ok':10s} {name:60s} {prev:>10.2f} -> {value:>10.2f}{unit} ({change:+.1%} worse)")
+    sys.exit(1 if any(r[4] for r in rows) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os, sys, time, wave, hashlib, types
+import numpy as np
+
+# offline stand-ins for faster-whisper, pyttsx3 and sentence-transformers; install() before importing server.*
+
+def _hash_vec(text: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / (np.linalg.norm(v) + 1e-12)
+
+class _Segment:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeWhisperModel:
+    # decode cost = fixed latency + a share per second of audio, like a real model on a fixed device
+    def __init__(self, model_size: str = "base", device: str = "auto", compute_type: str = "int8"):
+        self.base_s = float(os.getenv("BENCH_ASR_MS", "150")) / 1000
+        self.per_audio_s = float(os.getenv("BENCH_ASR_RTF", "0.05"))
+        self.text = os.getenv("BENCH_ASR_TEXT", "请介绍一下产品的保修政策")
+
+    def transcribe(self, audio, **kw):
+        seconds = len(audio) / 16000 if hasattr(audio, "__len__") and not isinstance(audio, str) else 1.0
+        time.sleep(self.base_s + self.per_audio_s * seconds)
+        return iter([_Segment(self.text)]), types.SimpleNamespace(language="zh", duration=seconds)
+
+class FakeTTSEngine:
+    # writes a silent 16 kHz WAV whose length follows the text, after a per-call synthesis delay
+    def __init__(self):
+        self.base_s = float(os.getenv("BENCH_TTS_MS", "80")) / 1000
+        self.per_char_s = float(os.getenv("BENCH_TTS_MS_PER_CHAR", "2")) / 1000
+        self._jobs = []
+
+    def setProperty(self, name, value):
+        pass
+
+    def save_to_file(self, text: str, path: str):
+        self._jobs.append((text, path))
+
+    def runAndWait(self):
+        jobs, self._jobs = self._jobs, []
+        for text, path in jobs:
+            time.sleep(self.base_s + self.per_char_s * len(text))
+            with wave.open(path, "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(16000)
+                w.writeframes(b"\0\0" * int(16000 * 0.06 * max(1, len(text))))
+
+class FakeSentenceTransformer:
+    def __init__(self, model_name: str, device=None):
+        self.dim = int(os.getenv("BENCH_EMBED_DIM", "384"))
+        self.per_text_s = float(os.getenv("BENCH_EMBED_MS_PER_TEXT", "0.2")) / 1000
+
+    def encode(self, texts, normalize_embeddings=True, show_progress_bar=False, **kw):
+        time.sleep(self.per_text_s * len(texts))
+        return np.stack([_hash_vec(t, self.dim) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+def install():
+    sys.modules["faster_whisper"] = types.SimpleNamespace(WhisperModel=FakeWhisperModel)
+    sys.modules["pyttsx3"] = types.SimpleNamespace(init=FakeTTSEngine)
+    sys.modules["sentence_transformers"] = types.SimpleNamespace(SentenceTransformer=FakeSentenceTransformer)
@@ -0,0 +1,83 @@
+import os, json, time, random, asyncio, argparse
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# OpenAI-compatible stand-in with a controllable time-to-first-token and generation speed
+_WORDS = ["这是", "一个", "模拟", "的", "回答", "，", "用于", "测量", "语音", "流水线", "的", "延迟", "。",
+          "The", " mock", " model", " streams", " tokens", " at", " a", " fixed", " rate", ".", " "]
+
+def _tokens(n: int, rng: random.Random):
+    out = []
+    for i in range(n):
+        out.append(rng.choice(_WORDS))
+        if i % 12 == 11:
+            out.append("。")
+    return out
+
+def create_app(ttft_ms: float = 300, tokens_per_s: float = 40, tokens: int = 60, jitter: float = 0.1,
+               error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="mock-llm")
+    stats = {"requests": 0, "streams": 0, "errors": 0}
+
+    def delay(base: float) -> float:
+        return max(0.0, base * (1 + random.uniform(-jitter, jitter)))
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "bench"}]}
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat(req: Request):
+        body = await req.json()
+        stats["requests"] += 1
+        if error_rate and random.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "mock failure", "type": "server_error"}}, status_code=503)
+        rng = random.Random(json.dumps(body.get("messages", []), sort_keys=True))
+        pieces = _tokens(tokens, rng)
+        model = body.get("model", "mock")
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay(ttft_ms / 1000) + len(pieces) / tokens_per_s)
+            return {"id": "mock", "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(pieces), "total_tokens": len(pieces)}}
+
+        async def gen():
+            stats["streams"] += 1
+            await asyncio.sleep(delay(ttft_ms / 1000))
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(delay(1.0 / tokens_per_s))
+                chunk = {"id": "mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            done = {"id": "mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(gen(), media_type="text/event-stream")
+
+    return app
+
+def main():
+    ap = argparse.ArgumentParser(description="Mock OpenAI-compatible streaming server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=int(os.getenv("MOCK_LLM_PORT", "18101")))
+    ap.add_argument("--ttft-ms", type=float, default=300)
+    ap.add_argument("--tokens-per-s", type=float, default=40)
+    ap.add_argument("--tokens", type=int, default=60)
+    ap.add_argument("--jitter", type=float, default=0.1)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    app = create_app(args.ttft_ms, args.tokens_per_s, args.tokens, args.jitter, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
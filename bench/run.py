@@ -0,0 +1,315 @@
+import os, sys, json, time, random, asyncio, argparse, datetime, subprocess, tempfile
+import numpy as np
+import httpx
+import websockets
+
+# load driver: spawns bench.mock_llm and bench.serve (or targets --url), then measures each scenario
+
+def percentiles(xs) -> dict:
+    if not xs:
+        return {"n": 0}
+    a = np.asarray(xs, dtype=np.float64) * 1000
+    return {"n": len(xs), "mean_ms": round(float(a.mean()), 2), "p50_ms": round(float(np.percentile(a, 50)), 2),
+            "p95_ms": round(float(np.percentile(a, 95)), 2), "p99_ms": round(float(np.percentile(a, 99)), 2),
+            "max_ms": round(float(a.max()), 2)}
+
+_VOCAB = ["保修", "电池", "充电", "蓝牙", "固件", "升级", "退货", "发票", "客服", "营业时间", "配送", "安装",
+          "reset", "password", "warranty", "firmware", "bluetooth", "battery", "E-1042", "SKU-88", "error"]
+
+def synthetic_text(rng: random.Random, words: int = 60) -> str:
+    return "".join(rng.choice(_VOCAB) + ("。" if i % 10 == 9 else "，") for i in range(words))
+
+def speech_pcm(seconds: float, amplitude: float = 0.3) -> bytes:
+    # a voiced tone the server's energy VAD accepts as speech
+    t = np.arange(int(16000 * seconds)) / 16000
+    x = amplitude * np.sin(2 * np.pi * 220 * t) * (1 + 0.3 * np.sin(2 * np.pi * 3 * t))
+    return (np.clip(x, -1, 1) * 32767).astype("<i2").tobytes()
+
+async def _wait_http(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as c:
+        while time.monotonic() < deadline:
+            try:
+                if (await c.get(url, timeout=2)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.3)
+    raise RuntimeError(f"{url} did not come up")
+
+# ---- /ws voice turns ----
+
+async def _ws_user(url: str, turns: int, speech_s: float, realtime: bool, timeout: float, out: dict):
+    pcm = speech_pcm(speech_s)
+    frame = 16000 * 2 * 20 // 1000
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "config", "provider": "openai", "model": "mock", "asr": "faster_whisper",
+                                  "tts": "pyttsx3", "audio_binary": True}))
+        for _ in range(turns):
+            for i in range(0, len(pcm), frame):
+                await ws.send(pcm[i:i + frame])
+                if realtime:
+                    await asyncio.sleep(0.02)
+            t0 = time.perf_counter()
+            await ws.send(json.dumps({"type": "audio_end"}))
+            marks = {}
+            try:
+                while "done" not in marks:
+                    msg = await asyncio.wait_for(ws.recv(), timeout)
+                    now = time.perf_counter() - t0
+                    if isinstance(msg, bytes):
+                        marks.setdefault("first_audio", now)
+                        continue
+                    kind = json.loads(msg).get("type")
+                    if kind == "transcript":
+                        marks.setdefault("transcript", now)
+                    elif kind == "partial":
+                        marks.setdefault("first_token", now)
+                    elif kind == "audio_chunk":
+                        marks.setdefault("first_audio", now)
+                    elif kind == "audio_done":
+                        marks["done"] = now
+                    elif kind == "error":
+                        out["errors"] += 1
+                        break
+            except asyncio.TimeoutError:
+                out["errors"] += 1
+                continue
+            for k in ("transcript", "first_token", "first_audio", "done"):
+                if k in marks:
+                    out[k].append(marks[k])
+
+async def bench_ws(base: str, concurrency: int, turns: int, speech_s: float, realtime: bool, timeout: float) -> dict:
+    url = base.replace("http", "ws", 1) + "/ws"
+    out = {"errors": 0, "transcript": [], "first_token": [], "first_audio": [], "done": []}
+    t = time.perf_counter()
+    results = await asyncio.gather(*[_ws_user(url, turns, speech_s, realtime, timeout, out) for _ in range(concurrency)],
+                                   return_exceptions=True)
+    out["errors"] += sum(1 for r in results if isinstance(r, Exception))
+    wall = time.perf_counter() - t
+    return {"concurrency": concurrency, "turns": len(out["done"]), "errors": out["errors"], "wall_s": round(wall, 2),
+            "time_to_transcript": percentiles(out["transcript"]), "time_to_first_token": percentiles(out["first_token"]),
+            "time_to_first_audio": percentiles(out["first_audio"]), "turn_total": percentiles(out["done"])}
+
+# ---- /api/chat ----
+
+async def bench_chat(base: str, concurrency: int, requests: int) -> dict:
+    lat, errors = [], 0
+    queue = list(range(requests))
+    async with httpx.AsyncClient(base_url=base, timeout=120, limits=httpx.Limits(max_connections=concurrency)) as c:
+        async def worker():
+            nonlocal errors
+            while queue:
+                i = queue.pop()
+                t = time.perf_counter()
+                try:
+                    r = await c.post("/api/chat", json={"provider": "openai", "model": "mock", "cache": False,
+                                                        "messages": [{"role": "user", "content": f"问题 {i}"}]})
+                    r.raise_for_status()
+                    lat.append(time.perf_counter() - t)
+                except httpx.HTTPError:
+                    errors += 1
+        t = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - t
+    return {"concurrency": concurrency, "requests": requests, "errors": errors, "wall_s": round(wall, 2),
+            "rps": round(len(lat) / wall, 2) if wall else 0.0, "latency": percentiles(lat)}
+
+# ---- /api/kb/search by index size ----
+
+def populate_kb(target: int, have: int, batch: int = 2000) -> int:
+    # appends synthetic chunks through the store in this process; the server picks up the new generation
+    from server.rag.vectorstore import upsert_docs
+    rng = random.Random(have)
+    while have < target:
+        n = min(batch, target - have)
+        # one synthetic document per batch: upsert replaces a source's chunks wholesale
+        docs = [{"text": f"{synthetic_text(rng)} #{have + i}", "source": f"synthetic-{have}.txt",
+                 "meta": {"chunk_id": i}} for i in range(n)]
+        upsert_docs(docs)
+        have += n
+    return have
+
+async def bench_kb_search(base: str, concurrency: int, duration: float, topk: int) -> dict:
+    lat, errors = [], 0
+    rng = random.Random(7)
+    stop = time.perf_counter() + duration
+    async with httpx.AsyncClient(base_url=base, timeout=30, limits=httpx.Limits(max_connections=concurrency)) as c:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < stop:
+                q = " ".join(rng.choice(_VOCAB) for _ in range(3))
+                t = time.perf_counter()
+                try:
+                    r = await c.post("/api/kb/search", json={"q": q, "topk": topk})
+                    r.raise_for_status()
+                    lat.append(time.perf_counter() - t)
+                except httpx.HTTPError:
+                    errors += 1
+        t = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - t
+    return {"concurrency": concurrency, "errors": errors, "qps": round(len(lat) / wall, 2), "latency": percentiles(lat)}
+
+# ---- /api/kb/ingest ----
+
+async def bench_ingest(base: str, concurrency: int, files: int, chunks_per_file: int) -> dict:
+    rng = random.Random(11)
+    lat, errors, rejected = [], 0, 0
+    queue = list(range(files))
+    async with httpx.AsyncClient(base_url=base, timeout=300) as c:
+        async def worker():
+            nonlocal errors, rejected
+            while queue:
+                i = queue.pop()
+                body = "\n\n".join(synthetic_text(rng) for _ in range(chunks_per_file))
+                t = time.perf_counter()
+                r = await c.post("/api/kb/ingest", files={"files": (f"bench-{i}-{time.time_ns()}.txt", body.encode("utf-8"), "text/plain")})
+                if r.status_code == 429:
+                    rejected += 1
+                    queue.append(i)
+                    await asyncio.sleep(float(r.headers.get("Retry-After", "1")))
+                    continue
+                if r.status_code >= 400:
+                    errors += 1
+                    continue
+                job_id = r.json().get("job_id")
+                while True:
+                    job = (await c.get(f"/api/kb/jobs/{job_id}")).json()
+                    if job.get("status") in ("done", "failed"):
+                        break
+                    await asyncio.sleep(0.05)
+                if job.get("status") == "done":
+                    lat.append(time.perf_counter() - t)
+                else:
+                    errors += 1
+        t = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - t
+    return {"concurrency": concurrency, "files": files, "errors": errors, "rejected_429": rejected,
+            "wall_s": round(wall, 2), "files_per_s": round(len(lat) / wall, 2) if wall else 0.0,
+            "job_latency": percentiles(lat)}
+
+# ---- driver ----
+
+def _spawn(module: str, args, env) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", module] + [str(a) for a in args], env=env,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+def _ints(s: str):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+async def run(args) -> dict:
+    base = args.url or f"http://127.0.0.1:{args.port}"
+    results: dict = {}
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    if "ws" in scenarios:
+        results["ws"] = []
+        for c in _ints(args.concurrency):
+            r = await bench_ws(base, c, args.turns, args.speech_s, args.realtime, args.timeout)
+            results["ws"].append(r)
+            print(f"[ws] c={c} turns={r['turns']} errors={r['errors']} first_audio p50={r['time_to_first_audio'].get('p50_ms')}ms p95={r['time_to_first_audio'].get('p95_ms')}ms")
+    if "chat" in scenarios:
+        results["chat"] = []
+        for c in _ints(args.concurrency):
+            r = await bench_chat(base, c, args.requests)
+            results["chat"].append(r)
+            print(f"[chat] c={c} rps={r['rps']} p50={r['latency'].get('p50_ms')}ms p95={r['latency'].get('p95_ms')}ms")
+    if "kb_search" in scenarios:
+        results["kb_search"] = []
+        have = 0
+        for size in _ints(args.kb_sizes):
+            if args.url is None:
+                have = await asyncio.to_thread(populate_kb, size, have)
+                await asyncio.sleep(float(os.environ.get("KB_RELOAD_INTERVAL", "1.0")) + 0.5)
+            for c in _ints(args.concurrency):
+                r = await bench_kb_search(base, c, args.duration, args.topk)
+                r["index_size"] = size
+                results["kb_search"].append(r)
+                print(f"[kb_search] n={size} c={c} qps={r['qps']} p95={r['latency'].get('p95_ms')}ms")
+    if "ingest" in scenarios:
+        results["ingest"] = []
+        for c in _ints(args.concurrency):
+            r = await bench_ingest(base, c, args.files, args.chunks_per_file)
+            results["ingest"].append(r)
+            print(f"[ingest] c={c} files/s={r['files_per_s']} p95={r['job_latency'].get('p95_ms')}ms rejected={r['rejected_429']}")
+    async with httpx.AsyncClient(base_url=base, timeout=10) as c:
+        try:
+            results["server_stats"] = (await c.get("/api/stats")).json()
+        except httpx.HTTPError:
+            pass
+    return results
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the voice pipeline against offline stand-ins")
+    ap.add_argument("--scenarios", default="ws,chat,kb_search,ingest")
+    ap.add_argument("--concurrency", default="1,4,16", help="comma-separated levels")
+    ap.add_argument("--url", default=None, help="target an already running server instead of spawning bench.serve")
+    ap.add_argument("--port", type=int, default=18100)
+    ap.add_argument("--llm-port", type=int, default=18101)
+    ap.add_argument("--ttft-ms", type=float, default=300)
+    ap.add_argument("--tokens-per-s", type=float, default=40)
+    ap.add_argument("--tokens", type=int, default=60)
+    ap.add_argument("--asr-ms", type=float, default=150)
+    ap.add_argument("--tts-ms", type=float, default=80)
+    ap.add_argument("--turns", type=int, default=3, help="voice turns per /ws connection")
+    ap.add_argument("--speech-s", type=float, default=1.5)
+    ap.add_argument("--realtime", action="store_true", help="pace audio frames at 20 ms like a microphone")
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--requests", type=int, default=50, help="/api/chat requests per concurrency level")
+    ap.add_argument("--kb-sizes", default="1000,10000")
+    ap.add_argument("--duration", type=float, default=5, help="seconds per /api/kb/search level")
+    ap.add_argument("--topk", type=int, default=5)
+    ap.add_argument("--files", type=int, default=8)
+    ap.add_argument("--chunks-per-file", type=int, default=50)
+    ap.add_argument("--kb-dir", default=None, help="defaults to a fresh temp dir")
+    ap.add_argument("--out", default=None, help="write results JSON here")
+    args = ap.parse_args()
+
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1", "OPENAI_API_KEY": "bench",
+        "DEFAULT_PROVIDER": "openai", "DEFAULT_MODEL": "mock", "EMBEDDING_BACKEND": "local",
+        "KB_DIR": args.kb_dir or tempfile.mkdtemp(prefix="bench-kb-"),
+        "BENCH_ASR_MS": str(args.asr_ms), "BENCH_TTS_MS": str(args.tts_ms),
+    })
+    env.pop("WARMUP_MODELS", None)
+    os.environ.update(env)
+
+    procs = []
+    try:
+        if args.url is None:
+            procs.append(_spawn("bench.mock_llm", ["--port", args.llm_port, "--ttft-ms", args.ttft_ms,
+                                                   "--tokens-per-s", args.tokens_per_s, "--tokens", args.tokens], env))
+            procs.append(_spawn("bench.serve", ["--port", args.port], env))
+            asyncio.run(_wait_http(f"http://127.0.0.1:{args.llm_port}/v1/models"))
+            asyncio.run(_wait_http(f"http://127.0.0.1:{args.port}/api/stats"))
+            from bench import fakes
+            fakes.install()
+        results = asyncio.run(run(args))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+    report = {"version": 1, "git": _git_rev(), "started": datetime.datetime.now().isoformat(timespec="seconds"),
+              "config": vars(args), "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"wrote {args.out}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os, argparse
+import uvicorn
+from bench import fakes
+
+# the real server app with fake ASR/TTS/embedding backends; point OPENAI_BASE_URL at bench.mock_llm
+
+def main():
+    ap = argparse.ArgumentParser(description="Run server.main with offline fake backends")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=int(os.getenv("BENCH_SERVER_PORT", "18100")))
+    args = ap.parse_args()
+    fakes.install()
+    from server.main import app
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", ws_max_size=16 * 1024 * 1024)
+
+if __name__ == "__main__":
+    main()
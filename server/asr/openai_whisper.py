@@ -1,12 +1,15 @@
 import os, base64, tempfile
-from openai import OpenAI
+from server.providers.clients import get_clients
 
 def transcribe_with_openai_base64(b64_webm: str, filename: str = "audio.webm") -> str:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""), base_url=os.getenv("OPENAI_BASE_URL"))
+    client, _ = get_clients("openai_asr", os.getenv("OPENAI_BASE_URL"), os.getenv("OPENAI_API_KEY", ""))
     raw = base64.b64decode(b64_webm)
     with tempfile.NamedTemporaryFile(delete=False, suffix=filename) as fp:
         fp.write(raw)
         tmp = fp.name
-    with open(tmp, "rb") as f:
-        transcript = client.audio.transcriptions.create(model="whisper-1", file=f)
+    try:
+        with open(tmp, "rb") as f:
+            transcript = client.audio.transcriptions.create(model="whisper-1", file=f)
+    finally:
+        os.remove(tmp)
     return getattr(transcript, "text", "") or ""
@@ -0,0 +1,143 @@
+import os, io, wave
+import numpy as np
+from typing import List, Optional
+from .whisper_local import get_whisper_model
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+
+def pcm16_to_float32(pcm: bytes) -> np.ndarray:
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+
+def float32_to_wav_bytes(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes((np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    return buf.getvalue()
+
+class EnergyVAD:
+    # RMS energy against an adaptive noise floor, with hangover for end-of-speech
+    def __init__(self, silence_ms: int = 600, min_speech_ms: int = 200, threshold_db: float = -45.0, ratio: float = 3.0):
+        self.silence_frames = max(1, silence_ms // FRAME_MS)
+        self.min_speech_frames = max(1, min_speech_ms // FRAME_MS)
+        self.threshold = 10 ** (threshold_db / 20)
+        self.ratio = ratio
+        self.noise = self.threshold / ratio
+        self.in_speech = False
+        self.speech_run = 0
+        self.silence_run = 0
+
+    def reset(self):
+        self.in_speech = False
+        self.speech_run = 0
+        self.silence_run = 0
+
+    def frame(self, x: np.ndarray) -> str:
+        rms = float(np.sqrt(np.mean(x * x) + 1e-12))
+        voiced = rms > max(self.threshold, self.noise * self.ratio)
+        # the floor follows quiet frames quickly and loud ones slowly, so noise that rises above the
+        # threshold and stays there is eventually heard as silence (speech pauses pull it back down)
+        a = 0.05 if not voiced else 0.0005
+        self.noise = (1 - a) * self.noise + a * rms
+        if not self.in_speech:
+            self.speech_run = self.speech_run + 1 if voiced else 0
+            if self.speech_run >= self.min_speech_frames:
+                self.in_speech = True
+                self.silence_run = 0
+                return "start"
+            return ""
+        self.silence_run = 0 if voiced else self.silence_run + 1
+        if self.silence_run >= self.silence_frames:
+            self.in_speech = False
+            self.speech_run = 0
+            return "end"
+        return ""
+
+class StreamingTranscriber:
+    def __init__(self, model_size: str = "base", language: Optional[str] = None):
+        self.model_size = model_size
+        self.language = language or os.getenv("WHISPER_LANGUAGE") or None
+        self.window_s = float(os.getenv("ASR_WINDOW_S", "15"))
+        self.partial_interval_s = float(os.getenv("ASR_PARTIAL_INTERVAL_S", "0.6"))
+        self.preroll_frames = int(os.getenv("ASR_PREROLL_MS", "300")) // FRAME_MS
+        # an utterance this long is finalised even without an endpoint, bounding the buffer
+        self.max_utter_samples = int(float(os.getenv("ASR_MAX_UTTER_S", "30")) * SAMPLE_RATE)
+        self.vad = EnergyVAD(
+            silence_ms=int(os.getenv("ASR_ENDPOINT_SILENCE_MS", "600")),
+            min_speech_ms=int(os.getenv("ASR_MIN_SPEECH_MS", "200")),
+            threshold_db=float(os.getenv("ASR_VAD_THRESHOLD_DB", "-45")),
+        )
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._preroll: List[np.ndarray] = []
+        self._utt: List[np.ndarray] = []
+        self._utt_samples = 0
+        self._since_partial = 0
+
+    @property
+    def in_speech(self) -> bool:
+        return self.vad.in_speech or self._utt_samples > 0
+
+    def feed(self, pcm: bytes) -> List[str]:
+        # returns VAD events in order: "start", "partial_due", "end"
+        events: List[str] = []
+        audio = np.concatenate([self._pending, pcm16_to_float32(pcm)])
+        n = len(audio) // FRAME_SAMPLES * FRAME_SAMPLES
+        self._pending = audio[n:]
+        for i in range(0, n, FRAME_SAMPLES):
+            frame = audio[i:i + FRAME_SAMPLES]
+            ev = self.vad.frame(frame)
+            if ev == "start":
+                self._utt = self._preroll + [frame]
+                self._utt_samples = sum(len(f) for f in self._utt)
+                self._preroll = []
+                self._since_partial = 0
+                events.append("start")
+            elif self._utt_samples:
+                self._utt.append(frame)
+                self._utt_samples += len(frame)
+                self._since_partial += len(frame)
+                if ev != "end" and self._utt_samples >= self.max_utter_samples:
+                    self.vad.reset()
+                    ev = "end"
+                if ev == "end":
+                    events.append("end")
+                    # frames after the endpoint belong to the next utterance
+                    self._pending = np.concatenate([audio[i + FRAME_SAMPLES:n], self._pending])
+                    break
+            else:
+                self._preroll = (self._preroll + [frame])[-self.preroll_frames:] if self.preroll_frames else []
+        if self._utt_samples and self._since_partial >= self.partial_interval_s * SAMPLE_RATE and "end" not in events:
+            self._since_partial = 0
+            events.append("partial_due")
+        return events
+
+    def _decode(self, audio: np.ndarray, beam_size: int = 1) -> str:
+        if len(audio) < SAMPLE_RATE // 10:
+            return ""
+        model = get_whisper_model(self.model_size)
+        segments, _ = model.transcribe(audio, beam_size=beam_size, language=self.language,
+                                       vad_filter=False, condition_on_previous_text=False)
+        return "".join(seg.text for seg in segments).strip()
+
+    def utterance_audio(self) -> np.ndarray:
+        return np.concatenate(self._utt) if self._utt else np.zeros(0, dtype=np.float32)
+
+    # decode_* only read their argument, so they can run in a worker thread while feed() continues
+    def decode_partial(self, audio: np.ndarray) -> str:
+        # partials re-decode only the trailing window, so their cost stays flat as the utterance grows
+        window = int(self.window_s * SAMPLE_RATE)
+        text = self._decode(audio[-window:])
+        return ("…" + text) if len(audio) > window and text else text
+
+    def decode_final(self, audio: np.ndarray) -> str:
+        return self._decode(audio, beam_size=int(os.getenv("ASR_FINAL_BEAM_SIZE", "1")))
+
+    def reset(self):
+        self.vad.reset()
+        self._utt = []
+        self._utt_samples = 0
+        self._since_partial = 0
@@ -1,8 +1,26 @@
 import os
 from faster_whisper import WhisperModel
+from server.registry import get_registry
+
+_WHISPER_MB = {"tiny": 75, "base": 145, "small": 485, "medium": 1530, "large": 3100}
+
+def _whisper_compute_type() -> str:
+    return "int8" if os.getenv("WHISPER_INT8", "1") == "1" else "float16"
+
+def _whisper_size_mb(model_size: str, compute_type: str) -> float:
+    base = next((mb for k, mb in _WHISPER_MB.items() if model_size.startswith(k)), 500)
+    return base * (0.5 if compute_type.startswith("int8") else 1.0)
+
+def get_whisper_model(model_size: str = "base") -> WhisperModel:
+    compute_type = _whisper_compute_type()
+    device = os.getenv("WHISPER_DEVICE", "auto")
+    return get_registry().get(
+        "whisper", f"{model_size}@{device}", compute_type,
+        lambda: WhisperModel(model_size, device=device, compute_type=compute_type),
+        size_mb=_whisper_size_mb(model_size, compute_type),
+    )
 
 def transcribe_with_faster_whisper(audio_path: str, model_size: str = "base") -> str:
-    compute_type = "int8" if os.getenv("WHISPER_INT8", "1") == "1" else "float16"
-    model = WhisperModel(model_size, device="auto", compute_type=compute_type)
+    model = get_whisper_model(model_size)
     segments, info = model.transcribe(audio_path, beam_size=1, vad_filter=True)
     return "".join([seg.text for seg in segments]).strip()
@@ -0,0 +1,161 @@
+import os, asyncio, logging
+from typing import Dict, List, Optional, Tuple
+from server.tokens import count_tokens
+from server.rag.embed_cache import normalize_text, text_hash
+
+log = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own memory. Keep names, numbers, decisions, "
+    "open questions and user preferences; drop small talk. Write in the conversation's language, "
+    "at most {tokens} tokens."
+)
+
+class ConversationContext:
+    # per-session prompt builder: pinned system + KB snippets + rolling summary + recent turns, within a token budget
+    def __init__(self, system: str, max_tokens: int = 3000, kb_tokens: int = 1200, keep_messages: int = 6,
+                 summary_tokens: int = 300, summarize_at: float = 0.75):
+        self.system = system
+        self.max_tokens = max_tokens
+        self.kb_tokens = kb_tokens
+        self.keep_messages = keep_messages
+        self.summary_tokens = summary_tokens
+        self.summarize_at = summarize_at
+        self.summary = ""
+        self.turns: List[Tuple[Dict[str, str], int]] = []  # (message, tokens), oldest first
+        self.snippets: List[Tuple[str, str, str, int]] = []  # (hash, citation, text, tokens), newest first
+        self._task: Optional[asyncio.Task] = None
+        self.summaries = 0
+        self.folded_messages = 0
+        self.kb_deduped = 0
+
+    def reset(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.summary = ""
+        self.turns = []
+        self.snippets = []
+
+    def add(self, role: str, content: str):
+        msg = {"role": role, "content": content}
+        self.turns.append((msg, count_tokens(content) + 4))
+
+    def history(self) -> List[Dict[str, str]]:
+        # everything an answer depends on besides the new question and the KB: system, summary, turns
+        head = [{"role": "system", "content": self.system}]
+        if self.summary:
+            head.append({"role": "system", "content": self.summary})
+        return head + [m for m, _ in self.turns]
+
+    @property
+    def last_role(self) -> str:
+        return self.turns[-1][0]["role"] if self.turns else "system"
+
+    def set_kb(self, hits: List[Dict], cite=None) -> int:
+        # this turn's snippets go first, earlier pinned ones fill the rest of the KB budget;
+        # a snippet already in context moves up instead of being repeated. Returns how many were new.
+        pinned = {s[0]: s for s in self.snippets}
+        current, seen, new = [], set(), 0
+        for hit in hits:
+            h = text_hash(normalize_text(hit["text"]))
+            if h in seen:
+                continue
+            seen.add(h)
+            s = pinned.get(h)
+            if s is None:
+                label = cite(hit) if cite else hit.get("source", "")
+                s = (h, label, hit["text"], count_tokens(hit["text"]) + count_tokens(label) + 8)
+                new += 1
+            current.append(s)
+        self.kb_deduped += len(current) - new
+        kept, used = [], 0
+        for s in current + [s for s in self.snippets if s[0] not in seen]:
+            if kept and used + s[3] > self.kb_tokens:
+                break
+            kept.append(s)
+            used += s[3]
+        self.snippets = kept
+        return new
+
+    def clear_kb(self):
+        self.snippets = []
+
+    def _kb_messages(self) -> List[Dict[str, str]]:
+        if not self.snippets:
+            return []
+        ctx = "\n\n".join(f"【片段{i+1} 来自: {label}】\n{text}" for i, (_, label, text, _) in enumerate(self.snippets))
+        return [{"role": "system", "content": "你可以使用下面的知识库片段回答问题，尽量引用片段编号。"},
+                {"role": "system", "content": ctx}]
+
+    def messages(self) -> List[Dict[str, str]]:
+        head = [{"role": "system", "content": self.system}] + self._kb_messages()
+        if self.summary:
+            head.append({"role": "system", "content": f"Earlier in this conversation (summary):\n{self.summary}"})
+        budget = self.max_tokens - sum(count_tokens(m["content"]) + 4 for m in head)
+        # newest turns first until the budget runs out; the latest message is always kept
+        tail: List[Dict[str, str]] = []
+        for msg, n in reversed(self.turns):
+            if tail and n > budget:
+                break
+            tail.insert(0, msg)
+            budget -= n
+        return head + tail
+
+    def tokens(self) -> int:
+        return sum(count_tokens(m["content"]) + 4 for m in self.messages())
+
+    def _foldable(self) -> int:
+        # number of oldest messages to fold into the summary, 0 while the history still fits
+        history = sum(n for _, n in self.turns)
+        if history <= self.summarize_at * (self.max_tokens - self.kb_tokens) or len(self.turns) <= self.keep_messages:
+            return 0
+        return len(self.turns) - self.keep_messages
+
+    def maybe_summarize(self, provider, model: str):
+        # starts a background summary of older turns; the next prompt keeps working off the verbatim tail
+        if self._task is not None and not self._task.done():
+            return
+        count = self._foldable()
+        if count:
+            self._task = asyncio.create_task(self._summarize(provider, model, count))
+
+    async def _summarize(self, provider, model: str, count: int):
+        folded = [m for m, _ in self.turns[:count]]
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in folded)
+        if self.summary:
+            transcript = f"(summary so far) {self.summary}\n{transcript}"
+        prompt = [{"role": "system", "content": SUMMARY_PROMPT.format(tokens=self.summary_tokens)},
+                  {"role": "user", "content": transcript}]
+        try:
+            summary = ""
+            async for piece in provider.astream_chat(prompt, model=model):
+                summary += piece
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("summary failed, keeping turns verbatim: %s", e)
+            return
+        summary = summary.strip()
+        if not summary:
+            return
+        # turns only ever get appended while this ran, so the folded ones are still the prefix
+        self.summary = summary
+        self.turns = self.turns[count:]
+        self.summaries += 1
+        self.folded_messages += count
+
+    def stats(self) -> Dict:
+        return {"tokens": self.tokens(), "max_tokens": self.max_tokens, "messages": len(self.turns),
+                "kb_snippets": len(self.snippets), "summary_tokens": count_tokens(self.summary),
+                "summaries": self.summaries, "folded_messages": self.folded_messages, "kb_deduped": self.kb_deduped}
+
+def new_context(system: str) -> ConversationContext:
+    return ConversationContext(
+        system,
+        max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "3000")),
+        kb_tokens=int(os.getenv("CONTEXT_KB_TOKENS", "1200")),
+        keep_messages=int(os.getenv("CONTEXT_KEEP_MESSAGES", "6")),
+        summary_tokens=int(os.getenv("CONTEXT_SUMMARY_TOKENS", "300")),
+        summarize_at=float(os.getenv("CONTEXT_SUMMARIZE_AT", "0.75")),
+    )
@@ -0,0 +1,71 @@
+import os, time, asyncio, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from server.metrics import QUEUE_WAIT
+
+# CPU-bound and blocking work (ASR, TTS, embedding, sync SDK calls) runs on one bounded
+# pool per stage, so a slow stage queues its own work instead of starving the event loop.
+_DEFAULT_WORKERS = {"asr": 2, "tts": 2, "embed": 2, "io": 8}
+
+class Stage:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._pool
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.workers)
+        self.waiting += 1
+        t = time.perf_counter()
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        QUEUE_WAIT.observe(time.perf_counter() - t, self.name)
+        self.active += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # run in a copy of the caller's context so timing spans land in the caller's turn
+            ctx = contextvars.copy_context()
+            return await loop.run_in_executor(self.pool(), lambda: ctx.run(fn, *args, **kwargs))
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self._sem.release()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"workers": self.workers, "active": self.active, "waiting": self.waiting, "completed": self.completed}
+
+_stages: Dict[str, Stage] = {}
+
+def get_stage(name: str) -> Stage:
+    stage = _stages.get(name)
+    if stage is None:
+        workers = int(os.getenv(f"{name.upper()}_WORKERS", str(_DEFAULT_WORKERS.get(name, 4))))
+        stage = _stages[name] = Stage(name, workers)
+    return stage
+
+async def run_in(stage: str, fn: Callable, *args, **kwargs) -> Any:
+    return await get_stage(stage).run(fn, *args, **kwargs)
+
+def stage_stats() -> Dict[str, Dict[str, int]]:
+    return {name: s.stats() for name, s in _stages.items()}
+
+def shutdown_stages():
+    for s in _stages.values():
+        s.shutdown()
@@ -1,19 +1,30 @@
-import os, io, json, base64, tempfile, subprocess
-from typing import List, Dict, Any
+import os, io, json, time, base64, shutil, asyncio, logging, tempfile
+from typing import List, Dict, Any, Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 
 from server.providers.factory import build_provider
+from server.providers.clients import client_stats
+from server.providers.routing import router_stats
 from server.asr.whisper_local import transcribe_with_faster_whisper
 from server.asr.openai_whisper import transcribe_with_openai_base64
-from server.tts.pyttsx3_tts import tts_to_wav_bytes
-from server.rag.vectorstore import add_docs, search
-from server.rag.ingest import build_docs_from_files
+from server.asr.streaming import StreamingTranscriber, float32_to_wav_bytes
+from server.tts.audio import MIME, synthesize, pack_frame, tts_audio_stats
+from server.tts.streaming import SentenceSegmenter, StreamingTTS
+from server.rag.vectorstore import upsert_docs, search, list_docs, delete_doc
+from server.rag.jobs import QueueFull, get_job_manager
+from server.registry import get_registry, warmup
+from server.executors import run_in, stage_stats, shutdown_stages
+from server.rag.embed_cache import cache_stats
+from server.context import new_context
+from server.semantic_cache import cache_scope, embed_query, get_semantic_cache, semantic_cache_enabled, semantic_cache_stats
+from server.metrics import CONTENT_TYPE, WS_SESSIONS, Timings, active, family, render, span
 
 load_dotenv()
+log = logging.getLogger(__name__)
 
 app = FastAPI(title="Voice LLM Starter v0.6 (RAG)", version="0.6")
 
@@ -28,194 +39,587 @@ app.add_middleware(
 static_dir = os.path.join(os.path.dirname(__file__), "..", "web")
 app.mount("/web", StaticFiles(directory=static_dir), name="web")
 
+@app.on_event("startup")
+async def warmup_models():
+    if os.getenv("WARMUP_MODELS"):
+        loaded = await asyncio.to_thread(warmup)
+        log.info("warmed up: %s", ", ".join(loaded) or "none")
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    get_job_manager().shutdown()
+    shutdown_stages()
+
+@app.get("/api/stats")
+def stats():
+    return {"models": get_registry().stats(), "embed_cache": cache_stats(), "ingest_jobs": get_job_manager().stats(), "stages": stage_stats(), "llm_clients": client_stats(), "router": router_stats(), "semantic_cache": semantic_cache_stats(), "tts_cache": tts_audio_stats()}
+
+def _runtime_metrics() -> List[str]:
+    # gauges and cumulative counters read from the same stats /api/stats reports
+    lines: List[str] = []
+    stages = stage_stats()
+    lines += family("voice_executor_active", "gauge", "Jobs running in a stage executor.", [({"stage": k}, v["active"]) for k, v in stages.items()])
+    lines += family("voice_executor_waiting", "gauge", "Jobs queued for a stage executor.", [({"stage": k}, v["waiting"]) for k, v in stages.items()])
+    lines += family("voice_executor_completed_total", "counter", "Jobs finished by a stage executor.", [({"stage": k}, v["completed"]) for k, v in stages.items()])
+    jobs = get_job_manager().stats()
+    lines += family("voice_ingest_jobs", "gauge", "Knowledge-base ingest jobs.", [({"state": "pending"}, jobs["pending"]), ({"state": "running"}, jobs["running"])])
+    caches = {"models": get_registry().stats()}
+    embed = cache_stats()
+    caches["embed"] = {"hits": sum(c["mem_hits"] + c["disk_hits"] for c in embed), "misses": sum(c["misses"] for c in embed)}
+    for name, st in (("semantic", semantic_cache_stats()), ("tts", tts_audio_stats())):
+        if "hits" in st:
+            caches[name] = st
+    lines += family("voice_cache_hits_total", "counter", "Cache hits.", [({"cache": k}, v["hits"]) for k, v in caches.items()])
+    lines += family("voice_cache_misses_total", "counter", "Cache misses.", [({"cache": k}, v["misses"]) for k, v in caches.items()])
+    lines += family("voice_cache_hit_ratio", "gauge", "Cache hit ratio since start.",
+                    [({"cache": k}, round(v["hits"] / (v["hits"] + v["misses"]), 4) if v["hits"] + v["misses"] else 0.0) for k, v in caches.items()])
+    pools = client_stats()["pools"]
+    lines += family("voice_llm_requests_total", "counter", "Requests sent through pooled LLM clients.", [({"provider": p["provider"], "base_url": p["base_url"] or ""}, p["requests"]) for p in pools])
+    lines += family("voice_llm_new_connections_total", "counter", "New connections opened by pooled LLM clients.", [({"provider": p["provider"], "base_url": p["base_url"] or ""}, p["new_connections"]) for p in pools])
+    backends = [(b, st) for r in router_stats().values() for b, st in r["backends"].items()]
+    lines += family("voice_router_ttft_seconds", "gauge", "EWMA time to first token per routed backend.",
+                    [({"backend": b}, st["ttft_ms"] / 1000 if st["ttft_ms"] is not None else None) for b, st in backends])
+    lines += family("voice_router_healthy", "gauge", "1 while a routed backend's circuit is closed.", [({"backend": b}, int(st["healthy"])) for b, st in backends])
+    return lines
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render(_runtime_metrics()), media_type=CONTENT_TYPE)
+
 @app.get("/")
 def root():
     return HTMLResponse(open(os.path.join(static_dir, "index.html"), "r", encoding="utf-8").read())
 
 @app.post("/api/kb/ingest")
 async def kb_ingest(files: List[UploadFile] = File(default=[])):
-    tmp_paths = []
-    for f in files:
-        suffix = os.path.splitext(f.filename)[1] or ".bin"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as fp:
-            content = await f.read()
-            fp.write(content)
-            tmp_paths.append(fp.name)
-    chunk_size = int(os.getenv("KB_CHUNK_SIZE", "800"))
-    chunk_overlap = int(os.getenv("KB_CHUNK_OVERLAP", "120"))
-    docs = build_docs_from_files(tmp_paths, chunk_size, chunk_overlap)
-    n = add_docs(docs)
-    return {"ok": True, "added_chunks": n}
+    manager = get_job_manager()
+    try:
+        manager.check_capacity()
+    except QueueFull as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=429, headers={"Retry-After": "5"})
+    tmp_dir = tempfile.mkdtemp(prefix="kb_ingest_")
+    saved = []
+    try:
+        for i, f in enumerate(files):
+            suffix = os.path.splitext(f.filename or "")[1] or ".bin"
+            path = os.path.join(tmp_dir, f"{i}{suffix}")
+            # disk writes go to the io stage so a slow volume does not stall the event loop
+            fp = await run_in("io", open, path, "wb")
+            try:
+                while True:
+                    block = await f.read(1 << 20)
+                    if not block:
+                        break
+                    await run_in("io", fp.write, block)
+            finally:
+                await run_in("io", fp.close)
+            saved.append((path, f.filename or os.path.basename(path)))
+        job = manager.submit(tmp_dir, saved)
+    except Exception as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        status = 429 if isinstance(e, QueueFull) else 500
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=status)
+    return JSONResponse({"ok": True, **job.to_dict()}, status_code=202)
+
+@app.get("/api/kb/jobs/{job_id}")
+async def kb_job(job_id: str):
+    job = get_job_manager().jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"ok": False, "error": f"unknown job_id: {job_id}"}, status_code=404)
+    return {"ok": True, **job.to_dict()}
+
+@app.get("/api/kb/jobs/{job_id}/events")
+async def kb_job_events(job_id: str):
+    job = get_job_manager().jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"ok": False, "error": f"unknown job_id: {job_id}"}, status_code=404)
+
+    async def events():
+        seen = -1
+        while True:
+            if job.version != seen:
+                seen = job.version
+                yield f"data: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+            if job.finished:
+                return
+            await asyncio.sleep(0.25)
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/kb/docs")
+async def kb_docs():
+    return {"ok": True, "docs": list_docs()}
+
+@app.delete("/api/kb/doc/{doc_id}")
+async def kb_delete_doc(doc_id: str):
+    n = delete_doc(doc_id)
+    if n < 0:
+        return JSONResponse({"ok": False, "error": f"unknown doc_id: {doc_id}"}, status_code=404)
+    return {"ok": True, "removed_chunks": n}
 
 @app.post("/api/kb/search")
 async def kb_search(payload: Dict[str, Any]):
     q = payload.get("q", "")
     topk = int(payload.get("topk", 5))
-    return {"ok": True, "hits": search(q, topk)}
+    nprobe = payload.get("nprobe")
+    ef_search = payload.get("ef_search", payload.get("efSearch"))
+    timings = Timings("kb_search")
+    with active(timings):
+        try:
+            hits = await run_in("embed", search, q, topk, nprobe=int(nprobe) if nprobe else None,
+                                ef_search=int(ef_search) if ef_search else None, **_kb_weights(payload))
+        except asyncio.CancelledError:
+            timings.finish("cancelled")
+            raise
+        except Exception:
+            timings.finish("error")
+            raise
+    timings.finish()
+    out = {"ok": True, "hits": hits}
+    if payload.get("timings"):
+        out["timings"] = timings.to_dict()
+    return out
+
+def _kb_weights(payload: Dict[str, Any]) -> Dict[str, float]:
+    # per-request fusion weights; omitted ones fall back to KB_DENSE_WEIGHT / KB_LEXICAL_WEIGHT
+    return {k: float(payload[k]) for k in ("dense_weight", "lexical_weight") if payload.get(k) is not None}
+
+def _cite(hit: Dict[str, Any]) -> str:
+    meta = hit.get("meta") or {}
+    where = hit["source"]
+    if meta.get("page"):
+        where += f" p.{meta['page']}" + (f"-{meta['page_end']}" if meta.get("page_end", meta["page"]) != meta["page"] else "")
+    if meta.get("heading"):
+        where += f" §{meta['heading']}"
+    return where
+
+SYSTEM_PROMPT = "You are a helpful assistant. Reply in the same language as the user."
+
+async def _kb_hits(query: str, kb_topk: int, weights: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    with span("kb_search"):
+        return await run_in("embed", search, query, kb_topk, **(weights or {}))
+
+async def _kb_messages(query: str, kb_topk: int, weights: Optional[Dict[str, float]] = None) -> List[Dict[str, str]]:
+    hits = await _kb_hits(query, kb_topk, weights)
+    if not hits:
+        return []
+    ctx = "\n\n".join([f"【片段{i+1} score={h['score']:.3f} 来自: {_cite(h)}】\n{h['text']}" for i,h in enumerate(hits)])
+    return [{"role":"system","content": "你可以使用下面的知识库片段回答问题，尽量引用片段编号。"}, {"role":"system","content": ctx}]
+
+async def _cache_probe(query: str, provider_key: str, model: str, kb: bool, kb_topk: int,
+                       weights: Optional[Dict[str, float]] = None, history: Optional[List[Dict[str, str]]] = None):
+    # -> (scope, query vector, cached answer or None); (None, None, None) when the cache is off.
+    # history is the conversation before the question; answers are only shared within the same one
+    if not query or not semantic_cache_enabled():
+        return None, None, None
+    def probe():
+        scope = cache_scope(provider_key, model, kb, kb_topk, tuple(sorted((weights or {}).items())), history)
+        vec = embed_query(query)
+        return scope, vec, get_semantic_cache().lookup(scope, vec)
+    with span("cache_probe"):
+        return await run_in("embed", probe)
+
+async def _timed_stream(timings: Timings, stream):
+    # llm_ttft: request to first token; llm_stream: the whole generation
+    t = time.perf_counter()
+    first = True
+    try:
+        async for piece in stream:
+            if first:
+                first = False
+                timings.record("llm_ttft", time.perf_counter() - t)
+                timings.mark("first_token")
+            yield piece
+    finally:
+        timings.record("llm_stream", time.perf_counter() - t)
 
 @app.post("/api/chat")
 async def chat_api(payload: Dict[str, Any]):
+    timings = Timings("chat")
+    with active(timings):
+        try:
+            out = await _chat(payload, timings)
+        except asyncio.CancelledError:
+            timings.finish("cancelled")
+            raise
+        except Exception:
+            timings.finish("error")
+            raise
+    timings.finish("cached" if out["cached"] else "ok")
+    if payload.get("timings"):
+        out["timings"] = timings.to_dict()
+    return JSONResponse(out)
+
+async def _chat(payload: Dict[str, Any], timings: Timings) -> Dict[str, Any]:
     messages = payload.get("messages", [])
     provider_key = payload.get("provider", os.getenv("DEFAULT_PROVIDER", "aliyun"))
     model = payload.get("model", os.getenv("DEFAULT_MODEL", ""))
     use_kb = bool(payload.get("kb", False))
     kb_topk = int(payload.get("kb_topk", 4))
-
-    if use_kb and messages:
-        last_user = next((m for m in reversed(messages) if m.get("role") == "user"), None)
-        if last_user:
-            hits = search(last_user.get("content", ""), kb_topk)
-            if hits:
-                ctx = "\n\n".join([f"【片段{i+1} score={h['score']:.3f} 来自: {h['source']}】\n{h['text']}" for i,h in enumerate(hits)])
-                messages = [{"role":"system","content": "你可以使用下面的知识库片段回答问题，尽量引用片段编号。"}] +                            [{"role":"system","content": ctx}] + messages
+    weights = _kb_weights(payload)
 
     provider, default_model = build_provider(provider_key)
     if not model:
         model = default_model
-    text = ""
-    for piece in provider.stream_chat(messages, model=model):
-        text += piece
-    return JSONResponse({"provider": provider.name(), "model": model, "text": text})
+    last = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].get("role") == "user"), None)
+    query = messages[last].get("content", "") if last is not None else ""
+
+    scope, qvec, cached = (None, None, None)
+    if payload.get("cache", True):
+        scope, qvec, cached = await _cache_probe(query, provider_key, model, use_kb, kb_topk, weights, messages[:last])
+    if cached is not None:
+        return {"provider": provider.name(), "model": model, "text": cached.text, "cached": True}
+
+    if use_kb and query:
+        messages = await _kb_messages(query, kb_topk, weights) + messages
+
+    t0 = time.perf_counter()
+    pieces: List[str] = []
+    async for piece in _timed_stream(timings, provider.astream_chat(messages, model=model)):
+        pieces.append(piece)
+    if scope is not None and pieces:
+        get_semantic_cache().store(scope, qvec, query, pieces, time.perf_counter() - t0)
+    return {"provider": provider.name(), "model": model, "text": "".join(pieces), "cached": False}
+
+async def _send(ws: WebSocket, msg: Dict[str, Any]):
+    await ws.send_text(json.dumps(msg))
+
+async def _assistant_turn(ws: WebSocket, sess: Dict[str, Any], user_text: str, turn: int, timings: Timings):
+    ctx = sess["ctx"]
+    await _send(ws, {"type": "transcript", "text": user_text, "turn": turn})
+    history = ctx.history()
+    ctx.add("user", user_text)
+
+    provider, default_model = build_provider(sess["provider"])
+    use_model = sess["model"] or default_model
+    scope, qvec, cached = (None, None, None)
+    if sess["cache"]:
+        scope, qvec, cached = await _cache_probe(user_text, sess["provider"], use_model, sess["kb"], sess["kb_topk"], history=history)
+
+    tts, segmenter = None, None
+    spoken: List[Any] = []
+    tts_seconds = [0.0]
+    tts_key = f"{sess['tts']}:{sess['audio_format']}"
+    if sess["tts"] == "pyttsx3":
+        async def send_audio(seq: int, text: str, audio):
+            timings.mark("first_audio")
+            spoken.append((text, audio))
+            data, mime = audio
+            header = {"type": "audio_chunk", "turn": turn, "seq": seq, "text": text, "mime": mime}
+            if sess["audio_binary"]:
+                await ws.send_bytes(pack_frame(header, data))
+            else:
+                await _send(ws, {**header, "data": base64.b64encode(data).decode("utf-8")})
+        def synth(text: str):
+            t = time.perf_counter()
+            with timings.span("tts"):
+                audio = synthesize(text, sess["audio_format"])
+            tts_seconds[0] += time.perf_counter() - t
+            return audio
+        async def skip_audio(seq: int, text: str, error: Exception):
+            await _send(ws, {"type": "audio_skipped", "turn": turn, "seq": seq, "text": text, "error": str(error)})
+        segmenter = SentenceSegmenter()
+        tts = StreamingTTS(synth, send_audio, skip_audio)
+
+    assistant_text = ""
+    try:
+        if cached is not None:
+            await _send(ws, {"type": "status", "msg": "Answering from semantic cache"})
+            stream = _replay(cached.pieces)
+        else:
+            if sess["kb"]:
+                ctx.set_kb(await _kb_hits(user_text, sess["kb_topk"]), _cite)
+            else:
+                ctx.clear_kb()
+            local_messages = ctx.messages()
+            await _send(ws, {"type": "status", "msg": f"LLM streaming with {provider.name()} / {use_model} ({ctx.tokens()} context tokens) ..."})
+            stream = _timed_stream(timings, provider.astream_chat(local_messages, model=use_model))
+        cached_audio = cached.audio.get(tts_key) if cached is not None and tts else None
+        t0 = time.perf_counter()
+        pieces: List[str] = []
+        async for piece in stream:
+            pieces.append(piece)
+            assistant_text += piece
+            await _send(ws, {"type": "partial", "text": piece, "turn": turn})
+            if tts and cached_audio is None:
+                for seg in segmenter.feed(piece):
+                    tts.push(seg)
+        ctx.add("assistant", assistant_text)
+        ctx.maybe_summarize(provider, use_model)
+        await _send(ws, {"type": "final", "text": assistant_text, "turn": turn, "cached": cached is not None})
+        if cached is None and scope is not None and pieces:
+            cached = get_semantic_cache().store(scope, qvec, user_text, pieces, time.perf_counter() - t0)
+        if tts and cached_audio is not None:
+            tts.cancel()
+            get_semantic_cache().audio_hit(cached, tts_key)
+            for seq, (text, audio) in enumerate(cached_audio):
+                await send_audio(seq, text, audio)
+            await _send(ws, {"type": "audio_done", "turn": turn, "count": len(cached_audio)})
+        elif tts:
+            for seg in segmenter.flush():
+                tts.push(seg)
+            count = await tts.finish()
+            await _send(ws, {"type": "audio_done", "turn": turn, "count": count})
+            if cached is not None and len(spoken) == count:
+                cached.audio[tts_key] = spoken[:]
+                cached.audio_s[tts_key] = tts_seconds[0]
+    except asyncio.CancelledError:
+        if tts:
+            tts.cancel()
+        # keep what the user actually heard/read so the next turn has coherent history
+        if assistant_text and ctx.last_role != "assistant":
+            ctx.add("assistant", assistant_text)
+        raise
+
+async def _replay(pieces: List[str]):
+    for piece in pieces:
+        yield piece
+
+async def _run_turn(ws: WebSocket, sess: Dict[str, Any], user_text: str, turn: int, timings: Timings):
+    try:
+        with active(timings):
+            await _assistant_turn(ws, sess, user_text, turn, timings)
+    except asyncio.CancelledError:
+        timings.finish("cancelled")
+        raise
+    except Exception as e:
+        timings.finish("error")
+        try:
+            await _send(ws, {"type": "error", "msg": f"Server error: {e}"})
+        except Exception:
+            pass
+        return
+    timings.finish()
+    if sess["timings"]:
+        await _send(ws, {"type": "timings", "turn": turn, "ms": timings.to_dict()})
+
+async def _cancel_turn(ws: WebSocket, sess: Dict[str, Any]):
+    task = sess.get("turn_task")
+    if task is None or task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    await _send(ws, {"type": "turn_cancelled", "turn": sess["turn"]})
+
+async def _start_turn(ws: WebSocket, sess: Dict[str, Any], user_text: str, timings: Optional[Timings] = None):
+    # the turn runs as a task so the receive loop stays free for barge-in and cancel;
+    # timings started at end of speech carry the ASR stages into the turn
+    timings = timings or Timings("ws")
+    try:
+        await _cancel_turn(ws, sess)
+    except asyncio.CancelledError:
+        timings.finish("cancelled")
+        raise
+    sess["turn"] += 1
+    task = sess["turn_task"] = asyncio.create_task(_run_turn(ws, sess, user_text, sess["turn"], timings))
+    # a task cancelled before its first step never reaches _run_turn's handlers; finish() keeps the first outcome
+    task.add_done_callback(lambda _: timings.finish("cancelled"))
+
+async def _transcribe_clip(ws: WebSocket, sess: Dict[str, Any], b64: str, timings: Timings) -> Optional[str]:
+    if sess["asr"] == "openai":
+        try:
+            with timings.span("asr"):
+                return await run_in("io", transcribe_with_openai_base64, b64)
+        except Exception as e:
+            await _send(ws, {"type": "error", "msg": f"OpenAI ASR failed: {e}"})
+            return None
+    raw = base64.b64decode(b64)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as f:
+        f.write(raw)
+        webm = f.name
+    wav = webm.replace(".webm", ".wav")
+    try:
+        with timings.span("ffmpeg"):
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-y", "-i", webm, "-ac", "1", "-ar", "16000", wav,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            _, err = await proc.communicate()
+        if proc.returncode != 0:
+            lines = err.decode("utf-8", "ignore").strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else f"exit {proc.returncode}")
+    except Exception as e:
+        for path in (webm, wav):
+            if os.path.exists(path):
+                os.remove(path)
+        await _send(ws, {"type": "error", "msg": f"ffmpeg conversion failed: {e}"})
+        return None
+    try:
+        with timings.span("asr"):
+            return await run_in("asr", transcribe_with_faster_whisper, wav, os.getenv("FASTER_WHISPER_MODEL", "base"))
+    except Exception as e:
+        await _send(ws, {"type": "error", "msg": f"Local ASR failed: {e}"})
+        return None
+    finally:
+        for path in (webm, wav):
+            if os.path.exists(path):
+                os.remove(path)
+
+async def _end_of_speech(ws: WebSocket, sess: Dict[str, Any], asr: StreamingTranscriber):
+    audio = asr.utterance_audio()
+    asr.reset()
+    task = sess.pop("partial_task", None)
+    if task is not None:
+        task.cancel()
+    if not len(audio):
+        return
+    await _send(ws, {"type": "status", "msg": "Transcribing..."})
+    timings = Timings("ws")
+    try:
+        with timings.span("asr"):
+            if sess["asr"] == "openai":
+                b64 = base64.b64encode(float32_to_wav_bytes(audio)).decode("utf-8")
+                user_text = await run_in("io", transcribe_with_openai_base64, b64, "audio.wav")
+            else:
+                user_text = await run_in("asr", asr.decode_final, audio)
+    except asyncio.CancelledError:
+        timings.finish("cancelled")
+        raise
+    except Exception as e:
+        timings.finish("error")
+        await _send(ws, {"type": "error", "msg": f"ASR failed: {e}"})
+        return
+    user_text = (user_text or "").strip()
+    if user_text:
+        await _start_turn(ws, sess, user_text, timings)
+    else:
+        timings.finish("empty")
+
+async def _partial_transcript(ws: WebSocket, asr: StreamingTranscriber, audio):
+    try:
+        with span("asr_partial", "ws"):
+            text = await run_in("asr", asr.decode_partial, audio)
+        if text:
+            await _send(ws, {"type": "partial_transcript", "text": text})
+    except Exception:
+        pass
+
+async def _audio_frame(ws: WebSocket, sess: Dict[str, Any], asr: StreamingTranscriber, pcm: bytes):
+    for ev in asr.feed(pcm):
+        if ev == "start":
+            await _send(ws, {"type": "speech_start"})
+            if os.getenv("BARGE_IN", "1") == "1":
+                await _cancel_turn(ws, sess)
+        elif ev == "partial_due" and sess["asr"] != "openai":
+            # at most one partial decode in flight; skip ticks while the previous one runs
+            task = sess.get("partial_task")
+            if task is None or task.done():
+                sess["partial_task"] = asyncio.create_task(_partial_transcript(ws, asr, asr.utterance_audio()))
+        elif ev == "end":
+            await _end_of_speech(ws, sess, asr)
 
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket):
     await ws.accept()
-    messages: List[Dict[str, str]] = [
-        {"role": "system", "content": "You are a helpful assistant. Reply in the same language as the user."}
-    ]
-
-    provider_key = os.getenv("DEFAULT_PROVIDER", "aliyun")
-    model = os.getenv("DEFAULT_MODEL", "qwen-turbo")
-    asr_backend = os.getenv("DEFAULT_ASR_BACKEND", "faster_whisper")
-    tts_backend = os.getenv("DEFAULT_TTS_BACKEND", "pyttsx3")
-    kb_enabled = False
-    kb_topk = 4
+    sess: Dict[str, Any] = {
+        "ctx": new_context(SYSTEM_PROMPT),
+        "provider": os.getenv("DEFAULT_PROVIDER", "aliyun"),
+        "model": os.getenv("DEFAULT_MODEL", "qwen-turbo"),
+        "asr": os.getenv("DEFAULT_ASR_BACKEND", "faster_whisper"),
+        "tts": os.getenv("DEFAULT_TTS_BACKEND", "pyttsx3"),
+        "kb": False,
+        "kb_topk": 4,
+        "cache": True,
+        "audio_format": os.getenv("TTS_AUDIO_FORMAT", "wav"),
+        "audio_binary": False,
+        "timings": os.getenv("WS_TIMINGS", "0") == "1",
+        "turn": 0,
+        "turn_task": None,
+    }
+    asr = StreamingTranscriber(os.getenv("FASTER_WHISPER_MODEL", "base"))
+    WS_SESSIONS.inc()
 
     try:
         while True:
-            raw = await ws.receive_text()
-            data = json.loads(raw)
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(msg.get("code", 1000))
+            if msg.get("bytes") is not None:
+                # binary frames are 16 kHz mono PCM16LE audio
+                await _audio_frame(ws, sess, asr, msg["bytes"])
+                continue
+            data = json.loads(msg.get("text") or "{}")
 
             if data.get("type") == "config":
-                provider_key = data.get("provider", provider_key)
-                model = data.get("model", model)
-                asr_backend = data.get("asr", asr_backend)
-                tts_backend = data.get("tts", tts_backend)
-                kb_enabled = bool(data.get("kb", kb_enabled))
-                kb_topk = int(data.get("kb_topk", kb_topk))
-                await ws.send_text(json.dumps({"type": "info", "msg": f"Config updated: provider={provider_key}, model={model}, asr={asr_backend}, tts={tts_backend}, kb={kb_enabled}, kb_topk={kb_topk}"}))
+                sess["provider"] = data.get("provider", sess["provider"])
+                sess["model"] = data.get("model", sess["model"])
+                sess["asr"] = data.get("asr", sess["asr"])
+                sess["tts"] = data.get("tts", sess["tts"])
+                sess["kb"] = bool(data.get("kb", sess["kb"]))
+                sess["kb_topk"] = int(data.get("kb_topk", sess["kb_topk"]))
+                sess["cache"] = bool(data.get("cache", sess["cache"]))
+                if data.get("audio_format") in MIME:
+                    sess["audio_format"] = data["audio_format"]
+                sess["audio_binary"] = bool(data.get("audio_binary", sess["audio_binary"]))
+                sess["timings"] = bool(data.get("timings", sess["timings"]))
+                await _send(ws, {"type": "info", "msg": f"Config updated: provider={sess['provider']}, model={sess['model']}, asr={sess['asr']}, tts={sess['tts']}, kb={sess['kb']}, kb_topk={sess['kb_topk']}, audio={sess['audio_format']}{' (binary)' if sess['audio_binary'] else ''}"})
                 continue
 
             if data.get("type") == "user_text":
                 user_text = (data.get("text") or "").strip()
                 if not user_text:
-                    await ws.send_text(json.dumps({"type": "error", "msg": "Empty text."}))
+                    await _send(ws, {"type": "error", "msg": "Empty text."})
                     continue
-                messages.append({"role": "user", "content": user_text})
-                await ws.send_text(json.dumps({"type": "transcript", "text": user_text}))
-
-                local_messages = messages[:]
-                if kb_enabled:
-                    hits = search(user_text, kb_topk)
-                    if hits:
-                        ctx = "\n\n".join([f"【片段{i+1} score={h['score']:.3f} 来自: {h['source']}】\n{h['text']}" for i,h in enumerate(hits)])
-                        local_messages = [{"role":"system","content": "你可以使用下面的知识库片段回答问题，尽量引用片段编号。"}] +                                          [{"role":"system","content": ctx}] + local_messages
-
-                provider, default_model = build_provider(provider_key)
-                use_model = model or default_model
-                await ws.send_text(json.dumps({"type": "status", "msg": "LLM streaming..."}))
-
-                assistant_text = ""
-                for piece in provider.stream_chat(local_messages, model=use_model):
-                    assistant_text += piece
-                    await ws.send_text(json.dumps({"type": "partial", "text": piece}))
-
-                messages.append({"role": "assistant", "content": assistant_text})
-                await ws.send_text(json.dumps({"type": "final", "text": assistant_text}))
-
-                if tts_backend == "pyttsx3":
-                    wav = tts_to_wav_bytes(assistant_text)
-                    b64 = base64.b64encode(wav).decode("utf-8")
-                    await ws.send_text(json.dumps({"type": "audio_chunk", "data": b64, "mime": "audio/wav"}))
-                    await ws.send_text(json.dumps({"type": "audio_done"}))
+                await _start_turn(ws, sess, user_text)
+                continue
+
+            if data.get("type") == "cancel":
+                await _cancel_turn(ws, sess)
+                continue
+
+            if data.get("type") == "audio_frame":
+                await _audio_frame(ws, sess, asr, base64.b64decode(data.get("data", "")))
+                continue
+
+            if data.get("type") == "audio_end":
+                # client-side endpoint, e.g. push-to-talk released before the VAD fired
+                await _end_of_speech(ws, sess, asr)
                 continue
 
             if data.get("type") == "user_audio":
                 b64 = data.get("data", "")
                 if not b64:
-                    await ws.send_text(json.dumps({"type": "error", "msg": "No audio data."}))
+                    await _send(ws, {"type": "error", "msg": "No audio data."})
                     continue
 
-                await ws.send_text(json.dumps({"type": "status", "msg": "Transcribing..."}))
-                if asr_backend == "openai":
-                    try:
-                        user_text = transcribe_with_openai_base64(b64)
-                    except Exception as e:
-                        await ws.send_text(json.dumps({"type": "error", "msg": f"OpenAI ASR failed: {e}"}))
-                        continue
-                else:
-                    raw = base64.b64decode(b64)
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as f:
-                        f.write(raw)
-                        webm = f.name
-                    wav = webm.replace(".webm", ".wav")
-                    try:
-                        subprocess.run(["ffmpeg", "-y", "-i", webm, "-ac", "1", "-ar", "16000", wav],
-                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-                    except Exception as e:
-                        await ws.send_text(json.dumps({"type": "error", "msg": f"ffmpeg conversion failed: {e}"}))
-                        continue
-                    try:
-                        user_text = transcribe_with_faster_whisper(wav, os.getenv("FASTER_WHISPER_MODEL", "base"))
-                    except Exception as e:
-                        await ws.send_text(json.dumps({"type": "error", "msg": f"Local ASR failed: {e}"}))
-                        continue
-
-                user_text = (user_text or "").strip()
+                await _send(ws, {"type": "status", "msg": "Transcribing..."})
+                timings = Timings("ws")
+                try:
+                    user_text = await _transcribe_clip(ws, sess, b64, timings)
+                except asyncio.CancelledError:
+                    timings.finish("cancelled")
+                    raise
+                if user_text is None:
+                    timings.finish("error")
+                    continue
+                user_text = user_text.strip()
                 if not user_text:
-                    await ws.send_text(json.dumps({"type": "error", "msg": "ASR produced empty text."}))
+                    timings.finish("empty")
+                    await _send(ws, {"type": "error", "msg": "ASR produced empty text."})
                     continue
-
-                await ws.send_text(json.dumps({"type": "transcript", "text": user_text}))
-                messages.append({"role": "user", "content": user_text})
-
-                local_messages = messages[:]
-                if kb_enabled:
-                    hits = search(user_text, kb_topk)
-                    if hits:
-                        ctx = "\n\n".join([f"【片段{i+1} score={h['score']:.3f} 来自: {h['source']}】\n{h['text']}" for i,h in enumerate(hits)])
-                        local_messages = [{"role":"system","content": "你可以使用下面的知识库片段回答问题，尽量引用片段编号。"}] +                                          [{"role":"system","content": ctx}] + local_messages
-
-                provider, default_model = build_provider(provider_key)
-                use_model = model or default_model
-                await ws.send_text(json.dumps({"type": "status", "msg": f"LLM streaming with {provider.name()} / {use_model} ..."}))
-
-                assistant_text = ""
-                for piece in provider.stream_chat(local_messages, model=use_model):
-                    assistant_text += piece
-                    await ws.send_text(json.dumps({"type": "partial", "text": piece}))
-
-                messages.append({"role": "assistant", "content": assistant_text})
-                await ws.send_text(json.dumps({"type": "final", "text": assistant_text}))
-
-                if tts_backend == "pyttsx3":
-                    wav = tts_to_wav_bytes(assistant_text)
-                    b64out = base64.b64encode(wav).decode("utf-8")
-                    await ws.send_text(json.dumps({"type": "audio_chunk", "data": b64out, "mime": "audio/wav"}))
-                    await ws.send_text(json.dumps({"type": "audio_done"}))
+                await _start_turn(ws, sess, user_text, timings)
                 continue
 
             if data.get("type") == "reset":
-                messages = [{"role": "system", "content": "You are a helpful assistant. Reply in the same language as the user."}]
-                await ws.send_text(json.dumps({"type": "info", "msg": "Conversation reset."}))
+                await _cancel_turn(ws, sess)
+                sess["ctx"].reset()
+                asr.reset()
+                await _send(ws, {"type": "info", "msg": "Conversation reset."})
                 continue
 
-            await ws.send_text(json.dumps({"type": "error", "msg": f"Unknown message type: {data.get('type')}"}))
+            await _send(ws, {"type": "error", "msg": f"Unknown message type: {data.get('type')}"})
 
     except WebSocketDisconnect:
         return
     except Exception as e:
         try:
-            await ws.send_text(json.dumps({"type": "error", "msg": f"Server error: {e}"}))
+            await _send(ws, {"type": "error", "msg": f"Server error: {e}"})
         except Exception:
             pass
+    finally:
+        WS_SESSIONS.dec()
+        task = sess.get("turn_task")
+        if task is not None and not task.done():
+            task.cancel()
+        sess["ctx"].reset()
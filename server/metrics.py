@@ -0,0 +1,214 @@
+import os, time, bisect, logging, threading, contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Prometheus text exposition without the client library; stage histograms are fed by per-turn Timings,
+# point-in-time gauges (queues, caches, sessions) are rendered at scrape time from the existing stats.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+log = logging.getLogger(__name__)
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+def _num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}  # label values -> per-bucket counts + [sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for labels, s in series:
+            acc = 0
+            for b, c in zip(self.buckets, s):
+                acc += c
+                out.append(f"{self.name}_bucket{_labels(names, labels + (_num(b),))} {acc}")
+            out.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {s[-1]}")
+            out.append(f"{self.name}_sum{_labels(self.labels, labels)} {_num(s[-2])}")
+            out.append(f"{self.name}_count{_labels(self.labels, labels)} {s[-1]}")
+        return out
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return family(self.name, self.kind, self.help, [(dict(zip(self.labels, k)), v) for k, v in values])
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, n: float = 1):
+        self.inc(*labels, n=-n)
+
+def family(name: str, kind: str, help: str, samples: List[Tuple[Dict[str, str], float]]) -> List[str]:
+    out = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if value is None:
+            continue
+        out.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_num(value)}")
+    return out
+
+STAGE_SECONDS = Histogram("voice_stage_seconds", "Duration of one pipeline stage within a request or turn.", ("path", "stage"))
+QUEUE_WAIT = Histogram("voice_executor_wait_seconds", "Time spent waiting for a free worker in a stage executor.", ("stage",))
+TURNS = Counter("voice_turns_total", "Finished turns and requests by outcome.", ("path", "outcome"))
+WS_SESSIONS = Gauge("voice_ws_sessions", "Open /ws sessions.")
+
+def render(extra: Optional[List[str]] = None) -> str:
+    lines: List[str] = []
+    for m in (STAGE_SECONDS, QUEUE_WAIT, TURNS, WS_SESSIONS):
+        lines += m.render()
+    return "\n".join(lines + (extra or [])) + "\n"
+
+# optional OpenTelemetry export: OTEL_EXPORT=1 with opentelemetry-api installed; with the sdk and the
+# OTLP/HTTP exporter also installed a provider is set up here (OTEL_EXPORTER_OTLP_ENDPOINT etc. apply)
+_tracer = None
+_tracer_checked = False
+
+def _otel_tracer():
+    global _tracer, _tracer_checked
+    if _tracer_checked:
+        return _tracer
+    _tracer_checked = True
+    if os.getenv("OTEL_EXPORT", "0") != "1":
+        return None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        log.warning("OTEL_EXPORT=1 but opentelemetry-api is not installed; spans are not exported")
+        return None
+    if isinstance(trace.get_tracer_provider(), trace.ProxyTracerProvider):
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "voice-llm-starter")}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            trace.set_tracer_provider(provider)
+        except ImportError:
+            log.warning("opentelemetry-sdk / OTLP exporter not installed; relying on an externally configured provider")
+    _tracer = trace.get_tracer("voice-llm-starter")
+    return _tracer
+
+class Timings:
+    # stage durations of one turn or request; stages that repeat (e.g. tts per sentence) add up
+    def __init__(self, path: str):
+        self.path = path
+        self.t0 = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._root, self._ctx = None, None
+        self._finished = False
+        tracer = _otel_tracer()
+        if tracer is not None:
+            from opentelemetry import trace
+            self._root = tracer.start_span(f"{path}.turn")
+            self._ctx = trace.set_span_in_context(self._root)
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, self.path, stage)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        otel = _tracer.start_span(stage, context=self._ctx) if self._root is not None else None
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - t)
+            if otel is not None:
+                otel.end()
+
+    def mark(self, stage: str):
+        # time since the turn started, recorded once (first_token, first_audio, ...)
+        if stage in self.spans:
+            return
+        self.record(stage, time.perf_counter() - self.t0)
+        if self._root is not None:
+            self._root.add_event(stage)
+
+    def finish(self, outcome: str = "ok"):
+        # only the first call counts, so cleanup paths can finish("cancelled") unconditionally
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        self.mark("total")
+        TURNS.inc(self.path, outcome)
+        if self._root is not None:
+            self._root.set_attribute("outcome", outcome)
+            self._root.end()
+            self._root = None
+
+    def to_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {k: round(v * 1000, 1) for k, v in self.spans.items()}
+
+_current: contextvars.ContextVar = contextvars.ContextVar("timings", default=None)
+
+def current_timings() -> Optional[Timings]:
+    return _current.get()
+
+@contextmanager
+def active(timings: Timings) -> Iterator[Timings]:
+    # makes timings visible to span() in code it calls, including stage executors (they copy the context)
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def span(stage: str, path: str = "other") -> Iterator[None]:
+    t = _current.get()
+    if t is not None:
+        with t.span(stage):
+            yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, path, stage)
@@ -1,11 +1,41 @@
+import asyncio, threading
 from abc import ABC, abstractmethod
-from typing import Dict, List, Generator
+from typing import AsyncGenerator, Dict, List, Generator
 
 class LLMProvider(ABC):
     @abstractmethod
     def stream_chat(self, messages: List[Dict[str, str]], model: str, **kwargs) -> Generator[str, None, None]:
         ...
 
+    async def astream_chat(self, messages: List[Dict[str, str]], model: str, **kwargs) -> AsyncGenerator[str, None]:
+        # fallback for sync-only providers: drive stream_chat on a worker thread
+        loop = asyncio.get_running_loop()
+        queue: "asyncio.Queue" = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def pump():
+            try:
+                for piece in self.stream_chat(messages, model, **kwargs):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, piece)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        loop.run_in_executor(None, pump)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
     @abstractmethod
     def name(self) -> str:
         ...
@@ -0,0 +1,99 @@
+import os, hashlib, threading, importlib.util
+import httpx
+from typing import Dict, Optional, Tuple
+from openai import OpenAI, AsyncOpenAI
+
+# One sync + one async client per (provider, base_url, api_key), each with its own
+# keep-alive connection pool, so chat turns reuse warm TCP/TLS connections.
+
+class ConnStats:
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.errors = 0
+
+    def trace(self, event: str, info: Dict):
+        if event == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+        elif event.endswith(".failed"):
+            self.errors += 1
+
+    async def atrace(self, event: str, info: Dict):
+        self.trace(event, info)
+
+    def to_dict(self) -> Dict[str, int]:
+        reused = max(0, self.requests - self.new_connections)
+        return {"requests": self.requests, "new_connections": self.new_connections, "reused": reused,
+                "tls_handshakes": self.tls_handshakes, "errors": self.errors,
+                "reuse_rate": round(reused / self.requests, 4) if self.requests else 0.0}
+
+def _http2() -> bool:
+    return os.getenv("LLM_HTTP2", "0") == "1" and importlib.util.find_spec("h2") is not None
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60")),
+    )
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(float(os.getenv("LLM_TIMEOUT", "60")), connect=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")))
+
+class ClientPool:
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, str], Tuple[OpenAI, AsyncOpenAI, ConnStats]] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def get(self, provider: str, base_url: Optional[str], api_key: str) -> Tuple[OpenAI, AsyncOpenAI]:
+        key = (provider, base_url or "", hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16])
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = self._clients[key] = self._build(base_url, api_key)
+                self.created += 1
+            else:
+                self.reused += 1
+        return entry[0], entry[1]
+
+    def _build(self, base_url: Optional[str], api_key: str):
+        stats = ConnStats()
+
+        def on_request(request: httpx.Request):
+            stats.requests += 1
+            request.extensions["trace"] = stats.trace
+
+        async def on_arequest(request: httpx.Request):
+            stats.requests += 1
+            request.extensions["trace"] = stats.atrace
+
+        retries = int(os.getenv("LLM_MAX_RETRIES", "2"))
+        http2 = _http2()
+        sync_http = httpx.Client(limits=_limits(), timeout=_timeout(), http2=http2, event_hooks={"request": [on_request]})
+        async_http = httpx.AsyncClient(limits=_limits(), timeout=_timeout(), http2=http2, event_hooks={"request": [on_arequest]})
+        # the SDK retries connection errors, 408/409/429 and 5xx with exponential backoff
+        client = OpenAI(base_url=base_url, api_key=api_key, http_client=sync_http, max_retries=retries)
+        aclient = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=async_http, max_retries=retries)
+        return client, aclient, stats
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "clients_created": self.created,
+                "clients_reused": self.reused,
+                "http2": _http2(),
+                "pools": [{"provider": k[0], "base_url": k[1], **v[2].to_dict()} for k, v in self._clients.items()],
+            }
+
+_pool = ClientPool()
+
+def get_clients(provider: str, base_url: Optional[str], api_key: str) -> Tuple[OpenAI, AsyncOpenAI]:
+    return _pool.get(provider, base_url, api_key)
+
+def client_stats() -> Dict:
+    return _pool.stats()
@@ -1,29 +1,56 @@
-import os
+import os, threading
+from typing import Dict, Tuple
 from .openai_compatible import OpenAICompatibleProvider
 
+_providers: Dict[Tuple[str, str, str], OpenAICompatibleProvider] = {}
+_providers_lock = threading.Lock()
+
+# each provider's own model; DEFAULT_MODEL overrides it for a single-provider session only
+_MODELS = {"aliyun": "qwen-turbo", "openai": "gpt-4o-mini", "ollama": "llama3.1:8b-instruct", "lmstudio": "qwen2:7b-instruct"}
+
+def _provider(base_url: str, api_key: str, name: str) -> OpenAICompatibleProvider:
+    # providers are stateless wrappers around pooled clients; reuse them across turns
+    key = (name, base_url or "", api_key or "")
+    with _providers_lock:
+        p = _providers.get(key)
+        if p is None:
+            p = _providers[key] = OpenAICompatibleProvider(base_url, api_key, name)
+    return p
+
 def build_provider(provider_key: str):
     key = (provider_key or "").lower()
     if key == "aliyun":
         base = os.getenv("ALIYUN_BASE_URL")
         api = os.getenv("ALIYUN_API_KEY", "")
-        model = os.getenv("DEFAULT_MODEL", "qwen-turbo")
-        return OpenAICompatibleProvider(base, api, "aliyun"), model
+        model = os.getenv("DEFAULT_MODEL", _MODELS["aliyun"])
+        return _provider(base, api, "aliyun"), model
     if key == "openai":
         base = os.getenv("OPENAI_BASE_URL")
         api = os.getenv("OPENAI_API_KEY", "")
-        model = os.getenv("DEFAULT_MODEL", "gpt-4o-mini")
-        return OpenAICompatibleProvider(base, api, "openai"), model
+        model = os.getenv("DEFAULT_MODEL", _MODELS["openai"])
+        return _provider(base, api, "openai"), model
     if key == "ollama":
         base = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
         api = os.getenv("OLLAMA_API_KEY", "ollama")
-        model = os.getenv("DEFAULT_MODEL", "llama3.1:8b-instruct")
-        return OpenAICompatibleProvider(base, api, "ollama"), model
+        model = os.getenv("DEFAULT_MODEL", _MODELS["ollama"])
+        return _provider(base, api, "ollama"), model
     if key == "lmstudio":
         base = os.getenv("LMSTUDIO_BASE_URL", "http://localhost:1234/v1")
         api = os.getenv("LMSTUDIO_API_KEY", "lmstudio")
-        model = os.getenv("DEFAULT_MODEL", "qwen2:7b-instruct")
-        return OpenAICompatibleProvider(base, api, "lmstudio"), model
+        model = os.getenv("DEFAULT_MODEL", _MODELS["lmstudio"])
+        return _provider(base, api, "lmstudio"), model
+    if key in ("router", "auto"):
+        # each backend streams with its own model; the model argument is ignored
+        from .routing import build_router
+        spec = os.getenv("ROUTER_BACKENDS", "aliyun,openai,ollama")
+        if any(x.strip().partition("=")[0].lower() in ("router", "auto") for x in spec.split(",")):
+            raise ValueError("ROUTER_BACKENDS cannot contain router/auto")
+        return build_router(spec, build_provider, provider_model), "auto"
     base = os.getenv("OPENAI_BASE_URL")
     api = os.getenv("OPENAI_API_KEY", "")
-    model = os.getenv("DEFAULT_MODEL", "gpt-4o-mini")
-    return OpenAICompatibleProvider(base, api, "openai"), model
+    model = os.getenv("DEFAULT_MODEL", _MODELS["openai"])
+    return _provider(base, api, "openai"), model
+
+def provider_model(provider_key: str) -> str:
+    # the provider's own default model, ignoring DEFAULT_MODEL (which names one provider's model)
+    return _MODELS.get((provider_key or "").lower(), _MODELS["openai"])
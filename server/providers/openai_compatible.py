@@ -1,10 +1,10 @@
-from typing import Dict, List, Generator
-from openai import OpenAI
+from typing import AsyncGenerator, Dict, List, Generator
 from .base import LLMProvider
+from .clients import get_clients
 
 class OpenAICompatibleProvider(LLMProvider):
     def __init__(self, base_url: str, api_key: str, provider_name: str):
-        self.client = OpenAI(base_url=base_url, api_key=api_key)
+        self.client, self.aclient = get_clients(provider_name, base_url, api_key)
         self._name = provider_name
 
     def name(self) -> str:
@@ -25,3 +25,23 @@ class OpenAICompatibleProvider(LLMProvider):
                     yield delta.content
             except Exception:
                 continue
+
+    async def astream_chat(self, messages: List[Dict[str, str]], model: str, **kwargs) -> AsyncGenerator[str, None]:
+        stream = await self.aclient.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            temperature=kwargs.get("temperature", 0.3),
+            top_p=kwargs.get("top_p", 1.0),
+        )
+        try:
+            async for chunk in stream:
+                try:
+                    delta = chunk.choices[0].delta
+                    if delta and delta.content:
+                        yield delta.content
+                except Exception:
+                    continue
+        finally:
+            # closes the HTTP response when the consumer stops early (barge-in, cancel)
+            await stream.close()
@@ -0,0 +1,285 @@
+import os, time, asyncio, threading
+from typing import AsyncGenerator, Dict, Generator, List, Optional
+from .base import LLMProvider
+
+_DONE = object()
+
+class BackendStats:
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.ttft: Optional[float] = None
+        self.tps: Optional[float] = None
+        self.failures = 0
+        self.open_until = 0.0  # 0 while the circuit is closed
+        self.probing = False  # half-open: the single trial request is in flight
+        self.requests = 0
+        self.wins = 0
+        self.errors = 0
+
+    def _ewma(self, old: Optional[float], x: float) -> float:
+        return x if old is None else (1 - self.alpha) * old + self.alpha * x
+
+    def observe_ttft(self, seconds: float):
+        self.ttft = self._ewma(self.ttft, seconds)
+
+    def observe_late(self, seconds: float, step: bool = True):
+        # still no first token after `seconds`: a lower bound, so the estimate is raised to at least it
+        # (step=False when this request already counted one sample)
+        self.ttft = max(self._ewma(self.ttft, seconds) if step else (self.ttft or 0.0), seconds)
+
+    def observe_success(self, tokens: int, gen_seconds: float):
+        self.close()
+        if tokens > 1 and gen_seconds > 0:
+            self.tps = self._ewma(self.tps, tokens / gen_seconds)
+
+    def observe_failure(self, threshold: int, cooldown: float):
+        self.errors += 1
+        self.failures += 1
+        if self.probing or self.failures >= threshold:
+            # circuit (re)opens; after the cooldown a single trial request is let through (half-open)
+            self.open_until = time.monotonic() + cooldown
+            self.probing = False
+
+    def close(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def state(self) -> str:
+        if not self.open_until:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def healthy(self) -> bool:
+        # routable: closed, or half-open with the trial request still unclaimed
+        state = self.state()
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def acquire(self) -> bool:
+        # called right before sending; in half-open only the first caller gets through
+        state = self.state()
+        if state == "closed":
+            return True
+        if state == "open" or self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def release(self):
+        # the trial request ended without a verdict (cancelled): let the next request probe
+        self.probing = False
+
+    def to_dict(self) -> Dict:
+        return {"ttft_ms": round(self.ttft * 1000, 1) if self.ttft is not None else None,
+                "tokens_per_s": round(self.tps, 1) if self.tps is not None else None,
+                "healthy": self.healthy(), "state": self.state(), "consecutive_failures": self.failures,
+                "requests": self.requests, "wins": self.wins, "errors": self.errors}
+
+class Backend:
+    def __init__(self, provider: LLMProvider, model: str, alpha: float):
+        self.provider = provider
+        self.model = model
+        self.stats = BackendStats(alpha)
+
+    @property
+    def label(self) -> str:
+        return f"{self.provider.name()}/{self.model}"
+
+class RoutingProvider(LLMProvider):
+    def __init__(self, backends: List[Backend], hedge_ms: float = 0, fail_threshold: int = 3,
+                 cooldown_s: float = 30.0, tokens_weight: float = 20.0):
+        self.backends = backends
+        self.hedge_s = hedge_ms / 1000.0
+        self.fail_threshold = fail_threshold
+        self.cooldown_s = cooldown_s
+        # ranking = expected time to first token + time to speak the first ~sentence
+        self.tokens_weight = tokens_weight
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def name(self) -> str:
+        return "router"
+
+    def _score(self, b: Backend, default_tps: Optional[float]) -> float:
+        if b.stats.ttft is None:
+            return 0.0  # unmeasured backends go first once, so every backend gets an estimate
+        tps = b.stats.tps or default_tps
+        return b.stats.ttft + (self.tokens_weight / tps if tps else 0.0)
+
+    def ranked(self) -> List[Backend]:
+        healthy = [b for b in self.backends if b.stats.healthy()]
+        # if every circuit is open, still try the least recently failed backend
+        pool = healthy or sorted(self.backends, key=lambda b: b.stats.open_until)[:1]
+        known = [b.stats.tps for b in self.backends if b.stats.tps]
+        default_tps = sum(known) / len(known) if known else None
+        return sorted(pool, key=lambda b: self._score(b, default_tps))
+
+    async def _pump(self, b: Backend, messages, kwargs, queue: "asyncio.Queue", tag: int, noted: set):
+        # noted: tags whose TTFT was already recorded as a lower bound when a hedge fired
+        b.stats.requests += 1
+        t0 = time.monotonic()
+        first = None
+        n = 0
+        try:
+            async for piece in b.provider.astream_chat(messages, b.model, **kwargs):
+                if first is None:
+                    first = time.monotonic()
+                    if tag in noted:
+                        b.stats.observe_late(first - t0, step=False)
+                    else:
+                        b.stats.observe_ttft(first - t0)
+                    b.stats.close()  # a backend that streams is healthy
+                n += 1
+                queue.put_nowait((tag, piece))
+            b.stats.observe_success(n, time.monotonic() - (first or t0))
+            queue.put_nowait((tag, _DONE))
+        except asyncio.CancelledError:
+            if first is None:
+                # lost a hedge without producing anything: its TTFT is at least this long
+                b.stats.observe_late(time.monotonic() - t0, step=tag not in noted)
+                b.stats.release()
+            raise
+        except Exception as e:
+            b.stats.observe_failure(self.fail_threshold, self.cooldown_s)
+            queue.put_nowait((tag, e))
+
+    async def astream_chat(self, messages: List[Dict[str, str]], model: str, **kwargs) -> AsyncGenerator[str, None]:
+        ranked = self.ranked()
+        forced = not ranked[0].stats.healthy()  # every circuit is open
+        queue: "asyncio.Queue" = asyncio.Queue()
+        tasks: Dict[int, asyncio.Task] = {}
+        next_i = 0
+        hedged = False
+        noted: set = set()
+        launched: Dict[int, float] = {}
+        last_error: Optional[Exception] = None
+
+        def launch() -> bool:
+            # next backend that may take a request; a half-open one whose probe is taken is skipped
+            nonlocal next_i
+            while next_i < len(ranked):
+                i = next_i
+                next_i += 1
+                if forced or ranked[i].stats.acquire():
+                    tasks[i] = asyncio.create_task(self._pump(ranked[i], messages, kwargs, queue, i, noted))
+                    launched[i] = time.monotonic()
+                    return True
+            return False
+
+        if not launch():
+            raise RuntimeError("no routed backend accepted the request")
+        winner = None
+        try:
+            while winner is None:
+                can_hedge = self.hedge_s > 0 and not hedged and next_i < len(ranked)
+                try:
+                    tag, item = await asyncio.wait_for(queue.get(), self.hedge_s if can_hedge else None)
+                except asyncio.TimeoutError:
+                    # first token is late: race the next-best backend and keep whichever answers first
+                    hedged = True
+                    # the late backend is slow now, not only once this request is over: concurrent
+                    # requests should already rank it lower
+                    for t in tasks:
+                        ranked[t].stats.observe_late(time.monotonic() - launched[t])
+                        noted.add(t)
+                    if launch():
+                        self.hedges += 1
+                    continue
+                if isinstance(item, Exception):
+                    # failed before its first token: fail over to the next backend
+                    last_error = item
+                    tasks.pop(tag, None)
+                    if not tasks and not launch():
+                        raise last_error
+                    continue
+                winner = tag
+                ranked[tag].stats.wins += 1
+                if tag > 0 and hedged:
+                    self.hedge_wins += 1
+                for t, task in list(tasks.items()):
+                    if t != tag:
+                        task.cancel()
+                if item is _DONE:
+                    return
+                yield item
+            while True:
+                tag, item = await queue.get()
+                if tag != winner:
+                    continue
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    def stream_chat(self, messages: List[Dict[str, str]], model: str, **kwargs) -> Generator[str, None, None]:
+        # sync path: latency-ordered failover without hedging
+        last_error: Optional[Exception] = None
+        ranked = self.ranked()
+        forced = not ranked[0].stats.healthy()
+        for b in ranked:
+            if not (forced or b.stats.acquire()):
+                continue
+            b.stats.requests += 1
+            t0 = time.monotonic()
+            first = None
+            n = 0
+            try:
+                for piece in b.provider.stream_chat(messages, b.model, **kwargs):
+                    if first is None:
+                        first = time.monotonic()
+                        b.stats.observe_ttft(first - t0)
+                        b.stats.close()
+                        b.stats.wins += 1
+                    n += 1
+                    yield piece
+                b.stats.observe_success(n, time.monotonic() - (first or t0))
+                return
+            except GeneratorExit:
+                if first is None:
+                    b.stats.release()
+                raise
+            except Exception as e:
+                b.stats.observe_failure(self.fail_threshold, self.cooldown_s)
+                if first is not None:
+                    raise
+                last_error = e
+        if last_error is not None:
+            raise last_error
+        raise RuntimeError("no routed backend accepted the request")
+
+    def stats(self) -> Dict:
+        return {"hedge_ms": self.hedge_s * 1000, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                "backends": {b.label: b.stats.to_dict() for b in self.backends}}
+
+_routers: Dict[str, RoutingProvider] = {}
+_routers_lock = threading.Lock()
+
+def build_router(spec: str, build_provider, provider_model) -> RoutingProvider:
+    # spec: "aliyun,openai=gpt-4o-mini,ollama=llama3.1:8b-instruct"; model defaults to the provider's own
+    # (provider_model), never to DEFAULT_MODEL, which names a model of one provider only
+    with _routers_lock:
+        router = _routers.get(spec)
+        if router is None:
+            alpha = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+            backends = []
+            for item in [x.strip() for x in spec.split(",") if x.strip()]:
+                key, _, model = item.partition("=")
+                provider, _ = build_provider(key)
+                backends.append(Backend(provider, model or provider_model(key), alpha))
+            if not backends:
+                raise ValueError("ROUTER_BACKENDS is empty")
+            router = _routers[spec] = RoutingProvider(
+                backends,
+                hedge_ms=float(os.getenv("ROUTER_HEDGE_MS", "0")),
+                fail_threshold=int(os.getenv("ROUTER_FAIL_THRESHOLD", "3")),
+                cooldown_s=float(os.getenv("ROUTER_COOLDOWN_S", "30")),
+                tokens_weight=float(os.getenv("ROUTER_TOKENS_WEIGHT", "20")),
+            )
+    return router
+
+def router_stats() -> Dict:
+    return {spec: r.stats() for spec, r in list(_routers.items())}
@@ -0,0 +1,86 @@
+import sys, json, time, argparse
+import numpy as np
+import faiss
+from typing import Dict, List, Optional, Tuple
+from .index_factory import MODES, build_index, search_params, trainable
+
+def _queries(vecs: np.ndarray, nq: int, noise: float = 0.05) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    q = np.asarray(vecs[rng.choice(len(vecs), min(nq, len(vecs)), replace=False)], dtype=np.float32)
+    q = q + rng.normal(0, noise, q.shape).astype(np.float32)
+    faiss.normalize_L2(q)
+    return q
+
+def _timed_search(index, q: np.ndarray, k: int, params) -> Tuple[np.ndarray, List[float]]:
+    ids, lat = [], []
+    for row in q:
+        t0 = time.perf_counter()
+        _, I = index.search(row[None, :], k, params=params)
+        lat.append((time.perf_counter() - t0) * 1000)
+        ids.append(I[0])
+    return np.stack(ids), lat
+
+def recall_at_k(truth: np.ndarray, found: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(t) & set(f)) / k for t, f in zip(truth.tolist(), found.tolist())]))
+
+def benchmark(vecs: np.ndarray, k: int = 10, nq: int = 200, modes: Optional[List[str]] = None,
+              nprobes=(1, 4, 16, 64), ef_searches=(16, 32, 64, 128)) -> List[Dict]:
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    q = _queries(vecs, nq)
+    flat = build_index("flat", vecs)
+    truth, lat = _timed_search(flat, q, k, None)
+    rows = [{"mode": "flat", "param": None, "recall": 1.0, "p50_ms": float(np.percentile(lat, 50)),
+             "p95_ms": float(np.percentile(lat, 95)), "build_s": 0.0}]
+    for mode in modes or [m for m in MODES if m != "flat"]:
+        # build_index quietly falls back to flat below the IVF training minimum; don't label that as IVF
+        if mode not in MODES or not trainable(mode, len(vecs)):
+            rows.append({"mode": mode, "skipped": "unknown mode" if mode not in MODES else f"too few vectors ({len(vecs)}) to train"})
+            continue
+        t0 = time.perf_counter()
+        index = build_index(mode, vecs)
+        build_s = time.perf_counter() - t0
+        knobs = [("ef_search", v) for v in ef_searches] if mode == "hnsw" else [("nprobe", v) for v in nprobes]
+        for name, v in knobs:
+            params = search_params(index, **{name: v})
+            found, lat = _timed_search(index, q, k, params)
+            rows.append({"mode": mode, "param": {name: v}, "recall": recall_at_k(truth, found),
+                         "p50_ms": float(np.percentile(lat, 50)), "p95_ms": float(np.percentile(lat, 95)),
+                         "build_s": build_s})
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="recall@k vs latency of KB index modes against exact flat search")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--modes", default="", help="comma separated subset of " + ",".join(MODES[1:]))
+    ap.add_argument("--synthetic", type=int, default=0, help="benchmark N random vectors instead of the KB")
+    ap.add_argument("--dim", type=int, default=512)
+    ap.add_argument("--json", default="", help="write results to this file")
+    args = ap.parse_args(argv)
+
+    if args.synthetic:
+        vecs = np.random.default_rng(0).normal(size=(args.synthetic, args.dim)).astype(np.float32)
+        faiss.normalize_L2(vecs)
+    else:
+        from .vectorstore import get_store
+        vecs = get_store().snapshot().meta.vectors()
+        if vecs is None:
+            print("KB has no stored vectors; ingest documents or use --synthetic N")
+            return 1
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()] or None
+    rows = benchmark(vecs, k=args.k, nq=args.queries, modes=modes)
+    print(f"n={len(vecs)} dim={vecs.shape[1]} k={args.k}")
+    for r in rows:
+        if r.get("skipped"):
+            print(f"{r['mode']:<9} skipped: {r['skipped']}")
+            continue
+        param = ",".join(f"{k}={v}" for k, v in (r["param"] or {}).items()) or "-"
+        print(f"{r['mode']:<9} {param:<14} recall@{args.k}={r['recall']:.3f}  p50={r['p50_ms']:.3f}ms  p95={r['p95_ms']:.3f}ms  build={r['build_s']:.1f}s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"n": len(vecs), "dim": int(vecs.shape[1]), "k": args.k, "results": rows}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import os, re, sqlite3, hashlib, threading, unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+_WS = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, space_id: str, max_items: int = 20000, db_path: Optional[str] = None):
+        self.space_id = space_id
+        self.max_items = max_items
+        self._mem: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()  # memory LRU and counters only
+        self._db_lock = threading.Lock()  # the shared sqlite connection; never held with _lock
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS emb (space TEXT, h TEXT, vec BLOB, PRIMARY KEY (space, h))")
+        self.mem_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.deduped = 0
+
+    def get_many(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        out, missing = {}, []
+        with self._lock:
+            for h in hashes:
+                v = self._mem.get(h)
+                if v is not None:
+                    self._mem.move_to_end(h)
+                    out[h] = v
+                else:
+                    missing.append(h)
+            self.mem_hits += len(out)
+        disk = {}
+        if missing and self._db is not None:
+            with self._db_lock:
+                for i in range(0, len(missing), 500):
+                    part = missing[i:i + 500]
+                    q = f"SELECT h, vec FROM emb WHERE space=? AND h IN ({','.join('?' * len(part))})"
+                    for h, blob in self._db.execute(q, [self.space_id, *part]):
+                        disk[h] = np.frombuffer(blob, dtype=np.float32)
+        with self._lock:
+            for h, v in disk.items():
+                self._remember(h, v)
+            self.disk_hits += len(disk)
+            self.misses += len(missing) - len(disk)
+        out.update(disk)
+        return out
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        # own copies, so a cached row does not keep the caller's whole batch array alive
+        items = {h: np.array(v, dtype=np.float32) for h, v in items.items()}
+        with self._lock:
+            for h, v in items.items():
+                self._remember(h, v)
+        if self._db is not None and items:
+            rows = [(self.space_id, h, v.tobytes()) for h, v in items.items()]
+            with self._db_lock:
+                # autocommit connection: one explicit transaction, so a batch costs one commit, not one per row
+                self._db.execute("BEGIN")
+                try:
+                    self._db.executemany("INSERT OR REPLACE INTO emb (space, h, vec) VALUES (?, ?, ?)", rows)
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+                self._db.execute("COMMIT")
+
+    def _remember(self, h: str, v: np.ndarray):
+        self._mem[h] = v
+        self._mem.move_to_end(h)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> Dict:
+        looked_up = self.mem_hits + self.disk_hits + self.misses
+        return {
+            "space_id": self.space_id,
+            "mem_items": len(self._mem),
+            "mem_hits": self.mem_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "deduped": self.deduped,
+            "hit_rate": round((self.mem_hits + self.disk_hits) / looked_up, 4) if looked_up else 0.0,
+        }
+
+class CachedEmbedder:
+    def __init__(self, inner, cache: EmbeddingCache):
+        self.inner = inner
+        self.cache = cache
+        self.model_name = getattr(inner, "model_name", "")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        # normalized text is only the cache key; the model sees the original text, as uncached
+        hashes = [text_hash(normalize_text(t)) for t in texts]
+        unique = list(dict.fromkeys(hashes))
+        self.cache.deduped += len(hashes) - len(unique)
+        found = self.cache.get_many(unique)
+        todo = [h for h in unique if h not in found]
+        if todo:
+            first: Dict[str, str] = {}
+            for h, t in zip(hashes, texts):
+                first.setdefault(h, t)
+            vecs = np.asarray(self.inner.embed([first[h] for h in todo]), dtype=np.float32)
+            fresh = {h: vecs[i] for i, h in enumerate(todo)}
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        if not hashes:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[h] for h in hashes]).astype(np.float32, copy=False)
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+def get_cache(space_id: str) -> EmbeddingCache:
+    cache = _caches.get(space_id)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(space_id)
+            if cache is None:
+                db_path = None
+                if os.getenv("EMBED_CACHE_DISK", "1") == "1":
+                    db_path = os.path.join(os.getenv("KB_DIR", "./kb"), "embed_cache.sqlite")
+                cache = _caches[space_id] = EmbeddingCache(
+                    space_id, max_items=int(os.getenv("EMBED_CACHE_MEM_ITEMS", "20000")), db_path=db_path)
+    return cache
+
+def cache_stats() -> List[Dict]:
+    return [c.stats() for c in list(_caches.values())]
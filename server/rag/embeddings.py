@@ -2,7 +2,9 @@ import os, hashlib
 import numpy as np
 from typing import List
 from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+from server.providers.clients import get_clients
+from server.registry import get_registry
+from .embed_cache import CachedEmbedder, get_cache
 
 def _l2_normalize(x: np.ndarray) -> np.ndarray:
     n = np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
@@ -11,7 +13,11 @@ def _l2_normalize(x: np.ndarray) -> np.ndarray:
 class LocalEmbeddings:
     def __init__(self, model_name: str):
         self.model_name = model_name
-        self.model = SentenceTransformer(model_name)
+        device = os.getenv("EMBED_DEVICE") or None
+        self.model = get_registry().get(
+            "embed", model_name, device or "auto",
+            lambda: SentenceTransformer(model_name, device=device),
+        )
 
     def embed(self, texts: List[str]) -> np.ndarray:
         embs = self.model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
@@ -19,7 +25,7 @@ class LocalEmbeddings:
 
 class OpenAICompatEmbeddings:
     def __init__(self, base_url: str, api_key: str, model_name: str):
-        self.client = OpenAI(base_url=base_url, api_key=api_key)
+        self.client, _ = get_clients("embeddings", base_url, api_key)
         self.model_name = model_name
 
     def embed(self, texts: List[str]) -> np.ndarray:
@@ -34,6 +40,12 @@ class OpenAICompatEmbeddings:
         return _l2_normalize(arr)
 
 def build_embedder():
+    embedder = _build_raw_embedder()
+    if os.getenv("EMBED_CACHE", "1") == "1":
+        return CachedEmbedder(embedder, get_cache(emb_space_id()))
+    return embedder
+
+def _build_raw_embedder():
     backend = os.getenv("EMBEDDING_BACKEND", "local").lower()
     if backend == "openai_compat":
         base_url = os.getenv("OPENAI_BASE_URL") or os.getenv("ALIYUN_BASE_URL")
@@ -0,0 +1,94 @@
+import os, math
+import numpy as np
+import faiss
+from typing import Optional
+
+MODES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+def _want_nlist(n: int) -> int:
+    return int(os.getenv("KB_IVF_NLIST", "0")) or max(1, int(4 * math.sqrt(max(n, 1))))
+
+def _nlist(n: int) -> int:
+    # faiss wants ~39 training points per centroid
+    return max(1, min(_want_nlist(n), n // 39 or 1))
+
+def trainable(mode: str, n: int) -> bool:
+    # IVF needs ~39 points per centroid at the nlist it would use; PQ8 has 256 centroids per sub-quantizer
+    if mode not in ("ivf_flat", "ivf_pq"):
+        return True
+    return n >= 39 * max(_want_nlist(n), 256 if mode == "ivf_pq" else 1)
+
+def _pq_m(dim: int) -> int:
+    m = int(os.getenv("KB_PQ_M", "0")) or max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+def target_mode(n: int) -> str:
+    mode = os.getenv("KB_INDEX_MODE", "auto").lower()
+    if mode not in MODES:
+        # auto: exact search while small, then promote to a trained ANN index
+        if n < int(os.getenv("KB_AUTO_PROMOTE_AT", "50000")):
+            return "flat"
+        mode = os.getenv("KB_AUTO_INDEX", "hnsw").lower()
+        mode = mode if mode in MODES else "hnsw"
+    # stay exact until there is enough data to train the IVF coarse quantizer well
+    return mode if trainable(mode, n) else "flat"
+
+def needs_retrain(index, n: int) -> bool:
+    # IVF centroids are trained once; retrain when the corpus has grown into the next nlist tier (2x)
+    ivf = faiss.try_extract_index_ivf(index) if index is not None else None
+    return ivf is not None and _nlist(n) >= 2 * ivf.nlist
+
+def index_mode(index) -> str:
+    if index is None:
+        return ""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+def is_id_mapped(index) -> bool:
+    # IVF indexes store ids natively; flat and HNSW need an IDMap wrapper
+    return isinstance(index, faiss.IndexIDMap) or faiss.try_extract_index_ivf(index) is not None
+
+def describe(mode: str, dim: int, n: int) -> str:
+    if mode == "ivf_flat":
+        return f"IVF{_nlist(n)},Flat"
+    if mode == "ivf_pq":
+        return f"IVF{_nlist(n)},PQ{_pq_m(dim)}"
+    if mode == "hnsw":
+        return f"HNSW{int(os.getenv('KB_HNSW_M', '32'))}"
+    return "Flat"
+
+def build_index(mode: str, vecs: np.ndarray, ids: Optional[np.ndarray] = None):
+    n, dim = vecs.shape
+    if not trainable(mode, n):
+        mode = "flat"
+    if ids is None:
+        ids = np.arange(n, dtype=np.int64)
+    index = faiss.index_factory(dim, describe(mode, dim, n), faiss.METRIC_INNER_PRODUCT)
+    if mode == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = int(os.getenv("KB_HNSW_EF_CONSTRUCTION", "80"))
+    if mode in ("flat", "hnsw"):
+        index = faiss.IndexIDMap2(index)
+    if not index.is_trained:
+        sample = int(os.getenv("KB_TRAIN_SAMPLE", "100000"))
+        train = vecs if n <= sample else vecs[np.random.default_rng(0).choice(n, sample, replace=False)]
+        index.train(np.ascontiguousarray(train, dtype=np.float32))
+    step = 65536
+    for i in range(0, n, step):
+        index.add_with_ids(np.ascontiguousarray(vecs[i:i + step], dtype=np.float32), np.ascontiguousarray(ids[i:i + step], dtype=np.int64))
+    return index
+
+def search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    mode = index_mode(index)
+    if mode in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe or os.getenv("KB_NPROBE", "16")))
+    if mode == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search or os.getenv("KB_EF_SEARCH", "64")))
+    return None
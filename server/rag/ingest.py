@@ -1,44 +1,296 @@
-import os
-from typing import List, Dict
+import os, re, bisect
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from pypdf import PdfReader
+from server.tokens import count_tokens
 
-def read_text_from_file(path: str) -> str:
+# headings: markdown "#", or a short standalone line (blank line after it) that is not a list item
+# and does not end like a sentence; "1. 打开设置" / "一、…" / "- …" are list items and stay body text
+_MD_HEADING = re.compile(r"^(#{1,6})\s+(\S.*)$")
+_LIST_ITEM = re.compile(r"^(?:[-*+•·▪]\s|\d+[.)、．](?!\d)|[一二三四五六七八九十]+[、.．]|[（(][0-9一二三四五六七八九十]+[)）]"
+                        r"|[a-zA-Z][.)]\s|[①-⑳])")
+# explicit levels for the breadcrumb: "1.2.3 Title" -> 3, 第X章 -> 1, 第X节 -> 2
+_NUMBERED = re.compile(r"^(\d+(?:\.\d+){0,3})\s+\S")
+_CHAPTER = re.compile(r"^第[一二三四五六七八九十百千零〇0-9]+([章篇部节条])")
+_CHAPTER_LEVEL = {"章": 1, "篇": 1, "部": 1, "节": 2, "条": 3}
+_HEADING_MAX_CHARS = 60
+_SENTENCE_END = "。！？；…!?;.,，：:"
+_STOP = "。！？；…!?;."
+# split after CJK sentence punctuation, or after .!?; followed by whitespace (keeps "3.14" intact)
+_SENTENCE = re.compile(r"(?<=[。！？；…])|(?<=[.!?;])\s+")
+_CLAUSE = re.compile(r"(?<=[，、：,:])")
+# a paragraph longer than this (no blank lines) hands its complete sentences on instead of growing
+_PARA_MAX_CHARS = 65536
+_CJK = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+Block = Tuple[Optional[int], str]  # (1-based page or None, text)
+
+def iter_blocks(path: str) -> Iterator[Block]:
+    # one page (PDF) or one ~64 KB slice of whole lines (text) at a time, never the whole file;
+    # paragraphs and sentences may continue into the next block
     ext = os.path.splitext(path)[1].lower()
-    if ext in [".txt", ".md", ".markdown"]:
-        return open(path, "r", encoding="utf-8", errors="ignore").read()
     if ext == ".pdf":
-        txt = []
         try:
             reader = PdfReader(path)
-            for p in reader.pages:
-                txt.append(p.extract_text() or "")
-            return "\n".join(txt)
+            for i, page in enumerate(reader.pages):
+                try:
+                    text = page.extract_text() or ""
+                except Exception:
+                    text = ""
+                if text.strip():
+                    yield i + 1, text
         except Exception:
-            return ""
+            return
+        return
     try:
-        return open(path, "r", encoding="utf-8", errors="ignore").read()
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            lines: List[str] = []
+            size = 0
+            for line in f:
+                lines.append(line)
+                size += len(line)
+                if size >= 65536:
+                    yield None, "".join(lines)
+                    lines, size = [], 0
+            if lines:
+                yield None, "".join(lines)
     except Exception:
+        return
+
+def read_text_from_file(path: str) -> str:
+    return "\n".join(text for _, text in iter_blocks(path))
+
+def _heading(line: str, standalone: bool) -> Optional[Tuple[int, str]]:
+    # -> (level, title); level 0 means "below the last explicitly levelled heading"
+    m = _MD_HEADING.match(line)
+    if m:
+        return len(m.group(1)), m.group(2).strip()
+    if not standalone or len(line) > _HEADING_MAX_CHARS or line[-1] in _SENTENCE_END or _LIST_ITEM.match(line):
+        return None
+    m = _NUMBERED.match(line)
+    if m:
+        return m.group(1).count(".") + 1, line
+    m = _CHAPTER.match(line)
+    return (_CHAPTER_LEVEL[m.group(1)] if m else 0), line
+
+def _joiner(left: str, right: str) -> str:
+    # PDF lines are hard-wrapped: rejoin CJK without a space, Latin with one
+    if not left or not right:
         return ""
+    return "" if _CJK.match(left[-1]) or _CJK.match(right[0]) else " "
+
+def _hard_split(text: str, max_tokens: int) -> Iterator[str]:
+    # every cut counts tokens in a bounded window, so an unbroken run is split in linear time
+    window = max(max_tokens, 16) * 8
+    while text:
+        head = text[:window]
+        n = count_tokens(head)
+        if n <= max_tokens and len(head) == len(text):
+            yield text
+            return
+        cut = len(head) if n <= max_tokens else max(1, len(head) * max_tokens // n)
+        while cut > 1 and count_tokens(head[:cut]) > max_tokens:
+            cut = cut * 9 // 10
+        space = head.rfind(" ", 0, cut)
+        if space > cut // 2:
+            cut = space + 1
+        yield text[:cut].strip()
+        text = text[cut:].strip()
 
-def simple_chunks(text: str, size: int, overlap: int) -> List[str]:
-    text = text.strip().replace("\r\n", "\n").replace("\r", "\n")
-    if not text:
-        return []
-    out = []
-    i = 0
-    n = len(text)
-    while i < n:
-        out.append(text[i:i+size])
-        i += max(1, size - overlap)
-    return out
-
-def build_docs_from_files(files: List[str], chunk_size: int, chunk_overlap: int) -> List[Dict]:
-    docs = []
-    for f in files:
-        content = read_text_from_file(f)
-        if not content:
+def _split_long(sentence: str, max_tokens: int) -> Iterator[str]:
+    # oversized sentences fall back to clause boundaries, then to a hard cut
+    if count_tokens(sentence) <= max_tokens:
+        yield sentence
+        return
+    cur = ""
+    for clause in _CLAUSE.split(sentence):
+        if not clause:
             continue
-        chunks = simple_chunks(content, chunk_size, chunk_overlap)
-        for j, ch in enumerate(chunks):
-            docs.append({"text": ch, "source": os.path.basename(f), "meta": {"chunk_id": j}})
-    return docs
+        if cur and count_tokens(cur + clause) > max_tokens:
+            yield cur.strip()
+            cur = ""
+        if count_tokens(clause) > max_tokens:
+            yield from _hard_split(clause.strip(), max_tokens)
+        else:
+            cur += clause
+    if cur.strip():
+        yield cur.strip()
+
+def _lines(blocks: Iterable[Block]) -> Iterator[Tuple[Optional[int], str, bool]]:
+    # -> (page, line, first line of a PDF page)
+    for page, text in blocks:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        # a text slice ends with its last line's newline, which is not a blank line
+        for k, raw in enumerate((text[:-1] if text.endswith("\n") else text).split("\n")):
+            yield page, raw.strip(), k == 0 and page is not None
+
+def _units(blocks: Iterable[Block], max_tokens: int) -> Iterator[Tuple[Optional[int], str, object]]:
+    # (page, "heading", (level, title)) | (page, "sentence", text) | (page, "para", "") at paragraph ends.
+    # Paragraphs stay open across blocks, so a sentence running over a page break is not cut.
+    para = ""
+    starts: List[int] = []  # offset in para where each of its lines starts
+    pages: List[Optional[int]] = []  # page of each of those lines
+
+    def sentences(final: bool):
+        # yields the paragraph's sentences; unless final, the last (maybe unfinished) one stays open
+        # (a run without any sentence end is cut where it is)
+        nonlocal para, starts, pages
+        # a list marker ("1. ") stays on its item's first sentence instead of splitting off
+        m = re.match(_LIST_ITEM.pattern + r"\s*", para)
+        marker = para[:m.end()] if m else ""
+        parts = [x.strip() for x in _SENTENCE.split(para[len(marker):])]
+        parts = [x for x in parts if x]
+        rest = parts.pop() if not final and len(parts) > 1 else ""
+        pos = len(marker)
+        page = pages[0] if pages else None
+        for s in parts:
+            pos = para.find(s, pos)
+            page = pages[bisect.bisect_right(starts, pos) - 1]
+            pos += len(s)
+            if marker:
+                s, marker = marker + s, ""
+            for piece in _split_long(s, max_tokens):
+                yield page, "sentence", piece
+        if final:
+            para, starts, pages = "", [], []
+            yield page, "para", ""
+        elif rest:
+            at = para.find(rest, pos)
+            para, starts, pages = rest, [0], [pages[bisect.bisect_right(starts, at) - 1]]
+        else:
+            para, starts, pages = "", [], []
+
+    prev: Optional[Tuple[Optional[int], str, bool]] = None
+    titles: set = set()  # headings seen so far, to spot running page headers
+    # None marks the end of input: each line looks at the one after it
+    for cur in chain(_lines(blocks), [None]):
+        if prev is not None:
+            page, line, page_start = prev
+            # a plain heading is a one-line paragraph: nothing open before it, a blank line after it.
+            # pypdf rarely emits blank lines, so a page's first line also qualifies when the text before
+            # it ended a sentence (an open paragraph there usually runs on from the previous page) and
+            # the page goes on below it
+            if page_start and line and not line[0].islower() and (not para or para[-1] in _STOP) \
+                    and cur is not None and cur[1] and not cur[2]:
+                h = _heading(line, True)
+                if h and h[1] in titles:
+                    prev = cur  # the same title on top of another page is a running header
+                    continue
+            else:
+                h = _heading(line, not para and cur is not None and not cur[1]) if line else None
+            if h:
+                titles.add(h[1])
+            # every list item starts its own paragraph, so steps keep their line breaks
+            if not line or h or (para and _LIST_ITEM.match(line)):
+                if para:
+                    yield from sentences(True)
+                if h:
+                    yield page, "heading", h
+            if line and not h:
+                sep = _joiner(para, line) if para else ""
+                starts.append(len(para) + len(sep))
+                pages.append(page)
+                para += sep + line
+                if len(para) > _PARA_MAX_CHARS:
+                    yield from sentences(False)
+        prev = cur
+    if para:
+        yield from sentences(True)
+
+def _breadcrumb(path: List[Tuple[int, str]], max_tokens: int) -> str:
+    # section path written into every chunk so headings are searchable; trimmed to max_tokens
+    titles = [t for _, t in path]
+    while titles:
+        text = " > ".join(titles)
+        if count_tokens(text) <= max_tokens:
+            return text
+        if len(titles) == 1:
+            return next(_hard_split(text, max_tokens), "")
+        titles = titles[1:]
+    return ""
+
+def chunk_blocks(blocks: Iterable[Block], max_tokens: int = 400, overlap_tokens: int = 60) -> Iterator[Dict]:
+    # packs sentences up to max_tokens (including the section breadcrumb that starts each chunk),
+    # preferring to cut at headings and paragraph ends; consecutive chunks in a section share up to
+    # overlap_tokens of trailing sentences
+    path: List[Tuple[int, str]] = []  # open headings, outermost first
+    explicit = 0  # level of the last heading whose level the text states
+    heading, head_tokens = "", 0
+    budget = max_tokens
+    buf: List[Tuple[str, int, Optional[int], bool]] = []  # (text, tokens, page, starts a paragraph)
+    size = 0
+    fresh = 0
+    new_para = True
+    chunk_id = 0
+
+    def make() -> Dict:
+        text = heading
+        for t, _, _, para_start in buf:
+            text += ("\n" if para_start else _joiner(text, t)) + t if text else t
+        pages = [p for _, _, p, _ in buf if p is not None]
+        meta: Dict = {"chunk_id": chunk_id, "tokens": size + head_tokens}
+        if pages:
+            meta["page"], meta["page_end"] = pages[0], pages[-1]
+        if heading:
+            meta["heading"] = heading
+            meta["heading_path"] = [t for _, t in path]
+        return {"text": text, "meta": meta}
+
+    def tail() -> List[Tuple[str, int, Optional[int], bool]]:
+        out, n = [], 0
+        for item in reversed(buf):
+            if n + item[1] > overlap_tokens:
+                break
+            out.insert(0, item)
+            n += item[1]
+        return out
+
+    # sentence pieces leave room for the breadcrumb, which is capped at a quarter of the chunk
+    for page, kind, unit in _units(blocks, max_tokens - max_tokens // 4):
+        if kind == "heading":
+            if fresh:
+                yield make()
+                chunk_id += 1
+            buf, size, fresh, new_para = [], 0, 0, True
+            level, title = unit
+            if level:
+                explicit = level
+            else:
+                level = explicit + 1
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, title))
+            heading = _breadcrumb(path, max_tokens // 4)
+            head_tokens = count_tokens(heading) if heading else 0
+            budget = max_tokens - head_tokens
+            continue
+        if kind == "para":
+            new_para = True
+            # a paragraph end is a good place to cut once the chunk is mostly full
+            if fresh and size >= budget * 3 // 4:
+                yield make()
+                chunk_id += 1
+                buf, size, fresh = [], 0, 0
+            continue
+        n = count_tokens(unit)
+        if fresh and size + n > budget:
+            yield make()
+            chunk_id += 1
+            buf, fresh = tail(), 0
+            size = sum(item[1] for item in buf)
+            if size + n > budget:
+                buf, size = [], 0
+        buf.append((unit, n, page, new_para))
+        size += n
+        fresh += 1
+        new_para = False
+    if fresh:
+        yield make()
+
+def iter_docs(path: str, chunk_tokens: int, overlap_tokens: int, name: Optional[str] = None) -> Iterator[Dict]:
+    source = os.path.basename(name or path)
+    for ch in chunk_blocks(iter_blocks(path), chunk_tokens, overlap_tokens):
+        yield {"text": ch["text"], "source": source, "meta": ch["meta"]}
+
+def build_docs_from_files(files: List[str], chunk_tokens: int, overlap_tokens: int, names: Optional[List[str]] = None) -> List[Dict]:
+    return [d for i, f in enumerate(files) for d in iter_docs(f, chunk_tokens, overlap_tokens, names[i] if names else None)]
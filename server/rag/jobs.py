@@ -0,0 +1,198 @@
+import os, json, time, uuid, shutil, asyncio, threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from .ingest import iter_docs
+from .embeddings import build_embedder
+from server.executors import run_in
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, job_id: str, tmp_dir: str, files: List[Tuple[str, str]]):
+        self.id = job_id
+        self.tmp_dir = tmp_dir
+        self.files = files  # (temp path, original filename)
+        self.status = "queued"
+        self.stage = "queued"
+        self.files_done = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.result: Dict = {}
+        self.error = ""
+        self.created = time.time()
+        self.updated = self.created
+        self.version = 0
+
+    def update(self, **kw):
+        for k, v in kw.items():
+            setattr(self, k, v)
+        self.updated = time.time()
+        self.version += 1
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id, "status": self.status, "stage": self.stage,
+            "files_total": len(self.files), "files_done": self.files_done,
+            "chunks_total": self.chunks_total, "chunks_embedded": self.chunks_embedded,
+            "result": self.result, "error": self.error,
+            "created": int(self.created), "updated": int(self.updated),
+        }
+
+def _extract(path: str, name: str, chunk_tokens: int, overlap_tokens: int, out_path: str) -> int:
+    # runs in a worker process: PDF parsing is CPU bound and holds the GIL. Chunks are streamed to
+    # out_path as JSON lines, so neither process ever holds a whole document
+    n = 0
+    with open(out_path, "w", encoding="utf-8") as f:
+        for doc in iter_docs(path, chunk_tokens, overlap_tokens, name):
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            n += 1
+            if n % 64 == 0:
+                f.flush()
+    return n
+
+async def _spooled(fut: asyncio.Future, path: str, step: int) -> AsyncIterator[List[Dict]]:
+    # follows _extract's output while the worker is still writing, step chunks at a time
+    batch: List[Dict] = []
+    partial = ""
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            done = fut.done()  # checked before reading: lines written before the worker finished are not missed
+            line = f.readline()
+            if line.endswith("\n"):
+                batch.append(json.loads(partial + line))
+                partial = ""
+                if len(batch) >= step:
+                    yield batch
+                    batch = []
+                continue
+            partial += line
+            if done:
+                break
+            await asyncio.sleep(0.05)
+    fut.result()  # the worker's exception, if any
+    if batch:
+        yield batch
+
+class JobManager:
+    def __init__(self, concurrency: int = 2, max_pending: int = 16, extract_workers: int = 2, ttl: float = 3600.0):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.extract_workers = extract_workers
+        self.ttl = ttl
+        self.jobs: Dict[str, Job] = {}
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool_(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.extract_workers)
+            return self._pool
+
+    def pending(self) -> int:
+        return sum(1 for j in self.jobs.values() if not j.finished)
+
+    def check_capacity(self):
+        self._prune()
+        if self.pending() >= self.max_pending:
+            raise QueueFull(f"{self.pending()} ingest jobs pending, try again later")
+
+    def submit(self, tmp_dir: str, files: List[Tuple[str, str]]) -> Job:
+        self.check_capacity()
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        job = Job(uuid.uuid4().hex[:12], tmp_dir, files)
+        self.jobs[job.id] = job
+        asyncio.get_running_loop().create_task(self._run(job))
+        return job
+
+    async def _run(self, job: Job):
+        async with self._sem:
+            try:
+                await self._ingest(job)
+            except Exception as e:
+                job.update(status="failed", stage="failed", error=str(e))
+            finally:
+                shutil.rmtree(job.tmp_dir, ignore_errors=True)
+
+    async def _ingest(self, job: Job):
+        # files are extracted, embedded and indexed as a pipeline: each batch of chunks is written
+        # while the worker process is still parsing the rest of the file
+        job.update(status="running", stage="ingesting")
+        stats = {"docs": 0, "unchanged_docs": 0, "added_chunks": 0, "removed_chunks": 0}
+        tasks = [asyncio.ensure_future(self._ingest_file(job, i, path, name, stats)) for i, (path, name) in enumerate(job.files)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+        job.update(status="done", stage="done", result=stats)
+
+    async def _ingest_file(self, job: Job, i: int, path: str, name: str, stats: Dict[str, int]):
+        from .vectorstore import DocWriter, get_store
+        chunk_tokens = int(os.getenv("KB_CHUNK_TOKENS", "400"))
+        overlap_tokens = int(os.getenv("KB_CHUNK_OVERLAP_TOKENS", "60"))
+        # every upsert batch publishes a generation (index file and all), so batches are larger than embed batches
+        step = int(os.getenv("KB_INGEST_BATCH", "512"))
+        out_path = os.path.join(job.tmp_dir, f"chunks.{i}.jsonl")
+        open(out_path, "w").close()
+        fut = asyncio.get_running_loop().run_in_executor(self._pool_(), _extract, path, name, chunk_tokens, overlap_tokens, out_path)
+        writer = DocWriter(get_store(), os.path.basename(name or path))
+        embedder = build_embedder()
+        async for batch in _spooled(fut, out_path, step):
+            job.update(chunks_total=job.chunks_total + len(batch))
+            # diff against the index first: unchanged chunks are never embedded again
+            texts = await run_in("embed", writer.pending, batch)
+            job.update(chunks_embedded=job.chunks_embedded + len(batch) - len(texts))
+            known = await self._embed_batches(job, embedder, texts)
+            await run_in("io", writer.add, batch, embedder, known)
+        for k, v in (await run_in("io", writer.finish)).items():
+            stats[k] += v
+        job.update(files_done=job.files_done + 1)
+
+    async def _embed_batches(self, job: Job, embedder, texts: List[str]) -> Dict[str, np.ndarray]:
+        # embeds batch by batch so progress is visible, cached or not; the vectors go to the upsert,
+        # which then embeds nothing under the write lock. Each batch queues on the shared embed
+        # stage, so ingestion cannot starve query embedding
+        known: Dict[str, np.ndarray] = {}
+        step = int(os.getenv("KB_EMBED_BATCH", "64"))
+        for i in range(0, len(texts), step):
+            part = texts[i:i + step]
+            known.update(zip(part, await run_in("embed", embedder.embed, part)))
+            job.update(chunks_embedded=job.chunks_embedded + len(part))
+        return known
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [k for k, j in self.jobs.items() if j.finished and now - j.updated > self.ttl]:
+            self.jobs.pop(job_id, None)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def stats(self) -> Dict:
+        return {"pending": self.pending(), "running": sum(1 for j in self.jobs.values() if j.status == "running"),
+                "max_pending": self.max_pending, "concurrency": self.concurrency}
+
+_manager: Optional[JobManager] = None
+
+def get_job_manager() -> JobManager:
+    global _manager
+    if _manager is None:
+        _manager = JobManager(
+            concurrency=int(os.getenv("KB_JOBS_CONCURRENCY", "2")),
+            max_pending=int(os.getenv("KB_JOBS_MAX_PENDING", "16")),
+            extract_workers=int(os.getenv("KB_EXTRACT_WORKERS", "2")),
+            ttl=float(os.getenv("KB_JOBS_TTL", "3600")),
+        )
+    return _manager
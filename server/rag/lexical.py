@@ -0,0 +1,172 @@
+import os, re, math, pickle, threading, unicodedata
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# ASCII words keep inner - _ . so product codes ("E-1042", "v2.3") match whole; CJK runs become n-grams
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+_SPLIT = re.compile(r"[-_.]")
+FORMAT_VERSION = 1
+
+def tokenize(text: str, ngram: int = 2) -> List[str]:
+    out: List[str] = []
+    for m in _TOKEN.finditer(unicodedata.normalize("NFKC", text or "").lower()):
+        t = m.group()
+        if t[0] < "\x80":
+            out.append(t)
+            if len(t) > 2 and _SPLIT.search(t):
+                out.extend(p for p in _SPLIT.split(t) if p)
+            continue
+        for n in range(1, ngram + 1):
+            out.extend(t[i:i + n] for i in range(len(t) - n + 1))
+    return out
+
+class LexicalIndex:
+    # BM25 over an inverted index of numpy posting arrays. Copy-on-write: a published index is never
+    # modified, writers copy() it and update the copy, so a snapshot's postings match its metadata.
+    def __init__(self, ngram: int = 2, k1: float = 1.2, b: float = 0.75):
+        self.ngram = ngram
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}  # term -> (row ids, term freqs)
+        self.lengths = np.zeros(0, dtype=np.float32)  # row id -> token count, 0 when absent
+        self.live = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def copy(self) -> "LexicalIndex":
+        # shallow: posting arrays are shared, add/remove replace them instead of writing into them
+        other = LexicalIndex(self.ngram, self.k1, self.b)
+        with self._lock:
+            other.postings = dict(self.postings)
+            other.lengths = self.lengths.copy()
+            other.live, other.total = self.live, self.total
+        return other
+
+    def add(self, rows: List[int], texts: List[str]):
+        grouped: Dict[str, Tuple[List[int], List[int]]] = {}
+        lens = []
+        for row, text in zip(rows, texts):
+            counts = Counter(tokenize(text, self.ngram))
+            lens.append(sum(counts.values()))
+            for term, tf in counts.items():
+                r, f = grouped.setdefault(term, ([], []))
+                r.append(row)
+                f.append(tf)
+        with self._lock:
+            top = max(rows, default=-1) + 1
+            if top > len(self.lengths):
+                self.lengths = np.concatenate([self.lengths, np.zeros(top - len(self.lengths), dtype=np.float32)])
+            for row, n in zip(rows, lens):
+                self.lengths[row] = n
+            self.live += len(rows)
+            self.total += sum(lens)
+            for term, (r, f) in grouped.items():
+                old = self.postings.get(term)
+                r_arr, f_arr = np.asarray(r, dtype=np.int32), np.asarray(f, dtype=np.float32)
+                self.postings[term] = (r_arr, f_arr) if old is None else \
+                    (np.concatenate([old[0], r_arr]), np.concatenate([old[1], f_arr]))
+
+    def remove(self, rows: List[int], texts: List[str]):
+        terms = set()
+        for text in texts:
+            terms.update(tokenize(text, self.ngram))
+        drop = np.asarray(rows, dtype=np.int32)
+        with self._lock:
+            drop = drop[(drop < len(self.lengths))]
+            drop = drop[self.lengths[drop] > 0]
+            if not len(drop):
+                return
+            self.live -= len(drop)
+            self.total -= float(self.lengths[drop].sum())
+            self.lengths[drop] = 0
+            for term in terms:
+                old = self.postings.get(term)
+                if old is None:
+                    continue
+                keep = ~np.isin(old[0], drop)
+                if keep.all():
+                    continue
+                if keep.any():
+                    self.postings[term] = (old[0][keep], old[1][keep])
+                else:
+                    del self.postings[term]
+
+    def search(self, query: str, topk: int, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        # limit: ignore rows >= limit (rows appended after the caller's snapshot)
+        with self._lock:
+            if not self.live:
+                return []
+            postings = {t: p for t in set(tokenize(query, self.ngram)) for p in [self.postings.get(t)] if p is not None}
+            live, avgdl = self.live, self.total / self.live
+            lengths = self.lengths
+        # CJK single characters have huge posting lists; once a longer n-gram matches they add little
+        if any(len(t) > 1 and t[0] >= "\x80" for t in postings):
+            postings = {t: p for t, p in postings.items() if len(t) > 1 or t[0] < "\x80"}
+        if not postings:
+            return []
+        rows, scores = [], []
+        for r, tf in postings.values():
+            idf = math.log(1.0 + (live - len(r) + 0.5) / (len(r) + 0.5))
+            rows.append(r)
+            scores.append(idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths[r] / avgdl)))
+        # accumulate over candidate rows only, not one slot per row in the index
+        cand, inv = np.unique(np.concatenate(rows), return_inverse=True)
+        acc = np.bincount(inv, weights=np.concatenate(scores), minlength=len(cand))
+        if limit is not None:
+            keep = cand < limit
+            cand, acc = cand[keep], acc[keep]
+        if len(cand) > topk:
+            top = np.argpartition(-acc, topk - 1)[:topk]
+            cand, acc = cand[top], acc[top]
+        order = np.argsort(-acc, kind="stable")
+        return [(int(cand[i]), float(acc[i])) for i in order]
+
+    def save(self, path: str, generation: int):
+        with self._lock:
+            state = {"version": FORMAT_VERSION, "generation": generation, "ngram": self.ngram,
+                     "postings": self.postings, "lengths": self.lengths, "live": self.live, "total": self.total}
+            with open(path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[Tuple["LexicalIndex", int]]:
+        # -> (index, generation it was saved at); None when missing, unreadable or written with
+        # other settings, and the caller rebuilds from metadata
+        idx = new_lexical_index()
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            if state.get("version") != FORMAT_VERSION or state.get("ngram") != idx.ngram:
+                return None
+            idx.postings, idx.lengths = state["postings"], state["lengths"]
+            idx.live, idx.total = state["live"], state["total"]
+            return idx, int(state["generation"])
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, TypeError, KeyError,
+                IndexError, ImportError):
+            return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"rows": self.live, "terms": len(self.postings),
+                    "avg_len": round(self.total / self.live, 1) if self.live else 0.0}
+
+def lexical_enabled() -> bool:
+    return os.getenv("KB_LEXICAL", "1") == "1"
+
+def new_lexical_index() -> LexicalIndex:
+    return LexicalIndex(
+        ngram=int(os.getenv("KB_LEX_NGRAM", "2")),
+        k1=float(os.getenv("KB_BM25_K1", "1.2")),
+        b=float(os.getenv("KB_BM25_B", "0.75")),
+    )
+
+def rrf_fuse(ranked: List[Tuple[List[Tuple[int, float]], float]], k: int = 60) -> List[Tuple[int, float]]:
+    # reciprocal-rank fusion of (hits, weight) lists; hits are (row, score) best first
+    fused: Dict[int, float] = {}
+    for hits, weight in ranked:
+        if weight <= 0:
+            continue
+        for rank, (row, _) in enumerate(hits):
+            fused[row] = fused.get(row, 0.0) + weight / (k + rank + 1)
+    return sorted(fused.items(), key=lambda kv: -kv[1])
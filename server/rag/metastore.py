@@ -0,0 +1,227 @@
+import os, sys, json, mmap, threading
+import numpy as np
+from typing import Dict, List, Optional
+
+# Columnar chunk metadata, addressable by FAISS row id:
+#   texts.bin / texts.off   utf-8 text blob + int64 offsets (count + 1)
+#   metas.bin / metas.off   compact JSON of each row's "meta" dict + offsets
+#   src.i32                 interned source id per row
+#   ts.i64                  ingest timestamp per row
+#   vecs.f32                normalized embedding per row (count x dim), for index rebuilds
+#   manifest.json           row count, dim, source table and file epoch; written last, atomically
+# Blobs are append-only, so readers holding an older view are never disturbed. Compaction writes
+# the surviving rows into a new epoch of files (texts.1.bin, ...) instead of rewriting in place.
+
+MANIFEST = "manifest.json"
+_FILES = ("texts.bin", "texts.off", "metas.bin", "metas.off", "src.i32", "ts.i64", "vecs.f32")
+
+def _fname(name: str, epoch: int) -> str:
+    if not epoch:
+        return name
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{epoch}{ext}"
+
+def _atomic_write_text(path: str, text: str):
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+class _Blob:
+    def __init__(self, path: str, size: int):
+        self._f = None
+        self._mm = None
+        if size > 0:
+            self._f = open(path, "rb")
+            self._mm = mmap.mmap(self._f.fileno(), size, access=mmap.ACCESS_READ)
+
+    def get(self, start: int, end: int) -> bytes:
+        return self._mm[start:end] if self._mm is not None else b""
+
+def _column(path: str, dtype, count: int) -> np.ndarray:
+    if count <= 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+class MetaView:
+    def __init__(self, kb_dir: str, count: int, sources: List[str], dim: int = 0, epoch: int = 0):
+        self.kb_dir = kb_dir
+        self.count = count
+        self.sources = sources
+        self.dim = dim
+        self.epoch = epoch
+        p = lambda name: os.path.join(kb_dir, _fname(name, epoch))
+        self._text_off = _column(p("texts.off"), np.int64, count + 1) if count else np.zeros(1, np.int64)
+        self._meta_off = _column(p("metas.off"), np.int64, count + 1) if count else np.zeros(1, np.int64)
+        self._texts = _Blob(p("texts.bin"), int(self._text_off[-1]))
+        self._metas = _Blob(p("metas.bin"), int(self._meta_off[-1]))
+        self._src = _column(p("src.i32"), np.int32, count)
+        self._ts = _column(p("ts.i64"), np.int64, count)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def text(self, i: int) -> str:
+        return self._texts.get(int(self._text_off[i]), int(self._text_off[i + 1])).decode("utf-8")
+
+    def source(self, i: int) -> str:
+        return self.sources[int(self._src[i])]
+
+    def meta(self, i: int) -> Dict:
+        raw = self._metas.get(int(self._meta_off[i]), int(self._meta_off[i + 1]))
+        return json.loads(raw) if raw else {}
+
+    def vectors(self) -> Optional[np.ndarray]:
+        if not self.dim or not self.count:
+            return None
+        return np.memmap(os.path.join(self.kb_dir, _fname("vecs.f32", self.epoch)), dtype=np.float32, mode="r", shape=(self.count, self.dim))
+
+    def row(self, i: int) -> Dict:
+        return {"text": self.text(i), "source": self.source(i), "meta": self.meta(i), "ts": int(self._ts[i])}
+
+class MetaStore:
+    def __init__(self, kb_dir: str):
+        self.kb_dir = kb_dir
+        self.manifest_path = os.path.join(kb_dir, MANIFEST)
+
+    def _p(self, name: str) -> str:
+        return os.path.join(self.kb_dir, name)
+
+    def _manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"count": 0, "dim": 0, "sources": [], "epoch": 0}
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    def view(self) -> MetaView:
+        m = self._manifest()
+        return MetaView(self.kb_dir, int(m["count"]), list(m["sources"]), int(m.get("dim", 0)), int(m.get("epoch", 0)))
+
+    def _write_manifest(self, count: int, dim: int, sources: List[str], epoch: int = 0):
+        _atomic_write_text(self.manifest_path, json.dumps({"count": count, "dim": dim, "sources": sources, "epoch": epoch}, ensure_ascii=False))
+
+    def append(self, rows: List[Dict], vecs: Optional[np.ndarray] = None) -> MetaView:
+        # caller holds the store's exclusive write lock
+        m = self._manifest()
+        count, sources, dim, epoch = int(m["count"]), list(m["sources"]), int(m.get("dim", 0)), int(m.get("epoch", 0))
+        src_ids = {s: i for i, s in enumerate(sources)}
+        f = lambda name: _fname(name, epoch)
+        cur = MetaView(self.kb_dir, count, sources, epoch=epoch)
+        text_end, meta_end = int(cur._text_off[-1]), int(cur._meta_off[-1])
+
+        texts, metas, src, ts = [], [], [], []
+        for r in rows:
+            texts.append(r.get("text", "").encode("utf-8"))
+            meta = r.get("meta") or {}
+            metas.append(json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8") if meta else b"")
+            s = r.get("source", "")
+            if s not in src_ids:
+                src_ids[s] = len(sources)
+                sources.append(s)
+            src.append(src_ids[s])
+            ts.append(int(r.get("ts", 0)))
+
+        self._append_blob(f("texts.bin"), f("texts.off"), count, text_end, texts)
+        self._append_blob(f("metas.bin"), f("metas.off"), count, meta_end, metas)
+        self._append_column(f("src.i32"), np.int32, count, src)
+        self._append_column(f("ts.i64"), np.int64, count, ts)
+        if vecs is not None and (dim or count == 0):
+            dim = int(vecs.shape[1])
+            self._append_column(f("vecs.f32"), np.float32, count * dim, np.ascontiguousarray(vecs, dtype=np.float32).ravel())
+        else:
+            # rows without vectors (legacy stores): stop tracking them rather than misalign
+            dim = 0
+
+        new_count = count + len(rows)
+        self._write_manifest(new_count, dim, sources, epoch)
+        return MetaView(self.kb_dir, new_count, sources, dim, epoch)
+
+    def backfill_vectors(self, vecs: np.ndarray) -> MetaView:
+        m = self._manifest()
+        count, sources, epoch = int(m["count"]), list(m["sources"]), int(m.get("epoch", 0))
+        if len(vecs) != count:
+            return self.view()
+        self._append_column(_fname("vecs.f32", epoch), np.float32, 0, np.ascontiguousarray(vecs, dtype=np.float32).ravel())
+        self._write_manifest(count, int(vecs.shape[1]), sources, epoch)
+        return MetaView(self.kb_dir, count, sources, int(vecs.shape[1]), epoch)
+
+    def compact(self, keep: np.ndarray) -> MetaView:
+        # caller holds the write lock; rows keep[0], keep[1], ... become rows 0, 1, ... of a new epoch.
+        # The previous epoch stays for views still open on it, anything older is removed.
+        old = self.view()
+        epoch = old.epoch + 1
+        f = lambda name: _fname(name, epoch)
+        keep = np.asarray(keep, dtype=np.int64)
+        used = np.unique(old._src[keep]) if len(keep) else np.zeros(0, np.int32)
+        sources = [old.sources[int(i)] for i in used]
+        self._append_blob(f("texts.bin"), f("texts.off"), 0, 0,
+                          [old._texts.get(int(old._text_off[i]), int(old._text_off[i + 1])) for i in keep])
+        self._append_blob(f("metas.bin"), f("metas.off"), 0, 0,
+                          [old._metas.get(int(old._meta_off[i]), int(old._meta_off[i + 1])) for i in keep])
+        self._append_column(f("src.i32"), np.int32, 0, np.searchsorted(used, old._src[keep]))
+        self._append_column(f("ts.i64"), np.int64, 0, old._ts[keep])
+        if old.dim:
+            self._append_column(f("vecs.f32"), np.float32, 0, np.asarray(old.vectors()[keep]).ravel())
+        self._write_manifest(len(keep), old.dim, sources, epoch)
+        if epoch >= 2:
+            for name in _FILES:
+                path = self._p(_fname(name, epoch - 2))
+                if os.path.exists(path):
+                    os.remove(path)
+        return MetaView(self.kb_dir, len(keep), sources, old.dim, epoch)
+
+    def _append_blob(self, blob_name: str, off_name: str, count: int, end: int, items: List[bytes]):
+        offs = np.cumsum([end] + [len(b) for b in items], dtype=np.int64)
+        # truncate anything past the manifest, e.g. left over from a crashed writer
+        with open(self._p(blob_name), "ab") as f:
+            f.truncate(end)
+            f.write(b"".join(items))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._p(off_name), "ab") as f:
+            if count == 0:
+                f.truncate(0)
+                f.write(offs.tobytes())
+            else:
+                f.truncate((count + 1) * 8)
+                f.write(offs[1:].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append_column(self, name: str, dtype, count: int, values):
+        arr = np.asarray(values, dtype=dtype)
+        with open(self._p(name), "ab") as f:
+            f.truncate(count * arr.itemsize)
+            f.write(arr.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+def migrate_json_meta(kb_dir: str) -> int:
+    json_path = os.path.join(kb_dir, "meta.json")
+    store = MetaStore(kb_dir)
+    if not os.path.exists(json_path) or store.exists():
+        return 0
+    with open(json_path, "r", encoding="utf-8") as f:
+        rows = json.load(f)
+    store.append(rows)
+    os.replace(json_path, json_path + ".migrated")
+    return len(rows)
+
+def migrate_all(base: Optional[str] = None) -> Dict[str, int]:
+    base = base or os.getenv("KB_DIR", "./kb")
+    out = {}
+    if not os.path.isdir(base):
+        return out
+    for sid in sorted(os.listdir(base)):
+        kb_dir = os.path.join(base, sid)
+        if os.path.isfile(os.path.join(kb_dir, "meta.json")):
+            out[sid] = migrate_json_meta(kb_dir)
+    return out
+
+if __name__ == "__main__":
+    for sid, n in migrate_all(sys.argv[1] if len(sys.argv) > 1 else None).items():
+        print(f"{sid}: migrated {n} rows")
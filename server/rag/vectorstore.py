@@ -1,71 +1,743 @@
-import os, json, time
+import os, json, time, hashlib, threading
 import numpy as np
 import faiss
-from typing import List, Dict, Tuple
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 from .embeddings import build_embedder, emb_space_id
+from .embed_cache import normalize_text, text_hash
+from .metastore import MANIFEST, MetaStore, MetaView, migrate_json_meta
+from .index_factory import build_index, index_mode, is_id_mapped, needs_retrain, search_params, target_mode
+from .lexical import LexicalIndex, lexical_enabled, new_lexical_index, rrf_fuse
+from server.metrics import span
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
 
 def _paths():
     base = os.getenv("KB_DIR", "./kb")
     sid = emb_space_id()
     kb_dir = os.path.join(base, sid)
     os.makedirs(kb_dir, exist_ok=True)
-    return kb_dir, os.path.join(kb_dir, "index.faiss"), os.path.join(kb_dir, "meta.json")
+    return kb_dir, os.path.join(kb_dir, "index.faiss"), os.path.join(kb_dir, MANIFEST)
 
-def _load_meta(meta_path: str) -> List[Dict]:
-    if os.path.exists(meta_path):
-        return json.load(open(meta_path, "r", encoding="utf-8"))
-    return []
+def _atomic_write(path: str, write_fn):
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        write_fn(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
-def _save_meta(meta_path: str, meta: List[Dict]):
-    json.dump(meta, open(meta_path, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
+def doc_id_for(source: str) -> str:
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
 
-def load_index():
-    kb_dir, idx_path, meta_path = _paths()
-    meta = _load_meta(meta_path)
-    if os.path.exists(idx_path):
-        index = faiss.read_index(idx_path)
-        return index, meta
-    return None, meta
-
-def save_index(index, meta):
-    kb_dir, idx_path, meta_path = _paths()
-    faiss.write_index(index, idx_path)
-    _save_meta(meta_path, meta)
+def _chunk_hash(text: str) -> str:
+    return text_hash(normalize_text(text))
 
-def add_docs(docs: List[Dict]) -> int:
-    if not docs:
-        return 0
-    embedder = build_embedder()
-    texts = [d["text"] for d in docs]
-    vecs = embedder.embed(texts).astype("float32")
-    dim = vecs.shape[1]
-    index, meta = load_index()
-    if index is None:
-        index = faiss.IndexFlatIP(dim)
+def _content_hash(texts: List[str]) -> str:
+    h = hashlib.sha1()
+    _content_update(h, texts)
+    return h.hexdigest()
+
+def _content_update(h, texts: List[str]):
+    for t in texts:
+        h.update(normalize_text(t).encode("utf-8"))
+        h.update(b"\0")
+
+def _vectors(embedder, texts: List[str], known: Dict[str, np.ndarray]) -> np.ndarray:
+    # rows for texts, reusing vectors embedded before the write lock was taken; only texts that
+    # turned up since (another writer changed the document) are embedded under the lock
+    todo = [t for t in dict.fromkeys(texts) if t not in known]
+    if todo:
+        known = {**known, **dict(zip(todo, embedder.embed(todo)))}
+    vecs = np.asarray([known[t] for t in texts], dtype=np.float32)
     faiss.normalize_L2(vecs)
-    index.add(vecs)
+    return vecs
+
+def _row_meta(source: str, doc_id: str, chunk: Dict, ts: int) -> Dict:
+    meta = dict(chunk.get("meta", {}))
+    meta["doc_id"] = doc_id
+    return {"source": source, "meta": meta, "text": chunk["text"], "ts": ts}
+
+class Snapshot:
+    __slots__ = ("index", "meta", "generation", "docs", "deleted", "dead", "lexical", "rows", "base_rows")
+
+    def __init__(self, index, meta: MetaView, generation: int, docs: Optional[Dict] = None,
+                 deleted: frozenset = frozenset(), dead: frozenset = frozenset(),
+                 lexical: Optional[LexicalIndex] = None, rows: int = 0, base_rows: int = 0):
+        self.index = index
+        self.meta = meta
+        self.generation = generation
+        # doc_id -> {"source", "content_hash", "chunks": {chunk_hash: row_id}, "ts"}
+        self.docs = docs or {}
+        # every row id ever removed, and the subset still physically present in the index
+        self.deleted = deleted
+        self.dead = dead
+        # BM25 index over live rows; never modified once published (writers update a copy)
+        self.lexical = lexical
+        # rows [0, rows) are published; the index holds those below base_rows (the last checkpoint),
+        # later ones are scanned exactly from the metastore vectors until the next checkpoint
+        self.rows = rows
+        self.base_rows = base_rows
+
+    @property
+    def empty(self) -> bool:
+        return self.rows <= len(self.deleted)
+
+def _successor(snap: Snapshot) -> Snapshot:
+    return Snapshot(snap.index, snap.meta, snap.generation + 1, snap.docs, snap.deleted, snap.dead,
+                    snap.lexical, snap.rows, snap.base_rows)
+
+class VectorStore:
+    def __init__(self, kb_dir: str):
+        self.kb_dir = kb_dir
+        self.idx_path = os.path.join(kb_dir, "index.faiss")
+        self.docs_path = os.path.join(kb_dir, "docs.json")
+        self.lex_path = os.path.join(kb_dir, "lexical.pkl")
+        self.log_path = os.path.join(kb_dir, "changes.log")
+        self.metastore = MetaStore(kb_dir)
+        self.gen_path = os.path.join(kb_dir, "GENERATION")
+        self.lock_path = os.path.join(kb_dir, ".lock")
+        self.compacting_path = os.path.join(kb_dir, "COMPACTING")
+        self.reload_interval = float(os.getenv("KB_RELOAD_INTERVAL", "1.0"))
+        self.compact_ratio = float(os.getenv("KB_COMPACT_RATIO", "0.2"))
+        # deleted rows stay in the metastore (and in IVF id space) until this share of rows is dead
+        self.meta_compact_ratio = float(os.getenv("KB_META_COMPACT_RATIO", "0.3"))
+        self.meta_compact_min = int(os.getenv("KB_META_COMPACT_MIN", "1000"))
+        # a write appends one record to changes.log; index.faiss, docs.json and lexical.pkl are rewritten
+        # (a checkpoint) only once the rows added since pass KB_DELTA_RATIO of the index (at least
+        # KB_DELTA_MIN), removed rows pass KB_COMPACT_RATIO of it, or the log holds KB_LOG_MAX records
+        self.delta_min = int(os.getenv("KB_DELTA_MIN", "2048"))
+        self.delta_ratio = float(os.getenv("KB_DELTA_RATIO", "0.1"))
+        self.log_max = int(os.getenv("KB_LOG_MAX", "256"))
+        self._write_lock = threading.Lock()
+        self._snap = Snapshot(None, MetaView(kb_dir, 0, []), -1)
+        self._checked_at = 0.0
+        self._stale = False  # checkpoint files missing, outdated or in the format before changes.log
+        self._log = [-1, 0, 0]  # checkpoint generation, records applied after it, byte offset past them
+        with self._exclusive():
+            migrate_json_meta(kb_dir)
+            self._backfill_vectors()
+            self._backfill_docs()
+            self._reload(force=True)
+            if self._stale and self._snap.generation >= 0:
+                self._checkpoint(_successor(self._snap))
+
+    def _backfill_vectors(self):
+        # older stores kept vectors only inside a flat index; recover them for rebuilds
+        view = self.metastore.view()
+        if view.dim or not view.count or not os.path.exists(self.idx_path):
+            return
+        index = faiss.read_index(self.idx_path)
+        if index_mode(index) == "flat" and index.ntotal == view.count:
+            self.metastore.backfill_vectors(index.reconstruct_n(0, index.ntotal))
+
+    def _backfill_docs(self):
+        # rows ingested before documents had identity: group them by source
+        view = self.metastore.view()
+        if os.path.exists(self.docs_path) or not view.count:
+            return
+        by_source: Dict[str, List[int]] = {}
+        for i in range(view.count):
+            by_source.setdefault(view.source(i), []).append(i)
+        docs = {}
+        for source, rows in by_source.items():
+            texts = [view.text(i) for i in rows]
+            docs[doc_id_for(source)] = {
+                "source": source,
+                "content_hash": _content_hash(texts),
+                "chunks": {_chunk_hash(t): i for t, i in zip(texts, rows)},
+                "ts": int(view.row(rows[-1])["ts"]),
+            }
+        self._write_docs(docs, frozenset(), frozenset())
+
+    def _read_docs(self) -> Dict:
+        try:
+            with open(self.docs_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_docs(self, docs: Dict, deleted: frozenset, dead: frozenset, **checkpoint):
+        def write(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({**checkpoint, "docs": docs, "deleted": sorted(deleted), "dead": sorted(dead)}, f,
+                          ensure_ascii=False, separators=(",", ":"))
+        _atomic_write(self.docs_path, write)
+
+    def _disk_generation(self) -> int:
+        try:
+            with open(self.gen_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            # stores written before generations existed
+            return 0 if os.path.exists(self.idx_path) else -1
+
+    def _write_generation(self, generation: int):
+        def write(tmp):
+            with open(tmp, "w") as f:
+                f.write(str(generation))
+        _atomic_write(self.gen_path, write)
+
+    def _reload(self, force: bool = False):
+        gen = self._disk_generation()
+        cur = self._snap
+        if not force and gen == cur.generation:
+            return
+        # a checkpoint rewrites several files; wait until it is fully published,
+        # and drop a load that overlapped one (the next snapshot() check retries)
+        if os.path.exists(self.compacting_path):
+            return
+        meta = self.metastore.view()
+        out = None
+        if not force and cur.generation >= 0:
+            # same checkpoint as the current snapshot: apply only the records published since
+            out = self._replay(cur, meta, gen, self._log)
+        if out is None:
+            out = self._load(meta, gen)
+        if out is None or os.path.exists(self.compacting_path) or self._disk_generation() != gen:
+            return
+        self._snap, self._log = out
+
+    def _load(self, meta: MetaView, gen: int) -> Optional[Tuple[Snapshot, List[int]]]:
+        # the checkpoint files, then the change log up to gen
+        d = self._read_docs()
+        index = faiss.read_index(self.idx_path) if os.path.exists(self.idx_path) else None
+        if "generation" in d:
+            at, rows, base_rows = int(d["generation"]), int(d["rows"]), int(d["rows"])
+        else:
+            # written before changes.log, when docs.json was rewritten with every generation
+            at, rows = gen, meta.count
+            base_rows = rows if index is not None else 0
+        lex = None
+        if lexical_enabled():
+            saved = LexicalIndex.load(self.lex_path)
+            lex = saved[0] if saved is not None and saved[1] == at else None
+        snap = Snapshot(index, meta, at, d.get("docs", {}), frozenset(d.get("deleted", [])),
+                        frozenset(d.get("dead", [])), lex, rows, base_rows)
+        out = self._replay(snap, meta, gen, [at, 0, 0])
+        if out is None:
+            return None
+        snap = out[0]
+        self._stale = "generation" not in d or (lexical_enabled() and lex is None)
+        if lexical_enabled() and lex is None:
+            # missing or written with other settings: rebuild from the row texts
+            snap.lexical = self._build_lexical(snap.meta, snap.rows, snap.deleted)
+        return out
+
+    def _replay(self, snap: Snapshot, meta: MetaView, gen: int, log: List[int]) -> Optional[Tuple[Snapshot, List[int]]]:
+        # log = [checkpoint generation, records already applied, byte offset past them]; None when the log
+        # was checkpointed past snap, is damaged, or does not reach gen yet
+        checkpoint, records, pos = log
+        if snap.generation == gen:
+            return snap, [checkpoint, records, pos]
+        lex = snap.lexical.copy() if snap.lexical is not None else None
+        try:
+            with open(self.log_path, "rb") as f:
+                head = f.readline()
+                if json.loads(head or b"{}").get("checkpoint") != checkpoint:
+                    return None
+                f.seek(pos or len(head))
+                pos = pos or len(head)
+                while snap.generation < gen:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        return None
+                    rec = json.loads(line)
+                    if rec["gen"] != snap.generation + 1 or (rec["add"] and rec["add"][1] > meta.count):
+                        return None
+                    snap = self._apply(snap, meta, rec, lex)
+                    records, pos = records + 1, pos + len(line)
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+        return snap, [checkpoint, records, pos]
+
+    def _apply(self, snap: Snapshot, meta: MetaView, rec: Dict, lex: Optional[LexicalIndex]) -> Snapshot:
+        # one change-log record on top of snap; lex is the caller's private copy of snap.lexical, updated in place
+        lo, hi = rec["add"] or (snap.rows, snap.rows)
+        removed = sorted(frozenset(rec["remove"]) - snap.deleted)
+        # rows between the published ones and this append were left by a writer that died before publishing
+        deleted = snap.deleted | frozenset(removed) | frozenset(range(snap.rows, lo))
+        dead = snap.dead | frozenset(r for r in removed if r < snap.base_rows)
+        docs = dict(snap.docs)
+        for doc_id, d in rec["docs"].items():
+            if d is None:
+                docs.pop(doc_id, None)
+            else:
+                docs[doc_id] = d
+        if lex is not None:
+            if removed:
+                lex.remove(removed, [meta.text(i) for i in removed])
+            if hi > lo:
+                lex.add(list(range(lo, hi)), [meta.text(i) for i in range(lo, hi)])
+        return Snapshot(snap.index, meta, rec["gen"], docs, deleted, dead, lex, hi, snap.base_rows)
+
+    def _build_lexical(self, meta: MetaView, rows: int, deleted: frozenset) -> LexicalIndex:
+        lex = new_lexical_index()
+        live = [i for i in range(rows) if i not in deleted]
+        if live:
+            lex.add(live, [meta.text(i) for i in live])
+        return lex
+
+    def snapshot(self) -> Snapshot:
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_interval:
+            self._checked_at = now
+            # another uvicorn worker may have published a newer generation
+            if self._disk_generation() != self._snap.generation:
+                with self._write_lock:
+                    self._reload()
+        return self._snap
+
+    @property
+    def generation(self) -> int:
+        return self.snapshot().generation
+
+    @contextmanager
+    def _exclusive(self):
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lf:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+                # a marker seen while holding the lock was left by a writer that crashed mid-checkpoint
+                if os.path.exists(self.compacting_path):
+                    os.remove(self.compacting_path)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lf, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _compacting(self):
+        # caller holds _exclusive(); readers skip loads that overlap the marker
+        if os.path.exists(self.compacting_path):
+            yield
+            return
+        with open(self.compacting_path, "w"):
+            pass
+        try:
+            yield
+        finally:
+            os.remove(self.compacting_path)
+
+    def _rebuild(self, meta: MetaView, rows: int, deleted: frozenset, mode: str = ""):
+        ids = np.arange(rows, dtype=np.int64)
+        if deleted:
+            ids = np.setdiff1d(ids, np.fromiter(deleted, dtype=np.int64))
+        if not len(ids):
+            return None
+        return build_index(mode or target_mode(len(ids)), np.asarray(meta.vectors()[ids]), ids)
+
+    def _write(self, add_vecs: Optional[np.ndarray], add_metas: List[Dict], remove_ids: List[int], docs: Dict) -> Snapshot:
+        # caller holds _exclusive(); publishes one generation covering adds, removals and the doc table
+        cur = self._snap
+        meta, add = cur.meta, []
+        if add_metas:
+            # metadata first: a reader racing the publish may see extra rows, never missing ones
+            add = [meta.count]
+            meta = self.metastore.append(add_metas, add_vecs)
+            add.append(meta.count)
+        changes = {doc_id: d for doc_id, d in docs.items() if cur.docs.get(doc_id) is not d}
+        changes.update({doc_id: None for doc_id in cur.docs if doc_id not in docs})
+        rec = {"gen": cur.generation + 1, "add": add, "remove": sorted({int(i) for i in remove_ids} - cur.deleted),
+               "docs": changes}
+        snap = self._apply(cur, meta, rec, cur.lexical.copy() if cur.lexical is not None else None)
+        deleted = snap.deleted
+        if rec["remove"] and meta.dim and len(deleted) >= self.meta_compact_min and len(deleted) > self.meta_compact_ratio * snap.rows:
+            return self._compact(snap)
+        if self._due(snap):
+            return self._checkpoint(snap, add_vecs)
+
+        checkpoint, records, pos = self._log
+        line = (json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with open(self.log_path, "r+b") as f:
+            # cut whatever a writer that died before bumping GENERATION appended past the last publish
+            f.seek(pos)
+            f.truncate()
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_generation(snap.generation)
+        self._snap, self._log = snap, [checkpoint, records + 1, pos + len(line)]
+        return snap
+
+    def _due(self, snap: Snapshot) -> bool:
+        # rows added since the checkpoint cost an exact scan per query, logged records a replay per load
+        _, records, pos = self._log
+        base = snap.index.ntotal if snap.index is not None else 0
+        return (not pos or not snap.meta.dim or records >= self.log_max
+                or snap.rows - snap.base_rows > max(self.delta_min, self.delta_ratio * base)
+                or len(snap.dead) > self.compact_ratio * max(base, 1))
+
+    def _checkpoint(self, snap: Snapshot, vecs: Optional[np.ndarray] = None, mode: Optional[str] = None) -> Snapshot:
+        # caller holds _exclusive(); folds the rows added since the last checkpoint into the index and
+        # rewrites index.faiss, docs.json and lexical.pkl at snap's generation. vecs: the added rows'
+        # vectors for stores without vectors in the metastore; mode: rebuild in this mode ("" = auto)
+        meta, index, dead = snap.meta, snap.index, snap.dead
+        live = snap.rows - len(snap.deleted)
+        target = mode or target_mode(live)
+        if meta.dim and (mode is not None or index is None or index_mode(index) != target
+                         or not is_id_mapped(index) or needs_retrain(index, live)):
+            index, dead = self._rebuild(meta, snap.rows, snap.deleted, target), frozenset()
+        else:
+            if meta.dim:
+                vecs = np.asarray(meta.vectors()[snap.base_rows:snap.rows]) if snap.rows > snap.base_rows else None
+            index = faiss.clone_index(index) if index is not None else None
+            if vecs is not None and len(vecs):
+                ids = np.arange(snap.rows - len(vecs), snap.rows, dtype=np.int64)
+                if index is None or is_id_mapped(index):
+                    keep = np.fromiter((i not in snap.deleted for i in ids.tolist()), dtype=bool, count=len(ids))
+                    vecs, ids = vecs[keep], ids[keep]
+                if index is None:
+                    index = build_index(target, vecs, ids) if len(ids) else None
+                elif is_id_mapped(index):
+                    index.add_with_ids(vecs, ids)
+                else:
+                    index.add(vecs)
+            if dead and index is not None:
+                try:
+                    if not is_id_mapped(index):
+                        raise RuntimeError("positional ids")
+                    index.remove_ids(faiss.IDSelectorBatch(np.fromiter(dead, dtype=np.int64)))
+                    dead = frozenset()
+                except RuntimeError:
+                    # e.g. HNSW cannot remove; filter at query time until compaction
+                    pass
+            if dead and index is not None and meta.dim and len(dead) > self.compact_ratio * max(index.ntotal, 1):
+                index, dead = self._rebuild(meta, snap.rows, snap.deleted, target), frozenset()
+        out = Snapshot(index, meta, snap.generation, snap.docs, snap.deleted, dead, snap.lexical, snap.rows, snap.rows)
+        self._publish(out)
+        self._snap = out
+        return out
+
+    def _compact(self, snap: Snapshot) -> Snapshot:
+        # caller holds _exclusive(); drops deleted rows from the metastore and renumbers the survivors
+        keep = np.setdiff1d(np.arange(snap.rows, dtype=np.int64), np.fromiter(snap.deleted, dtype=np.int64))
+        new_row = {old: new for new, old in enumerate(keep.tolist())}
+        with self._compacting():
+            meta = self.metastore.compact(keep)
+            docs = {doc_id: {**d, "chunks": {h: new_row[r] for h, r in d["chunks"].items() if r in new_row}}
+                    for doc_id, d in snap.docs.items()}
+            lex = self._build_lexical(meta, meta.count, frozenset()) if lexical_enabled() else None
+            out = Snapshot(self._rebuild(meta, meta.count, frozenset()), meta, snap.generation, docs,
+                           frozenset(), frozenset(), lex, meta.count, meta.count)
+            self._publish(out)
+        self._snap = out
+        return out
+
+    def add(self, vecs: np.ndarray, metas: List[Dict]) -> int:
+        if len(metas) == 0:
+            return 0
+        with self._exclusive():
+            self._reload()
+            self._write(vecs, metas, [], self._snap.docs)
+        return len(metas)
+
+    def rebuild(self, mode: str = "") -> str:
+        with self._exclusive():
+            self._reload()
+            cur = self._snap
+            if not cur.meta.dim:
+                return index_mode(cur.index)
+            return index_mode(self._checkpoint(_successor(cur), mode=mode).index)
+
+    def _publish(self, snap: Snapshot):
+        # a checkpoint: every file at snap's generation, and an empty change log after it
+        head = (json.dumps({"checkpoint": snap.generation}) + "\n").encode("utf-8")
+
+        def write_log(tmp):
+            with open(tmp, "wb") as f:
+                f.write(head)
+        with self._compacting():
+            if snap.index is not None:
+                _atomic_write(self.idx_path, lambda tmp: faiss.write_index(snap.index, tmp))
+            elif os.path.exists(self.idx_path):
+                os.remove(self.idx_path)
+            self._write_docs(snap.docs, snap.deleted, snap.dead, generation=snap.generation, rows=snap.rows)
+            if snap.lexical is not None:
+                _atomic_write(self.lex_path, lambda tmp: snap.lexical.save(tmp, snap.generation))
+            _atomic_write(self.log_path, write_log)
+            # the per-write lexical log of older versions; its records are folded into lexical.pkl now
+            if os.path.exists(os.path.join(self.kb_dir, "lexical.log")):
+                os.remove(os.path.join(self.kb_dir, "lexical.log"))
+            self._write_generation(snap.generation)
+        self._log = [snap.generation, 0, len(head)]
+        self._stale = False
+
+    def _dense(self, snap: Snapshot, qvec: np.ndarray, topk: int, nprobe: Optional[int], ef_search: Optional[int]) -> List[Tuple[int, float]]:
+        hits = []
+        if snap.index is not None and snap.index.ntotal:
+            params = search_params(snap.index, nprobe, ef_search)
+            # over-fetch a little when removed rows are still physically in the index
+            k = min(topk + min(len(snap.dead), 4 * topk), snap.index.ntotal)
+            D, I = snap.index.search(qvec, k, params=params)
+            for score, idx in zip(D[0].tolist(), I[0].tolist()):
+                if idx < 0 or idx >= snap.rows or idx in snap.dead:
+                    continue
+                hits.append((idx, float(score)))
+                if len(hits) >= topk:
+                    break
+        if snap.rows > snap.base_rows:
+            # rows added since the checkpoint: exact scan over their stored (normalized) vectors
+            lo = snap.base_rows
+            scores = np.asarray(snap.meta.vectors()[lo:snap.rows]) @ qvec[0]
+            found = 0
+            for j in np.argsort(-scores, kind="stable").tolist():
+                if lo + j in snap.deleted:
+                    continue
+                hits.append((lo + j, float(scores[j])))
+                found += 1
+                if found >= topk:
+                    break
+            hits = sorted(hits, key=lambda h: -h[1])[:topk]
+        return hits
+
+    def _hit(self, snap: Snapshot, idx: int, score: float, **extra) -> Dict:
+        return {"score": score, "text": snap.meta.text(idx), "source": snap.meta.source(idx), "meta": snap.meta.meta(idx), **extra}
+
+    def search(self, qvec: Optional[np.ndarray], topk: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               query: str = "", dense_weight: float = 1.0, lexical_weight: float = 0.0) -> List[Dict]:
+        snap = self.snapshot()
+        if snap.empty:
+            return []
+        if lexical_weight <= 0 or snap.lexical is None or not query:
+            if qvec is None:
+                return []
+            with span("kb_dense"):
+                dense = self._dense(snap, qvec, topk, nprobe, ef_search)
+            return [self._hit(snap, i, s) for i, s in dense]
+        fetch = topk * int(os.getenv("KB_HYBRID_FETCH", "4"))
+        with span("kb_dense"):
+            dense = self._dense(snap, qvec, fetch, nprobe, ef_search) if dense_weight > 0 and qvec is not None else []
+        # rows appended after this snapshot are not published yet
+        with span("kb_lexical"):
+            lexical = snap.lexical.search(query, fetch, limit=snap.rows)
+        fused = rrf_fuse([(dense, dense_weight), (lexical, lexical_weight)], k=int(os.getenv("KB_RRF_K", "60")))[:topk]
+        d, l = dict(dense), dict(lexical)
+        # "score" stays the cosine similarity (as in dense-only search); the fused rank value is rrf_score
+        cos = self._cosine(snap, qvec, [i for i, _ in fused if i not in d])
+        out = []
+        for i, rrf in fused:
+            if i in d:
+                score = d[i]
+            elif qvec is not None:
+                score = cos.get(i, 0.0)
+            else:
+                score = l.get(i, 0.0)  # pure lexical search: no query vector to compare with
+            out.append(self._hit(snap, i, score, rrf_score=rrf, dense_score=d.get(i), lexical_score=l.get(i)))
+        return out
+
+    def _cosine(self, snap: Snapshot, qvec: Optional[np.ndarray], rows: List[int]) -> Dict[int, float]:
+        # exact similarity for lexical-only hits, from the stored row vectors
+        vecs = snap.meta.vectors() if qvec is not None and rows else None
+        if vecs is None:
+            return {}
+        return dict(zip(rows, (np.asarray(vecs[rows]) @ qvec[0]).tolist()))
+
+    def list_docs(self) -> List[Dict]:
+        snap = self.snapshot()
+        return [{"doc_id": doc_id, "source": d["source"], "content_hash": d["content_hash"],
+                 "chunks": len(d["chunks"]), "ts": d.get("ts", 0)}
+                for doc_id, d in sorted(snap.docs.items(), key=lambda kv: kv[1]["source"])]
+
+    def delete_doc(self, doc_id: str) -> int:
+        with self._exclusive():
+            self._reload()
+            cur = self._snap
+            d = cur.docs.get(doc_id)
+            if d is None:
+                return -1
+            docs = {k: v for k, v in cur.docs.items() if k != doc_id}
+            self._write(None, [], list(d["chunks"].values()), docs)
+            return len(d["chunks"])
+
+    def pending(self, grouped: Dict[str, List[Dict]]) -> List[str]:
+        # texts an upsert would embed: new or changed chunks of changed documents
+        snap = self.snapshot()
+        return [c["text"] for src, chunks in grouped.items() for p in [_plan(src, chunks, snap.docs)] if p for _, c in p[3]]
+
+    def upsert(self, grouped: Dict[str, List[Dict]], embedder) -> Dict[str, int]:
+        stats = {"docs": len(grouped), "unchanged_docs": 0, "added_chunks": 0, "removed_chunks": 0}
+        # embed outside the write lock and hand the vectors to the locked pass below
+        warm = self.pending(grouped)
+        known = dict(zip(warm, embedder.embed(warm))) if warm else {}
+
+        with self._exclusive():
+            self._reload()
+            docs = dict(self._snap.docs)
+            next_row = self._snap.meta.count
+            ts = int(time.time())
+            add_metas, remove_ids = [], []
+            for source, chunks in grouped.items():
+                plan = _plan(source, chunks, docs)
+                if plan is None:
+                    stats["unchanged_docs"] += 1
+                    continue
+                doc_id, content_hash, rows, new, removed = plan
+                for h, c in new:
+                    add_metas.append(_row_meta(source, doc_id, c, ts))
+                    rows[h] = next_row
+                    next_row += 1
+                remove_ids.extend(removed)
+                docs[doc_id] = {"source": source, "content_hash": content_hash, "chunks": rows, "ts": ts}
+            if stats["unchanged_docs"] == len(grouped):
+                return stats
+
+            vecs = _vectors(embedder, [m["text"] for m in add_metas], known) if add_metas else None
+            self._write(vecs, add_metas, remove_ids, docs)
+            stats["added_chunks"] = len(add_metas)
+            stats["removed_chunks"] = len(remove_ids)
+        return stats
+
+class DocWriter:
+    # streams one document into the store batch by batch. New chunks are published as they arrive
+    # and recorded under the document with an empty content hash, so a job that fails half way
+    # leaves no orphaned rows and the next upsert of the document diffs it fully; finish() removes
+    # the chunks only the old version had.
+    def __init__(self, store: VectorStore, source: str):
+        self.store = store
+        self.source = source
+        self.doc_id = doc_id_for(source)
+        self.seen: set = set()  # chunk hashes of the new version so far
+        self.hasher = hashlib.sha1()
+        self.stats = {"docs": 1, "unchanged_docs": 0, "added_chunks": 0, "removed_chunks": 0}
+
+    def _fresh(self, chunks: List[Dict], rows: Dict) -> List[Tuple[str, Dict]]:
+        out, hashes = [], set()
+        for c in chunks:
+            h = _chunk_hash(c["text"])
+            if h not in rows and h not in self.seen and h not in hashes:
+                hashes.add(h)
+                out.append((h, c))
+        return out
+
+    def pending(self, chunks: List[Dict]) -> List[str]:
+        # texts add() would embed
+        old = self.store.snapshot().docs.get(self.doc_id)
+        return [c["text"] for _, c in self._fresh(chunks, old["chunks"] if old else {})]
+
+    def add(self, chunks: List[Dict], embedder, known: Optional[Dict[str, np.ndarray]] = None) -> int:
+        # known: text -> vector for pending(chunks), when the caller already embedded them
+        _content_update(self.hasher, [c["text"] for c in chunks])
+        if known is None:
+            warm = self.pending(chunks)
+            known = dict(zip(warm, embedder.embed(warm))) if warm else {}
+        store = self.store
+        with store._exclusive():
+            store._reload()
+            cur = store._snap
+            old = cur.docs.get(self.doc_id)
+            rows = dict(old["chunks"]) if old else {}
+            new = self._fresh(chunks, rows)
+            self.seen.update(_chunk_hash(c["text"]) for c in chunks)
+            if not new:
+                return 0
+            ts = int(time.time())
+            add_metas = []
+            for h, c in new:
+                rows[h] = cur.meta.count + len(add_metas)
+                add_metas.append(_row_meta(self.source, self.doc_id, c, ts))
+            docs = dict(cur.docs)
+            docs[self.doc_id] = {"source": self.source, "content_hash": "", "chunks": rows, "ts": ts}
+            store._write(_vectors(embedder, [m["text"] for m in add_metas], known), add_metas, [], docs)
+        self.stats["added_chunks"] += len(add_metas)
+        return len(add_metas)
+
+    def finish(self) -> Dict[str, int]:
+        if not self.seen:
+            return {**self.stats, "docs": 0}
+        content_hash = self.hasher.hexdigest()
+        store = self.store
+        with store._exclusive():
+            store._reload()
+            cur = store._snap
+            old = cur.docs.get(self.doc_id)
+            if old is not None and old["content_hash"] == content_hash:
+                self.stats["unchanged_docs"] = 1
+                return self.stats
+            rows = old["chunks"] if old else {}
+            removed = [row for h, row in rows.items() if h not in self.seen]
+            docs = dict(cur.docs)
+            docs[self.doc_id] = {"source": self.source, "content_hash": content_hash, "ts": int(time.time()),
+                                 "chunks": {h: row for h, row in rows.items() if h in self.seen}}
+            store._write(None, [], removed, docs)
+        self.stats["removed_chunks"] = len(removed)
+        return self.stats
+
+def _plan(source: str, chunks: List[Dict], docs: Dict):
+    # diff one document's chunks against the indexed version; None when its content is unchanged
+    doc_id = doc_id_for(source)
+    content_hash = _content_hash([c["text"] for c in chunks])
+    old = docs.get(doc_id)
+    if old is not None and old["content_hash"] == content_hash:
+        return None
+    old_chunks = old["chunks"] if old else {}
+    want: Dict[str, Dict] = {}
+    for c in chunks:
+        want.setdefault(_chunk_hash(c["text"]), c)
+    rows = {h: row for h, row in old_chunks.items() if h in want}
+    new = [(h, c) for h, c in want.items() if h not in old_chunks]
+    removed = [row for h, row in old_chunks.items() if h not in want]
+    return doc_id, content_hash, rows, new, removed
+
+_stores: Dict[str, VectorStore] = {}
+_stores_lock = threading.Lock()
+
+def get_store() -> VectorStore:
+    kb_dir, _, _ = _paths()
+    store = _stores.get(kb_dir)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(kb_dir)
+            if store is None:
+                store = _stores[kb_dir] = VectorStore(kb_dir)
+    return store
+
+def load_index():
+    snap = get_store().snapshot()
+    return snap.index, snap.meta
+
+def _group(docs: List[Dict]) -> Dict[str, List[Dict]]:
+    grouped: Dict[str, List[Dict]] = {}
     for d in docs:
-        meta.append({
-            "source": d.get("source", ""),
-            "meta": d.get("meta", {}),
-            "text": d["text"],
-            "ts": int(time.time())
-        })
-    save_index(index, meta)
-    return len(docs)
-
-def search(query: str, topk: int = 5) -> List[Dict]:
-    embedder = build_embedder()
-    qvec = embedder.embed([query]).astype("float32")
-    faiss.normalize_L2(qvec)
-    index, meta = load_index()
-    if index is None or len(meta) == 0:
+        grouped.setdefault(d.get("source", ""), []).append(d)
+    return grouped
+
+def upsert_docs(docs: List[Dict]) -> Dict[str, int]:
+    if not docs:
+        return {"docs": 0, "unchanged_docs": 0, "added_chunks": 0, "removed_chunks": 0}
+    return get_store().upsert(_group(docs), build_embedder())
+
+def add_docs(docs: List[Dict]) -> int:
+    return upsert_docs(docs)["added_chunks"]
+
+def list_docs() -> List[Dict]:
+    return get_store().list_docs()
+
+def delete_doc(doc_id: str) -> int:
+    return get_store().delete_doc(doc_id)
+
+def search(query: str, topk: int = 5, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+           dense_weight: Optional[float] = None, lexical_weight: Optional[float] = None) -> List[Dict]:
+    # weights scale each ranking in reciprocal-rank fusion; lexical_weight=0 is pure dense retrieval,
+    # dense_weight=0 skips embedding the query (then "score" is the BM25 score)
+    store = get_store()
+    snap = store.snapshot()
+    if snap.empty:
         return []
-    D, I = index.search(qvec, min(topk, len(meta)))
-    hits = []
-    for score, idx in zip(D[0].tolist(), I[0].tolist()):
-        if idx == -1:
-            continue
-        m = meta[idx]
-        hits.append({"score": float(score), "text": m["text"], "source": m.get("source", ""), "meta": m.get("meta", {})})
-    return hits
+    if dense_weight is None:
+        dense_weight = float(os.getenv("KB_DENSE_WEIGHT", "1.0"))
+    if lexical_weight is None:
+        lexical_weight = float(os.getenv("KB_LEXICAL_WEIGHT", "1.0"))
+    lexical_runs = lexical_weight > 0 and snap.lexical is not None and bool(query)
+    qvec = None
+    if dense_weight > 0 or not lexical_runs:
+        with span("kb_embed"):
+            qvec = build_embedder().embed([query]).astype("float32")
+            faiss.normalize_L2(qvec)
+    return store.search(qvec, topk, nprobe, ef_search, query=query, dense_weight=dense_weight, lexical_weight=lexical_weight)
@@ -0,0 +1,150 @@
+import os, time, logging, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+Key = Tuple[str, str, str]
+
+def _estimate_mb(obj: Any) -> float:
+    params = getattr(obj, "parameters", None)
+    if callable(params):
+        try:
+            return sum(p.numel() * p.element_size() for p in params()) / (1024 * 1024)
+        except Exception:
+            return 0.0
+    return 0.0
+
+class _Entry:
+    __slots__ = ("obj", "size_mb", "load_s", "hits", "last_used")
+
+    def __init__(self, obj: Any, size_mb: float, load_s: float):
+        self.obj = obj
+        self.size_mb = size_mb
+        self.load_s = load_s
+        self.hits = 0
+        self.last_used = time.time()
+
+class ModelRegistry:
+    def __init__(self, max_entries: int = 8, max_mb: float = 0.0):
+        self.max_entries = max_entries
+        self.max_mb = max_mb
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Key, _Entry]" = OrderedDict()
+        self._key_locks: Dict[Key, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # capacity-driven
+        self.explicit_evictions = 0  # evict() / clear()
+        self.load_seconds_total = 0.0
+
+    def get(self, kind: str, name: str, compute_type: str, loader: Callable[[], Any],
+            size_mb: Optional[float] = None) -> Any:
+        key = (kind, name, compute_type or "")
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None:
+                self._touch(key, e)
+                return e.obj
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # one loader per key; concurrent first callers wait here instead of loading twice
+        with key_lock:
+            with self._lock:
+                e = self._entries.get(key)
+                if e is not None:
+                    self._touch(key, e)
+                    return e.obj
+                self.misses += 1
+            t0 = time.perf_counter()
+            obj = loader()
+            load_s = time.perf_counter() - t0
+            mb = float(size_mb) if size_mb is not None else _estimate_mb(obj)
+            with self._lock:
+                self._entries[key] = _Entry(obj, mb, load_s)
+                self.load_seconds_total += load_s
+                self._evict(keep=key)
+                self._key_locks.pop(key, None)
+            return obj
+
+    def _touch(self, key: Key, e: _Entry):
+        e.hits += 1
+        e.last_used = time.time()
+        self.hits += 1
+        self._entries.move_to_end(key)
+
+    def _evict(self, keep: Key):
+        def over() -> bool:
+            if self.max_entries and len(self._entries) > self.max_entries:
+                return True
+            return bool(self.max_mb) and self.total_mb() > self.max_mb
+        while over() and len(self._entries) > 1:
+            victim = next(k for k in self._entries if k != keep)
+            self._entries.pop(victim)
+            self.evictions += 1
+
+    def total_mb(self) -> float:
+        return sum(e.size_mb for e in self._entries.values())
+
+    def evict(self, kind: str, name: str, compute_type: str = "") -> bool:
+        with self._lock:
+            removed = self._entries.pop((kind, name, compute_type or ""), None) is not None
+            self.explicit_evictions += removed
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self.explicit_evictions += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "explicit_evictions": self.explicit_evictions,
+                "load_seconds_total": round(self.load_seconds_total, 3),
+                "total_mb": round(self.total_mb(), 1),
+                "max_mb": self.max_mb,
+                "max_entries": self.max_entries,
+                "models": [
+                    {"kind": k[0], "name": k[1], "compute_type": k[2], "size_mb": round(e.size_mb, 1),
+                     "load_s": round(e.load_s, 3), "hits": e.hits, "last_used": int(e.last_used)}
+                    for k, e in self._entries.items()
+                ],
+            }
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> ModelRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(
+                    max_entries=int(os.getenv("MODEL_CACHE_MAX_ENTRIES", "8")),
+                    max_mb=float(os.getenv("MODEL_CACHE_MAX_MB", "0")),
+                )
+    return _registry
+
+def warmup(kinds: str = ""):
+    kinds = kinds or os.getenv("WARMUP_MODELS", "")
+    done = []
+    for kind in [k.strip().lower() for k in kinds.split(",") if k.strip()]:
+        try:
+            if kind == "whisper":
+                from server.asr.whisper_local import get_whisper_model
+                get_whisper_model(os.getenv("FASTER_WHISPER_MODEL", "base"))
+            elif kind == "embed":
+                from server.rag.embeddings import build_embedder
+                build_embedder()
+            elif kind == "tts":
+                from server.tts.pyttsx3_tts import get_engine
+                get_engine()
+            else:
+                continue
+            done.append(kind)
+        except Exception as e:
+            log.warning("warmup of %s failed: %s", kind, e)
+    return done
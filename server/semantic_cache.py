@@ -0,0 +1,136 @@
+import os, json, time, hashlib, threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+Scope = Tuple[str, str, int, int, Tuple, str]
+
+class CachedAnswer:
+    __slots__ = ("query", "vec", "pieces", "gen_s", "created", "hits", "audio", "audio_s")
+
+    def __init__(self, query: str, vec: np.ndarray, pieces: List[str], gen_s: float):
+        self.query = query
+        self.vec = vec
+        self.pieces = pieces  # LLM deltas as streamed, so a hit replays the same partials
+        self.gen_s = gen_s
+        self.created = time.time()
+        self.hits = 0
+        self.audio: Dict[str, List[Tuple[str, bytes]]] = {}  # tts backend -> [(segment text, wav)]
+        self.audio_s: Dict[str, float] = {}
+
+    @property
+    def text(self) -> str:
+        return "".join(self.pieces)
+
+class SemanticCache:
+    # answers keyed by query embedding within a scope of (provider, model, kb generation, kb_topk, weights, history)
+    def __init__(self, max_items: int = 1000, ttl: float = 3600.0, threshold: float = 0.95):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[Scope, int], CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+        self.audio_hits = 0
+        self.saved_llm_s = 0.0
+        self.saved_tts_s = 0.0
+        self.saved_chars = 0
+
+    def lookup(self, scope: Scope, vec: np.ndarray) -> Optional[CachedAnswer]:
+        now = time.time()
+        with self._lock:
+            best, best_key, best_sim = None, None, self.threshold
+            for key, e in list(self._entries.items()):
+                if now - e.created > self.ttl:
+                    del self._entries[key]
+                    self.expired += 1
+                    continue
+                if key[0] != scope:
+                    continue
+                sim = float(np.dot(e.vec, vec))
+                if sim >= best_sim:
+                    best, best_key, best_sim = e, key, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            best.hits += 1
+            self.hits += 1
+            self.saved_llm_s += best.gen_s
+            self.saved_chars += len(best.text)
+            return best
+
+    def store(self, scope: Scope, vec: np.ndarray, query: str, pieces: List[str], gen_s: float) -> CachedAnswer:
+        entry = CachedAnswer(query, vec, pieces, gen_s)
+        with self._lock:
+            self._entries[(scope, self._next_id)] = entry
+            self._next_id += 1
+            self.stores += 1
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def audio_hit(self, entry: CachedAnswer, tts: str):
+        with self._lock:
+            self.audio_hits += 1
+            self.saved_tts_s += entry.audio_s.get(tts, 0.0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"items": len(self._entries), "max_items": self.max_items, "threshold": self.threshold,
+                    "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                    "stores": self.stores, "evictions": self.evictions, "expired": self.expired,
+                    "audio_hits": self.audio_hits, "saved_llm_seconds": round(self.saved_llm_s, 3),
+                    "saved_tts_seconds": round(self.saved_tts_s, 3), "saved_chars": self.saved_chars}
+
+def embed_query(text: str) -> np.ndarray:
+    from server.rag.embeddings import build_embedder
+    vec = np.asarray(build_embedder().embed([text])[0], dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm > 0 else vec
+
+def history_key(messages: List[Dict[str, str]]) -> str:
+    # the same question means something else after a different conversation ("why?", "tell me more")
+    raw = json.dumps([(m.get("role", ""), m.get("content", "")) for m in messages], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def cache_scope(provider: str, model: str, kb: bool, kb_topk: int, retrieval: Tuple = (),
+                history: Optional[List[Dict[str, str]]] = None) -> Scope:
+    # answers grounded in the KB are only valid for the generation and retrieval settings they came from
+    hist = history_key(history or [])
+    if not kb:
+        return (provider, model, -1, 0, (), hist)
+    from server.rag.vectorstore import get_store
+    return (provider, model, get_store().generation, kb_topk, retrieval, hist)
+
+_cache: Optional[SemanticCache] = None
+
+def semantic_cache_enabled() -> bool:
+    return os.getenv("SEMANTIC_CACHE", "0") == "1"
+
+def get_semantic_cache() -> SemanticCache:
+    global _cache
+    if _cache is None:
+        _cache = SemanticCache(
+            max_items=int(os.getenv("SEMANTIC_CACHE_MAX_ITEMS", "1000")),
+            ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        )
+    return _cache
+
+def semantic_cache_stats() -> Dict:
+    if _cache is None:
+        return {"enabled": semantic_cache_enabled()}
+    return {"enabled": semantic_cache_enabled(), **_cache.stats()}
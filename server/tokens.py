@@ -0,0 +1,40 @@
+import os, re
+from typing import Optional
+
+# fallback estimate: one token per CJK character or symbol, ~4 characters per ASCII word piece
+_PIECE = re.compile(r"[A-Za-z0-9]+|[^\sA-Za-z0-9]")
+
+_encoding = None
+_loaded = False
+
+def _get_encoding():
+    global _encoding, _loaded
+    if not _loaded:
+        _loaded = True
+        name = os.getenv("TIKTOKEN_ENCODING", "cl100k_base")
+        if name:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(name)
+            except Exception:
+                _encoding = None
+    return _encoding
+
+def estimate_tokens(text: str) -> int:
+    n = 0
+    for m in _PIECE.finditer(text or ""):
+        t = m.group()
+        n += (len(t) + 3) // 4 if t[0].isascii() and t[0].isalnum() else 1
+    return n
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+def tokenizer_name() -> str:
+    enc = _get_encoding()
+    return f"tiktoken:{enc.name}" if enc is not None else "estimate"
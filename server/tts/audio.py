@@ -0,0 +1,120 @@
+import os, json, time, struct, logging, threading, subprocess
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from server.rag.embed_cache import normalize_text
+from .pyttsx3_tts import tts_to_wav_bytes, voice_settings
+
+log = logging.getLogger(__name__)
+
+MIME = {"wav": "audio/wav", "opus": "audio/ogg; codecs=opus", "mp3": "audio/mpeg"}
+
+_FFMPEG_ARGS = {
+    "opus": lambda: ["-c:a", "libopus", "-b:a", os.getenv("TTS_OPUS_BITRATE", "24k"), "-application", "voip", "-f", "ogg"],
+    "mp3": lambda: ["-c:a", "libmp3lame", "-b:a", os.getenv("TTS_MP3_BITRATE", "48k"), "-f", "mp3"],
+}
+
+# per format: (consecutive failures, monotonic time before which encoding is not retried)
+_backoff: Dict[str, Tuple[int, float]] = {}
+_backoff_lock = threading.Lock()
+
+def _failed(fmt: str, reason) -> None:
+    # back off exponentially instead of giving up: the failure may be transient (timeout, load)
+    base = float(os.getenv("TTS_ENCODE_RETRY_S", "30"))
+    with _backoff_lock:
+        n = _backoff.get(fmt, (0, 0.0))[0] + 1
+        delay = min(base * 2 ** (n - 1), float(os.getenv("TTS_ENCODE_RETRY_MAX_S", "600")))
+        _backoff[fmt] = (n, time.monotonic() + delay)
+    log.warning("%s encoding failed (%d in a row), sending wav for %.1fs: %s", fmt, n, delay, reason)
+
+def encode_audio(wav: bytes, fmt: str) -> Tuple[bytes, str]:
+    # -> (data, mime); falls back to WAV when ffmpeg or the codec is unavailable
+    if fmt not in _FFMPEG_ARGS or time.monotonic() < _backoff.get(fmt, (0, 0.0))[1]:
+        return wav, MIME["wav"]
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "wav", "-i", "pipe:0", "-ac", "1"] + _FFMPEG_ARGS[fmt]() + ["pipe:1"]
+    try:
+        proc = subprocess.run(cmd, input=wav, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        _failed(fmt, e)
+        return wav, MIME["wav"]
+    if proc.returncode != 0 or not proc.stdout:
+        lines = proc.stderr.decode("utf-8", "ignore").strip().splitlines()
+        _failed(fmt, lines[-1] if lines else f"exit {proc.returncode}")
+        return wav, MIME["wav"]
+    if fmt in _backoff:
+        with _backoff_lock:
+            if _backoff.pop(fmt, None) is not None:
+                log.info("%s encoding recovered", fmt)
+    return proc.stdout, MIME[fmt]
+
+class TTSAudioCache:
+    def __init__(self, max_mb: float = 64.0):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, str, str], Tuple[bytes, str]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key, data: bytes, mime: str):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[0])
+            self._entries[key] = (data, mime)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"items": len(self._entries), "mb": round(self.bytes / (1024 * 1024), 2),
+                    "max_mb": round(self.max_bytes / (1024 * 1024), 2), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 4) if total else 0.0, "evictions": self.evictions}
+
+_cache: Optional[TTSAudioCache] = None
+
+def get_audio_cache() -> TTSAudioCache:
+    global _cache
+    if _cache is None:
+        _cache = TTSAudioCache(max_mb=float(os.getenv("TTS_CACHE_MB", "64")))
+    return _cache
+
+def synthesize(text: str, fmt: str = "wav") -> Tuple[bytes, str]:
+    # -> (encoded audio, mime), cached by (voice, rate, format, normalized text)
+    voice, rate = voice_settings()
+    norm = normalize_text(text)
+    key = (voice, rate, fmt, norm)
+    cache = get_audio_cache() if os.getenv("TTS_CACHE", "1") == "1" else None
+    if cache is not None:
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+    data, mime = encode_audio(tts_to_wav_bytes(norm), fmt)
+    # a WAV fallback is not cached under the opus/mp3 key, so it is re-encoded once ffmpeg recovers
+    if cache is not None and data and mime == MIME.get(fmt):
+        cache.put(key, data, mime)
+    return data, mime
+
+def pack_frame(header: Dict, data: bytes) -> bytes:
+    # binary WS frame: u32 big-endian header length, UTF-8 JSON header, then the audio bytes
+    head = json.dumps(header).encode("utf-8")
+    return struct.pack(">I", len(head)) + head + data
+
+def tts_audio_stats() -> Dict:
+    return get_audio_cache().stats() if _cache is not None else {}
@@ -1,10 +1,37 @@
-import tempfile, pyttsx3
+import os, tempfile, threading, pyttsx3
+from server.registry import get_registry
 
-def tts_to_wav_bytes(text: str) -> bytes:
+# pyttsx3 engines are not re-entrant; one synthesis at a time per engine
+_engine_lock = threading.Lock()
+
+def voice_settings():
+    return os.getenv("TTS_VOICE", ""), os.getenv("TTS_RATE", "")
+
+def _init_engine():
     engine = pyttsx3.init()
+    voice, rate = voice_settings()
+    if voice:
+        engine.setProperty("voice", voice)
+    if rate:
+        engine.setProperty("rate", int(rate))
+    return engine
+
+def get_engine():
+    voice, rate = voice_settings()
+    return get_registry().get("tts", "pyttsx3", f"{voice}:{rate}", _init_engine, size_mb=float(os.getenv("TTS_ENGINE_MB", "20")))
+
+def tts_to_wav_bytes(text: str) -> bytes:
+    engine = get_engine()
     with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
         tmp = f.name
-    engine.save_to_file(text, tmp)
-    engine.runAndWait()
-    with open(tmp, "rb") as rf:
-        return rf.read()
+    try:
+        with _engine_lock:
+            engine.save_to_file(text, tmp)
+            engine.runAndWait()
+        with open(tmp, "rb") as rf:
+            return rf.read()
+    finally:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
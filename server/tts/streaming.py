@@ -0,0 +1,106 @@
+import re, asyncio, logging
+from typing import Awaitable, Callable, List, Optional, Set
+from server.executors import run_in
+
+log = logging.getLogger(__name__)
+
+# 。！？；… and newlines always end a segment; English .!?; only when followed by whitespace
+# so "3.14" and "v0.6" stay intact. Clause marks split only once a segment is long enough.
+_STRONG = re.compile(r"[。！？；…\n]+|[.!?;]+(?=\s)")
+_CLAUSE = re.compile(r"[，、：]+|[,:]+(?=\s)")
+
+class SentenceSegmenter:
+    def __init__(self, first_min_chars: int = 4, min_chars: int = 8, clause_chars: int = 24, max_chars: int = 120):
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.clause_chars = clause_chars
+        self.max_chars = max_chars
+        self._buf = ""
+        self._emitted = 0
+
+    def _cut(self) -> Optional[int]:
+        # the first segment is allowed to be short: it decides time-to-first-audio
+        min_chars = self.first_min_chars if self._emitted == 0 else self.min_chars
+        for m in _STRONG.finditer(self._buf):
+            if len(self._buf[:m.end()].strip()) >= min_chars:
+                return m.end()
+        clause_at = self.first_min_chars * 3 if self._emitted == 0 else self.clause_chars
+        if len(self._buf) >= clause_at:
+            cut = None
+            for m in _CLAUSE.finditer(self._buf):
+                if len(self._buf[:m.end()].strip()) >= min_chars:
+                    cut = m.end()
+            if cut is not None:
+                return cut
+        if len(self._buf) >= self.max_chars:
+            space = self._buf.rfind(" ", 0, self.max_chars)
+            return space + 1 if space > self.max_chars // 2 else self.max_chars
+        return None
+
+    def feed(self, text: str) -> List[str]:
+        self._buf += text
+        out = []
+        while True:
+            cut = self._cut()
+            if cut is None:
+                break
+            seg, self._buf = self._buf[:cut].strip(), self._buf[cut:]
+            if seg:
+                out.append(seg)
+                self._emitted += 1
+        return out
+
+    def flush(self) -> List[str]:
+        seg, self._buf = self._buf.strip(), ""
+        return [seg] if seg else []
+
+class StreamingTTS:
+    # synthesizes segments on a worker pool as they arrive and delivers them strictly in order
+    # a segment whose synthesis fails is skipped: logged and reported through on_skip(seq, text, error)
+    def __init__(self, synth: Callable[[str], bytes], send: Callable[[int, str, bytes], Awaitable[None]],
+                 on_skip: Optional[Callable[[int, str, Exception], Awaitable[None]]] = None):
+        self.synth = synth
+        self.send = send
+        self.on_skip = on_skip
+        self.seq = 0
+        self.skipped = 0
+        self._queue: "asyncio.Queue" = asyncio.Queue()
+        self._futs: Set[asyncio.Future] = set()
+        self._sender = asyncio.create_task(self._drain())
+
+    def push(self, text: str):
+        fut = asyncio.ensure_future(run_in("tts", self.synth, text))
+        self._futs.add(fut)
+        fut.add_done_callback(self._futs.discard)
+        self._queue.put_nowait((self.seq, text, fut))
+        self.seq += 1
+
+    async def _drain(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            seq, text, fut = item
+            try:
+                audio = await fut
+            except Exception as e:
+                self.skipped += 1
+                log.warning("TTS failed for segment %d (%r), skipping it: %s", seq, text[:40], e)
+                if self.on_skip is not None:
+                    await self.on_skip(seq, text, e)
+                continue
+            if audio:
+                await self.send(seq, text, audio)
+
+    async def finish(self) -> int:
+        self._queue.put_nowait(None)
+        await self._sender
+        return self.seq
+
+    def cancel(self):
+        # includes the segment _drain is currently waiting on, which is no longer in the queue
+        self._sender.cancel()
+        for fut in list(self._futs):
+            fut.cancel()
+        while not self._queue.empty():
+            self._queue.get_nowait()
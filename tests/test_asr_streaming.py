@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faster_whisper")
+from server.asr.streaming import SAMPLE_RATE, StreamingTranscriber
+
+def _pcm(seconds, amplitude, freq=220.0):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * freq * t) * amplitude * 32767).astype("<i2").tobytes()
+
+def _silence(seconds):
+    return _pcm(seconds, 0.0)
+
+def test_speech_then_silence_ends_the_utterance(monkeypatch):
+    monkeypatch.setenv("ASR_ENDPOINT_SILENCE_MS", "400")
+    asr = StreamingTranscriber()
+    assert asr.feed(_silence(0.5)) == []
+    events = asr.feed(_pcm(1.0, 0.3))
+    assert events[0] == "start"
+    assert "end" not in asr.feed(_silence(0.3))
+    assert asr.feed(_silence(0.2))[-1] == "end"
+    # preroll + speech + the silence it took to decide
+    assert 1.5 <= len(asr.utterance_audio()) / SAMPLE_RATE <= 2.0
+
+def test_audio_after_the_endpoint_starts_the_next_utterance():
+    asr = StreamingTranscriber()
+    events = asr.feed(_pcm(0.6, 0.3) + _silence(0.8) + _pcm(0.6, 0.3))
+    assert events[0] == "start" and events[-1] == "end"
+    assert asr.feed(b"")[0] == "start"
+
+def test_steady_loud_noise_is_cut_at_the_utterance_cap(monkeypatch):
+    monkeypatch.setenv("ASR_MAX_UTTER_S", "3")
+    asr = StreamingTranscriber()
+    noise = (np.random.default_rng(0).standard_normal(SAMPLE_RATE * 4) * 0.2 * 32767).astype("<i2").tobytes()
+    events = asr.feed(noise)
+    assert events[0] == "start" and events[-1] == "end"
+    assert len(asr.utterance_audio()) <= 3 * SAMPLE_RATE + 320
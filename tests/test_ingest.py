@@ -0,0 +1,57 @@
+from server.rag.ingest import chunk_blocks
+
+PROCEDURE = """# 用户手册
+
+## 重置密码
+
+如果忘记密码，请按以下步骤操作：
+
+1. 打开设置
+2. 点击账户与安全
+3. 选择重置密码并按提示完成验证
+
+一、注意事项
+
+重置后所有设备需要重新登录。
+"""
+
+def _chunks(text, max_tokens=400, overlap_tokens=60):
+    return list(chunk_blocks([(None, text)], max_tokens, overlap_tokens))
+
+def test_numbered_procedure_survives_chunking():
+    text = "\n".join(c["text"] for c in _chunks(PROCEDURE))
+    for step in ("1. 打开设置", "2. 点击账户与安全", "3. 选择重置密码并按提示完成验证", "一、注意事项"):
+        assert step in text
+
+def test_list_items_are_not_headings():
+    for c in _chunks(PROCEDURE):
+        assert c["meta"]["heading"] == "用户手册 > 重置密码"
+
+def test_heading_breadcrumb_is_in_chunk_text():
+    chunks = _chunks(PROCEDURE, max_tokens=60, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert all(c["text"].startswith("用户手册 > 重置密码\n") for c in chunks)
+    assert all(c["meta"]["tokens"] <= 60 for c in chunks)
+
+def test_pdf_page_headings_get_a_heading_path():
+    pages = [
+        (1, "User Guide\nIntro text that explains the product.\nBody text ends here."),
+        (2, "Chapter 2 Setup\nInstall the app.\nOpen it once"),
+        (3, "before signing in.\n第三章 安装\n安装应用。"),
+        (4, "第四章 维护\n定期清洁设备。"),
+    ]
+    chunks = list(chunk_blocks(pages, 400, 60))
+    paths = [c["meta"].get("heading_path") for c in chunks]
+    assert paths == [["User Guide"], ["Chapter 2 Setup"], ["第四章 维护"]]
+    # a paragraph that runs over a page break stays one sentence
+    assert "Open it once before signing in." in chunks[1]["text"]
+    # a heading inside a page still needs a blank line after it
+    assert "第三章 安装" in chunks[1]["text"]
+
+def test_unbroken_run_splits_quickly():
+    import time
+    t = time.perf_counter()
+    chunks = list(chunk_blocks([(None, "x" * 200000)], 400, 60))
+    assert time.perf_counter() - t < 5
+    assert sum(len(c["text"]) for c in chunks) == 200000
+    assert all(c["meta"]["tokens"] <= 400 for c in chunks)
@@ -0,0 +1,73 @@
+import time, asyncio
+from server.providers.base import LLMProvider
+from server.providers.routing import Backend, RoutingProvider
+
+class _Fake(LLMProvider):
+    def __init__(self, label, fail=False, delay=0.0):
+        self.label = label
+        self.fail = fail
+        self.delay = delay
+        self.calls = 0
+
+    def name(self):
+        return self.label
+
+    def stream_chat(self, messages, model, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError(f"{self.label} down")
+        yield from (f"{self.label}:", "ok")
+
+    async def astream_chat(self, messages, model, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError(f"{self.label} down")
+        for piece in (f"{self.label}:", "ok"):
+            yield piece
+
+def _router(*providers, **kw):
+    return RoutingProvider([Backend(p, "m", 0.3) for p in providers], **kw)
+
+def _chat(router):
+    async def run():
+        return "".join([p async for p in router.astream_chat([{"role": "user", "content": "hi"}], "m")])
+    return asyncio.run(run())
+
+def test_fails_over_to_the_next_backend():
+    a, b = _Fake("a", fail=True), _Fake("b")
+    router = _router(a, b, fail_threshold=3)
+    assert _chat(router) == "b:ok"
+    assert "".join(router.stream_chat([], "m")) == "b:ok"
+    stats = router.stats()["backends"]
+    assert stats["a/m"]["errors"] == 2 and stats["a/m"]["state"] == "closed"
+    assert stats["b/m"]["wins"] == 2
+
+def test_circuit_opens_then_recovers_through_one_probe():
+    a, b = _Fake("a", fail=True), _Fake("b")
+    router = _router(a, b, fail_threshold=2, cooldown_s=0.05)
+    _chat(router)
+    _chat(router)
+    assert router.backends[0].stats.state() == "open"
+    calls = a.calls
+    _chat(router)
+    assert a.calls == calls  # skipped while open
+
+    time.sleep(0.06)
+    assert router.backends[0].stats.state() == "half_open"
+    _chat(router)  # the probe fails: open again for another cooldown
+    assert router.backends[0].stats.state() == "open" and a.calls == calls + 1
+
+    time.sleep(0.06)
+    a.fail = False
+    assert _chat(router) == "a:ok"
+    assert router.backends[0].stats.state() == "closed"
+
+def test_hedge_races_a_late_backend():
+    slow, fast = _Fake("slow", delay=0.3), _Fake("fast")
+    router = _router(slow, fast, hedge_ms=20)
+    assert _chat(router) == "fast:ok"
+    assert router.hedges == 1 and router.hedge_wins == 1
+    # the loser never produced a token, so its estimate is at least the hedge delay
+    assert router.backends[0].stats.ttft >= 0.02
+    assert router.ranked()[0] is router.backends[1]
@@ -0,0 +1,30 @@
+from server.tts.streaming import SentenceSegmenter
+
+def _segments(text, step=None, **kw):
+    seg, out = SentenceSegmenter(**kw), []
+    step = step or len(text)
+    for i in range(0, len(text), step):
+        out += seg.feed(text[i:i + step])
+    return out + seg.flush()
+
+def test_splits_on_sentence_ends_regardless_of_token_size():
+    text = "好的。我来帮你查一下保修政策。根据手册，产品享受两年保修；人为损坏除外！"
+    want = ["好的。我来帮你查一下保修政策。", "根据手册，产品享受两年保修；", "人为损坏除外！"]
+    assert _segments(text) == want
+    assert _segments(text, step=1) == want
+
+def test_decimals_and_versions_stay_whole():
+    assert _segments("Version v0.6 costs 3.14 dollars. It ships today! Really?") == \
+        ["Version v0.6 costs 3.14 dollars.", "It ships today!", "Really?"]
+
+def test_long_clauses_split_at_commas():
+    text = "这是一段很长的说明文字，没有句号但是有很多逗号，所以需要在逗号处切开，否则首个音频会来得太晚"
+    out = _segments(text, step=1)
+    assert len(out) > 1 and "".join(out) == text
+    assert all(s.endswith("，") for s in out[:-1])
+
+def test_unpunctuated_text_is_cut_at_max_chars_on_a_space():
+    out = _segments("word " * 40, step=3, max_chars=120)
+    assert len(out) == 2
+    assert all(len(s) <= 120 and not s.endswith("wor") for s in out)
+    assert " ".join(out).split() == ["word"] * 40
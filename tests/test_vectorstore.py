@@ -0,0 +1,81 @@
+import hashlib
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("faiss")
+from server.rag.vectorstore import VectorStore, doc_id_for
+
+class _Embedder:
+    def embed(self, texts):
+        out = []
+        for t in texts:
+            seed = int.from_bytes(hashlib.sha1(t.encode("utf-8")).digest()[:8], "little")
+            out.append(np.random.default_rng(seed).standard_normal(32))
+        return np.asarray(out, dtype=np.float32)
+
+E = _Embedder()
+
+def _chunks(*texts):
+    return [{"text": t, "meta": {}} for t in texts]
+
+def _top(store, text):
+    q = E.embed([text])
+    q /= np.linalg.norm(q)
+    hits = store.search(q, 1)
+    return hits[0]["text"] if hits else None
+
+def _texts(store):
+    snap = store.snapshot()
+    return sorted(snap.meta.text(r) for d in snap.docs.values() for r in d["chunks"].values())
+
+def test_upsert_update_delete_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv("KB_RELOAD_INTERVAL", "0")
+    store = VectorStore(str(tmp_path))
+    store.upsert({"a.txt": _chunks("alpha one", "alpha two"), "b.txt": _chunks("beta one")}, E)
+    assert store.upsert({"a.txt": _chunks("alpha one", "alpha two")}, E)["unchanged_docs"] == 1
+
+    stats = store.upsert({"a.txt": _chunks("alpha one", "alpha three")}, E)
+    assert (stats["added_chunks"], stats["removed_chunks"]) == (1, 1)
+    other = VectorStore(str(tmp_path))
+    for s in (store, other):
+        assert _texts(s) == ["alpha one", "alpha three", "beta one"]
+        assert _top(s, "alpha three") == "alpha three"
+        assert _top(s, "alpha two") != "alpha two"
+
+    assert other.delete_doc(doc_id_for("b.txt")) == 1
+    assert store.delete_doc("missing") == -1
+    for s in (store, VectorStore(str(tmp_path))):
+        assert _texts(s) == ["alpha one", "alpha three"]
+        assert _top(s, "beta one") != "beta one"
+        assert [h["text"] for h in s.search(None, 5, query="beta", lexical_weight=1.0)] == []
+
+def test_writes_are_logged_until_a_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setenv("KB_DELTA_MIN", "4")
+    store = VectorStore(str(tmp_path))
+    store.upsert({"seed.txt": _chunks("seed")}, E)
+    index_written = (tmp_path / "index.faiss").stat().st_mtime_ns
+    for i in range(3):
+        store.upsert({f"{i}.txt": _chunks(f"doc {i}")}, E)
+    assert (tmp_path / "index.faiss").stat().st_mtime_ns == index_written
+    assert store.snapshot().rows - store.snapshot().base_rows == 3
+    reopened = VectorStore(str(tmp_path))
+    assert _texts(reopened) == _texts(store)
+    assert _top(reopened, "doc 2") == "doc 2"
+
+    store.upsert({"big.txt": _chunks(*(f"big {i}" for i in range(5)))}, E)
+    snap = store.snapshot()
+    assert snap.base_rows == snap.rows and snap.index.ntotal == snap.rows
+    assert (tmp_path / "changes.log").read_text().count("\n") == 1
+
+def test_compaction_renumbers_rows(tmp_path, monkeypatch):
+    monkeypatch.setenv("KB_META_COMPACT_MIN", "2")
+    store = VectorStore(str(tmp_path))
+    store.upsert({"a.txt": _chunks("a1", "a2", "a3"), "b.txt": _chunks("b1", "b2")}, E)
+    store.delete_doc(doc_id_for("a.txt"))
+    snap = store.snapshot()
+    assert snap.meta.epoch == 1 and snap.rows == 2 and not snap.deleted
+    assert sorted(snap.docs[doc_id_for("b.txt")]["chunks"].values()) == [0, 1]
+    for s in (store, VectorStore(str(tmp_path))):
+        assert _texts(s) == ["b1", "b2"]
+        assert _top(s, "b2") == "b2"
@@ -2,6 +2,7 @@ const log = document.getElementById('log');
 const input = document.getElementById('text');
 const sendBtn = document.getElementById('send');
 const recordBtn = document.getElementById('record');
+const streamBtn = document.getElementById('stream');
 const applyBtn = document.getElementById('apply');
 const resetBtn = document.getElementById('reset');
 const providerSel = document.getElementById('provider');
@@ -19,29 +20,52 @@ let ws;
 let mediaRecorder;
 let chunks = [];
 let currentBotDiv = null;
+let liveDiv = null;
+let audioTurn = -1;
+let audioNext = 0;
+let audioPending = new Map();
+let audioPlaying = false;
+let streamCtx = null;
+let streamSrc = null;
+let streamNode = null;
 
 function ensureWS() {
   if (ws && ws.readyState === WebSocket.OPEN) return;
   ws = new WebSocket(`${location.origin.replace('http', 'ws')}/ws`);
+  ws.binaryType = 'arraybuffer';
+  ws.addEventListener('open', () => {
+    ws.send(JSON.stringify({ type: 'config', audio_format: audioFormat, audio_binary: true }));
+  });
   ws.addEventListener('message', (evt) => {
+    if (evt.data instanceof ArrayBuffer) {
+      enqueueAudio(unpackAudioFrame(evt.data));
+      return;
+    }
     const data = JSON.parse(evt.data);
     if (data.type === 'info' || data.type === 'status') {
       addMsg('系统', data.msg, 'info');
     } else if (data.type === 'error') {
       addMsg('错误', data.msg, 'info');
+    } else if (data.type === 'speech_start') {
+      showLiveTranscript('…');
+    } else if (data.type === 'partial_transcript') {
+      showLiveTranscript(data.text);
     } else if (data.type === 'transcript') {
+      clearLiveTranscript();
       addMsg('我', data.text, 'user');
     } else if (data.type === 'partial') {
       appendBotPartial(data.text);
     } else if (data.type === 'final') {
       finishBotMessage(data.text);
     } else if (data.type === 'audio_chunk') {
-      const b64 = data.data;
-      const buf = base64ToArrayBuffer(b64);
-      const blob = new Blob([buf], { type: data.mime || 'audio/wav' });
-      const url = URL.createObjectURL(blob);
-      player.src = url;
-      player.play();
+      enqueueAudio(data);
+    } else if (data.type === 'turn_cancelled') {
+      stopAudio();
+      if (currentBotDiv) finishBotMessage(currentBotDiv.textContent.replace(/^助手: /, '') + ' …');
+    } else if (data.type === 'audio_skipped') {
+      console.warn(`[tts] skipped segment ${data.seq}: ${data.error}`);
+    } else if (data.type === 'timings') {
+      console.debug(`[timings] turn ${data.turn}`, data.ms);
     }
   });
 }
@@ -72,6 +96,72 @@ function finishBotMessage(finalText) {
   log.scrollTop = log.scrollHeight;
 }
 
+function showLiveTranscript(text) {
+  if (!liveDiv) {
+    liveDiv = document.createElement('div');
+    liveDiv.className = 'msg user live';
+    log.appendChild(liveDiv);
+  }
+  liveDiv.textContent = `我（识别中）: ${text}`;
+  log.scrollTop = log.scrollHeight;
+}
+
+function clearLiveTranscript() {
+  if (liveDiv) liveDiv.remove();
+  liveDiv = null;
+}
+
+// Prefer compressed audio the browser can play; the server falls back to WAV without ffmpeg.
+const audioFormat = player.canPlayType('audio/ogg; codecs=opus') ? 'opus'
+  : (player.canPlayType('audio/mpeg') ? 'mp3' : 'wav');
+
+// Binary audio frame: u32 big-endian header length, JSON header, then the encoded audio.
+function unpackAudioFrame(buf) {
+  const headLen = new DataView(buf).getUint32(0);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 4, headLen)));
+  header.bytes = buf.slice(4 + headLen);
+  return header;
+}
+
+// Sentence-level audio arrives as ordered chunks (turn, seq); play them back to back.
+function enqueueAudio(data) {
+  const turn = data.turn ?? audioTurn;
+  if (turn < audioTurn) return;
+  if (turn > audioTurn) {
+    stopAudio();
+    audioTurn = turn;
+  }
+  audioPending.set(data.seq ?? audioNext, data);
+  if (!audioPlaying) playNextAudio();
+}
+
+function playNextAudio() {
+  const data = audioPending.get(audioNext);
+  if (!data) {
+    audioPlaying = false;
+    return;
+  }
+  audioPending.delete(audioNext);
+  audioNext += 1;
+  audioPlaying = true;
+  const bytes = data.bytes || base64ToArrayBuffer(data.data);
+  const blob = new Blob([bytes], { type: data.mime || 'audio/wav' });
+  player.src = URL.createObjectURL(blob);
+  player.play().catch(() => playNextAudio());
+}
+
+function stopAudio() {
+  player.pause();
+  audioPending.clear();
+  audioNext = 0;
+  audioPlaying = false;
+}
+
+player.addEventListener('ended', () => {
+  URL.revokeObjectURL(player.src);
+  playNextAudio();
+});
+
 function base64ToArrayBuffer(base64) {
   const binary_string = window.atob(base64);
   const len = binary_string.length;
@@ -89,7 +179,9 @@ applyBtn.addEventListener('click', () => {
     asr: asrSel.value,
     tts: ttsSel.value,
     kb: kbChk.checked,
-    kb_topk: Number(kbTopkInput.value || 4)
+    kb_topk: Number(kbTopkInput.value || 4),
+    audio_format: audioFormat,
+    audio_binary: true
   };
   ws.send(JSON.stringify(msg));
 });
@@ -132,6 +224,48 @@ recordBtn.addEventListener('click', async () => {
   }
 });
 
+// Streaming mode: 16 kHz mono PCM16 frames as binary WebSocket messages; the server endpoints speech itself.
+streamBtn.addEventListener('click', async () => {
+  ensureWS();
+  if (streamCtx) {
+    stopStreaming();
+    return;
+  }
+  const stream = await navigator.mediaDevices.getUserMedia({ audio: { channelCount: 1, echoCancellation: true, noiseSuppression: true } });
+  streamCtx = new AudioContext({ sampleRate: 16000 });
+  streamSrc = streamCtx.createMediaStreamSource(stream);
+  streamNode = streamCtx.createScriptProcessor(2048, 1, 1);
+  streamNode.onaudioprocess = (e) => {
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+    ws.send(floatToPCM16(e.inputBuffer.getChannelData(0), streamCtx.sampleRate));
+  };
+  streamSrc.connect(streamNode);
+  streamNode.connect(streamCtx.destination);
+  streamBtn.textContent = '■ 结束实时对话';
+});
+
+function stopStreaming() {
+  streamSrc.mediaStream.getTracks().forEach((t) => t.stop());
+  streamNode.disconnect();
+  streamSrc.disconnect();
+  streamCtx.close();
+  streamCtx = streamSrc = streamNode = null;
+  if (ws && ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'audio_end' }));
+  streamBtn.textContent = '🎙 实时对话';
+}
+
+function floatToPCM16(input, rate) {
+  // resample if the browser ignored the requested 16 kHz context rate
+  const ratio = rate / 16000;
+  const n = Math.floor(input.length / ratio);
+  const out = new Int16Array(n);
+  for (let i = 0; i < n; i++) {
+    const s = Math.max(-1, Math.min(1, input[Math.floor(i * ratio)]));
+    out[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
+  }
+  return out.buffer;
+}
+
 function blobToBase64(blob) {
   return new Promise((resolve, reject) => {
     const reader = new FileReader();
@@ -156,12 +290,35 @@ ingestBtn.addEventListener('click', async () => {
   try {
     const resp = await fetch('/api/kb/ingest', { method: 'POST', body: form });
     const data = await resp.json();
-    if (data.ok) ingestStatus.textContent = `已导入分片：${data.added_chunks}`;
-    else ingestStatus.textContent = '导入失败';
+    if (!data.ok) {
+      ingestStatus.textContent = `导入失败：${data.error || resp.status}`;
+      return;
+    }
+    watchIngestJob(data.job_id);
   } catch (e) {
     ingestStatus.textContent = '网络错误';
   }
 });
 
+function watchIngestJob(jobId) {
+  const es = new EventSource(`/api/kb/jobs/${jobId}/events`);
+  es.onmessage = (evt) => {
+    const job = JSON.parse(evt.data);
+    if (job.status === 'done') {
+      const r = job.result || {};
+      ingestStatus.textContent = `新增分片：${r.added_chunks}，移除：${r.removed_chunks}，未变化文档：${r.unchanged_docs}`;
+      es.close();
+    } else if (job.status === 'failed') {
+      ingestStatus.textContent = `导入失败：${job.error}`;
+      es.close();
+    } else if (job.stage === 'ingesting') {
+      ingestStatus.textContent = `导入中：文件 ${job.files_done}/${job.files_total}，已向量化分片 ${job.chunks_embedded}/${job.chunks_total}...`;
+    } else {
+      ingestStatus.textContent = '排队中...';
+    }
+  };
+  es.onerror = () => { es.close(); };
+}
+
 // init
 ensureWS();